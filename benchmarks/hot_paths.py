@@ -0,0 +1,312 @@
+"""Latency, query count and peak memory of the hot paths, as JSON.
+
+Creates a throwaway test database and starts a local stand-in for Google
+Books, which replays the recorded volumes of fixtures/volumes.json and
+serves generated covers. Then measures:
+
+- search/google: Search end to end with a query unknown locally, so
+  Google Books is asked (no cached response) and the volumes are ingested.
+- search/local: Search answered from the local catalog.
+- enrichment: one pending enrichment job, e.g. mirroring a cover.
+- list/<size>, list/<size>/cached: the first page of OwnedBookList for a
+  library of each size, rendered from scratch and from the page cache.
+- edit: htmx saves of OwnedBookEdit.
+- admin/<model>, admin/<model>/search: the admin changelists with the
+  largest library.
+
+Timings are percentiles over ``--repeat`` requests, queries the most any
+single request ran. Peak memory comes from one extra request per scenario
+under tracemalloc, which would skew the timings otherwise.
+
+Usage:
+
+    python -m benchmarks.hot_paths [--sizes 10 1000 10000 50000] [--repeat 20]
+        [--output results.json] [--baseline previous.json]
+
+With ``--baseline``, scenarios whose p50 grew by more than ``--threshold``
+or that run more queries than in the baseline are reported on stderr and
+the exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import django
+
+from benchmarks.render import create_library  # Sets up Django.
+from benchmarks.thumbnail_probe import make_image
+
+from django.core.cache import caches  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse  # noqa: E402
+
+from books.enrichment import run_pending_jobs  # noqa: E402
+from books.models import OwnedBook, User  # noqa: E402
+from books.page_cache import evict_user_pages  # noqa: E402
+
+FIXTURE = Path(__file__).parent / "fixtures" / "volumes.json"
+COVER_SIZE = (128, 192)
+ADMIN_MODELS = ("book", "ownedbook", "author", "publisher")
+
+
+def serve_google_books(recorded):
+    """Start the stand-in for Google Books, return the server.
+
+    Each query gets the recorded volumes with ISBNs unique to the query, so
+    that a new query ingests new Books like a real one would. ISBN queries
+    get the volume back with the ISBN asked for. Covers point to the server.
+    """
+    covers = {}
+    covers_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path.startswith("/covers/"):
+                with covers_lock:
+                    if url.path not in covers:
+                        covers[url.path] = make_image("JPEG", COVER_SIZE)
+                self.respond(covers[url.path], "image/jpeg")
+            else:
+                query = parse_qs(url.query).get("q", [""])[0]
+                data = self.replay(query, f"http://{self.headers['Host']}")
+                self.respond(json.dumps(data).encode(), "application/json")
+
+        def replay(self, query, base_url):
+            isbn = query[len("isbn:") :] if query.startswith("isbn:") else None
+            volumes = json.loads(json.dumps(recorded["items"]))
+            for i, volume in enumerate(volumes):
+                volume_info = volume["volumeInfo"]
+                for identifier in volume_info.get("industryIdentifiers", []):
+                    identifier["identifier"] = (
+                        isbn
+                        or f"{identifier['identifier']}-{zlib.crc32(query.encode())}"
+                    )
+                if "imageLinks" in volume_info:
+                    volume_info["imageLinks"] = {
+                        "thumbnail": f"{base_url}/covers/{volume['id']}-{i}.jpg"
+                    }
+            if isbn:
+                volumes = volumes[:1]
+            return {**recorded, "totalItems": len(volumes), "items": volumes}
+
+        def respond(self, data, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(request, repeat, prepare=lambda i: None):
+    """Run ``request(i)`` ``repeat`` times plus once under tracemalloc.
+
+    ``prepare(i)`` runs before each request, outside of the measurement.
+    """
+    timings = []
+    num_queries = 0
+    for i in range(repeat):
+        prepare(i)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            request(i)
+            timings.append(time.perf_counter() - start)
+        num_queries = max(num_queries, len(queries))
+
+    prepare(repeat)
+    tracemalloc.start()
+    try:
+        request(repeat)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    percentiles = statistics.quantiles(
+        [timing * 1000 for timing in timings], n=100, method="inclusive"
+    )
+    return {
+        "requests": repeat,
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        "queries": num_queries,
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+    }
+
+
+def get(client, url, status=200, **extra):
+    response = client.get(url, **extra)
+    assert response.status_code == status, (url, response.status_code)
+    return response
+
+
+def benchmark_search(client, repeat):
+    def forget_google_books(i):
+        caches["google_books"].clear()
+
+    return {
+        # The query is new every time, nothing local matches it.
+        "search/google": measure(
+            lambda i: get(client, f"/search?title=unknown{i}"),
+            repeat,
+            prepare=forget_google_books,
+        ),
+        # Every replay ingested another "Dune".
+        "search/local": measure(lambda i: get(client, "/search?title=dune"), repeat),
+        "enrichment": measure(lambda i: run_pending_jobs(limit=1), repeat),
+    }
+
+
+def benchmark_list(client, user, size, repeat):
+    def forget_pages(i):
+        caches["template_fragments"].clear()
+        evict_user_pages([user.id])
+
+    create_library(user, size)
+    return {
+        f"list/{size}": measure(
+            lambda i: get(client, "/books"), repeat, prepare=forget_pages
+        ),
+        f"list/{size}/cached": measure(lambda i: get(client, "/books"), repeat),
+    }
+
+
+def benchmark_edit(client, user, repeat):
+    ownedbook = OwnedBook.objects.filter(user=user).first()
+    url = reverse("ownedbook-edit", args=(ownedbook.id,))
+
+    def save(i):
+        response = client.post(
+            url,
+            {
+                "progress": (
+                    OwnedBook.ReadStates.FULLY_READ
+                    if i % 2
+                    else OwnedBook.ReadStates.UNREAD
+                ),
+                "rating": 1 + i % 5,
+                "review": f"Review {i}",
+            },
+            HTTP_HX_REQUEST="true",
+        )
+        assert response.status_code == 302, response.status_code
+
+    return {"edit": measure(save, repeat)}
+
+
+def benchmark_admin(client, repeat):
+    results = {}
+    for model in ADMIN_MODELS:
+        url = reverse(f"admin:books_{model}_changelist")
+        results[f"admin/{model}"] = measure(lambda i: get(client, url), repeat)
+        if model != "ownedbook":
+            results[f"admin/{model}/search"] = measure(
+                lambda i: get(client, f"{url}?q=Book%2012"), repeat
+            )
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        if result["p50_ms"] > previous["p50_ms"] * (1 + threshold):
+            yield f"{name}: p50 {previous['p50_ms']} ms -> {result['p50_ms']} ms"
+        if result["queries"] > previous["queries"]:
+            yield f"{name}: {previous['queries']} -> {result['queries']} queries"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 1000, 10000, 50000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    parser.add_argument("--baseline", type=argparse.FileType("r"))
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = serve_google_books(json.loads(FIXTURE.read_text()))
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with (
+            tempfile.TemporaryDirectory() as media_root,
+            override_settings(
+                GOOGLE_BOOKS_BASE_URL=f"http://127.0.0.1:{server.server_port}/books/v1/volumes",
+                MEDIA_ROOT=media_root,
+                PERFORMANCE_SAMPLE_RATE=0,
+                GOOGLE_BOOKS_RATE_LIMIT=1000,
+                GOOGLE_BOOKS_RATE_LIMIT_BURST=1000,
+            ),
+        ):
+            user = User.objects.create_superuser("benchmark")
+            client = Client()
+            client.force_login(user)
+
+            results = benchmark_search(client, args.repeat)
+            for size in sorted(args.sizes):
+                results.update(benchmark_list(client, user, size, args.repeat))
+            results.update(benchmark_edit(client, user, args.repeat))
+            results.update(benchmark_admin(client, args.repeat))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        server.shutdown()
+
+    json.dump(
+        {
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "sizes": sorted(args.sizes),
+                "repeat": args.repeat,
+            },
+            "results": results,
+        },
+        args.output,
+        indent=2,
+    )
+    args.output.write("\n")
+
+    if args.baseline:
+        regressions = list(
+            find_regressions(results, json.load(args.baseline), args.threshold)
+        )
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
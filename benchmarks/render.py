@@ -0,0 +1,132 @@
+"""HTML size and render time of the Owned Books grid against library size.
+
+Creates a throwaway test database, gives a user libraries of increasing
+size and renders the whole library as one page (OWNED_BOOKS_PAGE_SIZE is
+raised to the library size). Reports raw, minified and gzipped bytes and
+the median response time without any cache, with cached tiles only (as
+after an eviction) and with the cached page.
+
+Usage:
+
+    python -m benchmarks.render [--sizes 100 1000 5000] [--repeat 5]
+"""
+
+import argparse
+import gzip
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "booksread.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from books.models import Author, Book, OwnedBook, Publisher, User  # noqa: E402
+from books.page_cache import evict_user_pages  # noqa: E402
+
+# What to forget before each request.
+CACHE_STATES = {
+    "cold": lambda user: (
+        caches["template_fragments"].clear(),
+        evict_user_pages([user.id]),
+    ),
+    "tiles": lambda user: evict_user_pages([user.id]),
+    "cached": lambda user: None,
+}
+
+
+def create_library(user, size):
+    OwnedBook.objects.filter(user=user).delete()
+    publisher, _ = Publisher.objects.get_or_create(name="Penguin")
+    authors = [
+        Author.objects.get_or_create(full_name=f"Author {i}")[0] for i in range(3)
+    ]
+    books = Book.objects.bulk_create(
+        [
+            Book(
+                title=f"Book {i:06d}",
+                isbn=f"bench-{size}-{i}",
+                publisher=publisher,
+                description=f"Description {i}",
+                thumbnail_url=f"https://img/{i}.jpg" if i % 2 else None,
+                thumbnail_width=128,
+                thumbnail_height=192,
+            )
+            for i in range(size)
+        ],
+        batch_size=1000,
+    )
+    Book.authors.through.objects.bulk_create(
+        [
+            Book.authors.through(book_id=book.id, author_id=author.id)
+            for i, book in enumerate(books)
+            for author in authors[: 1 + i % 3]
+        ],
+        batch_size=1000,
+    )
+    OwnedBook.objects.bulk_create(
+        [OwnedBook(user=user, book=book) for book in books], batch_size=1000
+    )
+    evict_user_pages([user.id])
+
+
+def render(client, size, minify):
+    with override_settings(OWNED_BOOKS_PAGE_SIZE=size, MINIFY_HTML=minify):
+        start = time.perf_counter()
+        response = client.get("/books")
+        elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return response.content, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user("benchmark")
+        client = Client()
+        client.force_login(user)
+
+        print(
+            f"{'books':>6} {'bytes':>10} {'minified':>10} {'gzipped':>10} "
+            + " ".join(f"{state + ' ms':>10}" for state in CACHE_STATES)
+        )
+        for size in args.sizes:
+            create_library(user, size)
+            raw, _ = render(client, size, minify=False)
+            minified, _ = render(client, size, minify=True)
+            medians = []
+            for forget in CACHE_STATES.values():
+                timings = []
+                for _ in range(args.repeat):
+                    forget(user)
+                    timings.append(render(client, size, minify=True)[1])
+                medians.append(statistics.median(timings) * 1000)
+            print(
+                f"{size:>6} {len(raw):>10} {len(minified):>10} "
+                f"{len(gzip.compress(minified)):>10} "
+                + " ".join(f"{median:>10.1f}" for median in medians)
+            )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Read throughput of SQLite under concurrent writers, per journal profile.
+
+Runs reader and writer threads against a scratch database file, once with
+SQLite's defaults and once with settings.SQLITE_PRAGMAS, and reports
+completed reads and writes per second plus reads that hit a lock.
+
+Usage:
+
+    python -m benchmarks.sqlite_concurrency [--readers 8] [--writers 2]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from booksread.settings import SQLITE_PRAGMAS
+
+PROFILES = {
+    "default": ({}, "DEFERRED"),
+    "high_concurrency": (SQLITE_PRAGMAS, "IMMEDIATE"),
+}
+
+
+def connect(path, pragmas):
+    connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name}={value}")
+    return connection
+
+
+def setup(path, pragmas, num_rows):
+    connection = connect(path, pragmas)
+    connection.execute(
+        "CREATE TABLE ownedbook (id INTEGER PRIMARY KEY, user_id INT, title TEXT)"
+    )
+    connection.execute("CREATE INDEX ownedbook_user ON ownedbook (user_id, title)")
+    connection.executemany(
+        "INSERT INTO ownedbook (user_id, title) VALUES (?, ?)",
+        ((i % 100, f"Book {i}") for i in range(num_rows)),
+    )
+    connection.close()
+
+
+def reader(path, pragmas, stop, counts):
+    connection = connect(path, pragmas)
+    while not stop.is_set():
+        try:
+            connection.execute(
+                "SELECT id, title FROM ownedbook WHERE user_id = ? "
+                "ORDER BY title LIMIT 48",
+                (counts["reads"] % 100,),
+            ).fetchall()
+            counts["reads"] += 1
+        except sqlite3.OperationalError:
+            counts["read_errors"] += 1
+    connection.close()
+
+
+def writer(path, pragmas, transaction_mode, stop, counts):
+    connection = connect(path, pragmas)
+    while not stop.is_set():
+        try:
+            connection.execute(f"BEGIN {transaction_mode}")
+            connection.executemany(
+                "INSERT INTO ownedbook (user_id, title) VALUES (?, ?)",
+                ((i, f"New book {i}") for i in range(10)),
+            )
+            connection.execute("COMMIT")
+            counts["writes"] += 1
+        except sqlite3.OperationalError:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            counts["write_errors"] += 1
+    connection.close()
+
+
+def run_profile(name, num_readers, num_writers, duration, num_rows):
+    pragmas, transaction_mode = PROFILES[name]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite3")
+        setup(path, pragmas, num_rows)
+
+        stop = threading.Event()
+        reader_counts = [{"reads": 0, "read_errors": 0} for _ in range(num_readers)]
+        writer_counts = [{"writes": 0, "write_errors": 0} for _ in range(num_writers)]
+        threads = [
+            threading.Thread(target=reader, args=(path, pragmas, stop, counts))
+            for counts in reader_counts
+        ] + [
+            threading.Thread(
+                target=writer, args=(path, pragmas, transaction_mode, stop, counts)
+            )
+            for counts in writer_counts
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return {
+        "reads/s": sum(c["reads"] for c in reader_counts) / duration,
+        "read errors": sum(c["read_errors"] for c in reader_counts),
+        "writes/s": sum(c["writes"] for c in writer_counts) / duration,
+        "write errors": sum(c["write_errors"] for c in writer_counts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5, help="Seconds.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':<18} {'reads/s':>10} {'read errors':>12} "
+        f"{'writes/s':>10} {'write errors':>12}"
+    )
+    for name in PROFILES:
+        result = run_profile(name, args.readers, args.writers, args.duration, args.rows)
+        print(
+            f"{name:<18} {result['reads/s']:>10.0f} {result['read errors']:>12} "
+            f"{result['writes/s']:>10.0f} {result['write errors']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compare the streaming thumbnail probe against the old 2 MB range download.
+
+Serves generated covers in several formats and sizes from a local HTTP
+server and reports bytes read and time per probe for both approaches.
+
+Usage:
+
+    python -m benchmarks.thumbnail_probe [--repeat 20]
+"""
+
+import argparse
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image, ImageFile
+
+from books.images import read_image_dimensions
+
+FORMATS = ("JPEG", "PNG", "GIF", "WEBP")
+SIZES = ((128, 192), (800, 1200))
+CHUNK_SIZE = 1024
+MAX_BYTES = 2_000_000
+
+
+def make_image(image_format, size):
+    # Random pixels do not compress, which makes for realistically big files.
+    image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    if image_format == "GIF":
+        image = image.convert("P")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def serve(images):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = images[self.path]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The streaming probe hangs up early on purpose.
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def probe_legacy(url):
+    resume_header = {"Range": f"bytes=0-{MAX_BYTES}"}
+    data = requests.get(url, stream=True, headers=resume_header).content
+    parser = ImageFile.Parser()
+    parser.feed(data)
+    return (parser.image.size if parser.image else None), len(data)
+
+
+def probe_streaming(url):
+    resume_header = {"Range": f"bytes=0-{MAX_BYTES - 1}"}
+    with requests.get(url, stream=True, headers=resume_header) as response:
+        return read_image_dimensions(
+            response.iter_content(chunk_size=CHUNK_SIZE), max_bytes=MAX_BYTES
+        )
+
+
+def measure(probe, url, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        dimensions, bytes_read = probe(url)
+    elapsed = time.perf_counter() - started_at
+    return dimensions, bytes_read, elapsed / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    images = {
+        f"/{width}x{height}.{image_format.lower()}": make_image(
+            image_format, (width, height)
+        )
+        for image_format in FORMATS
+        for width, height in SIZES
+    }
+    server = serve(images)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    print(
+        f"{'image':<20} {'file bytes':>10} "
+        f"{'legacy bytes':>12} {'legacy ms':>9} "
+        f"{'stream bytes':>12} {'stream ms':>9}"
+    )
+    try:
+        for path, data in images.items():
+            url = base_url + path
+            legacy_size, legacy_bytes, legacy_ms = measure(
+                probe_legacy, url, args.repeat
+            )
+            stream_size, stream_bytes, stream_ms = measure(
+                probe_streaming, url, args.repeat
+            )
+            assert legacy_size == stream_size, (path, legacy_size, stream_size)
+            print(
+                f"{path[1:]:<20} {len(data):>10} "
+                f"{legacy_bytes:>12} {legacy_ms:>9.2f} "
+                f"{stream_bytes:>12} {stream_ms:>9.2f}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
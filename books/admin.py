@@ -1,18 +1,90 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db.models import Max, Prefetch, Q
+from django.db.models.functions import Substr
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
 
-from .models import Author, Book, OwnedBook, Publisher, User
+from .models import Author, Book, EnrichmentJob, OwnedBook, Publisher, User
 
+REVIEW_EXCERPT_LENGTH = 80  # Characters shown in the changelist.
 
-class AuthorAdmin(admin.ModelAdmin):
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that does not COUNT(*) whole tables.
+
+    Unfiltered changelists of more than ADMIN_COUNT_ESTIMATE_THRESHOLD rows
+    report the highest primary key instead, an index lookup. Filtered ones
+    count at most ADMIN_COUNT_LIMIT rows, later pages are not reachable.
+    """
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            max_id = self.object_list.aggregate(max_id=Max("pk"))["max_id"] or 0
+            if max_id > settings.ADMIN_COUNT_ESTIMATE_THRESHOLD:
+                return max_id
+            return super().count
+        return self.object_list[: settings.ADMIN_COUNT_LIMIT].count()
+
+
+class BaseAdmin(admin.ModelAdmin):
+    """ModelAdmin for tables of millions of rows.
+
+    Fields in search_fields must be prefix searches (``^field``), which
+    are answered with range lookups on their indexes, see
+    get_search_results().
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Match ``^field`` prefixes with range lookups instead of LIKE.
+
+        Django searches them with istartswith, a LIKE that SQLite cannot
+        answer from an index. A range is case sensitive, so the term is
+        tried as typed, capitalized and in title case. Related fields are
+        matched in a subquery, which neither duplicates rows nor keeps the
+        database from starting at their index.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        variants = {search_term, search_term[:1].upper() + search_term[1:]}
+        variants.add(search_term.title())
+        query = Q()
+        for field_name in self.get_search_fields(request):
+            field_name = field_name.removeprefix("^")
+            prefix_query = Q()
+            for variant in variants:
+                prefix_query |= Q(
+                    **{
+                        f"{field_name}__gte": variant,
+                        f"{field_name}__lt": variant + "\U0010ffff",
+                    }
+                )
+            if "__" in field_name:
+                prefix_query = Q(
+                    pk__in=self.model.objects.filter(prefix_query).values("pk")
+                )
+            query |= prefix_query
+        return queryset.filter(query), False
+
+
+class AuthorAdmin(BaseAdmin):
     list_display = (
         "full_name",
         "created_at",
         "id",
     )
+    search_fields = ("^full_name",)
 
 
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(BaseAdmin):
     list_display = (
         "title",
         "author_names",
@@ -21,37 +93,74 @@ class BookAdmin(admin.ModelAdmin):
         "created_at",
         "id",
     )
-    filter_horizontal = ("authors",)
-    autocomplete_fields = ("publisher",)
-    search_fields = ("title",)
+    list_select_related = ("publisher",)
+    # A select box of all authors would not render with that many.
+    autocomplete_fields = ("publisher", "authors")
+    search_fields = ("^title", "^publisher__name", "^authors__full_name")
 
-    def author_names(self, book):
-        return ", ".join(
-            [author.full_name for author in book.authors.order_by("full_name")]
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .prefetch_related(
+                Prefetch("authors", queryset=Author.objects.order_by("full_name"))
+            )
         )
 
+    def author_names(self, book):
+        return ", ".join([author.full_name for author in book.authors.all()])
+
 
-class PublisherAdmin(admin.ModelAdmin):
+class PublisherAdmin(BaseAdmin):
     list_display = (
         "name",
         "created_at",
         "id",
     )
-    search_fields = ("name",)
+    search_fields = ("^name",)
 
 
-class OwnedBookAdmin(admin.ModelAdmin):
+class OwnedBookAdmin(BaseAdmin):
     list_display = (
         "user",
         "book",
         "progress",
         "rating",
-        "review",
+        "review_excerpt",
         "created_at",
         "id",
     )
+    list_select_related = ("user", "book")
     autocomplete_fields = ("user", "book")
 
+    def get_queryset(self, request):
+        # Reviews can be long, the changelist only needs their beginning.
+        return (
+            super()
+            .get_queryset(request)
+            .defer("review")
+            .annotate(review_start=Substr("review", 1, REVIEW_EXCERPT_LENGTH + 1))
+        )
+
+    @admin.display(description="Review")
+    def review_excerpt(self, ownedbook):
+        return Truncator(ownedbook.review_start).chars(REVIEW_EXCERPT_LENGTH)
+
+
+class EnrichmentJobAdmin(BaseAdmin):
+    list_display = (
+        "kind",
+        "book",
+        "state",
+        "attempts",
+        "run_after",
+        "created_at",
+        "id",
+    )
+    list_filter = ("kind", "state")
+    list_select_related = ("book",)
+    raw_id_fields = ("book",)
+
 
 admin.site.site_header = "BooksRead Admin"
 
@@ -59,5 +168,6 @@ admin.site.register(User, UserAdmin)
 
 admin.site.register(Author, AuthorAdmin)
 admin.site.register(Book, BookAdmin)
+admin.site.register(EnrichmentJob, EnrichmentJobAdmin)
 admin.site.register(OwnedBook, OwnedBookAdmin)
 admin.site.register(Publisher, PublisherAdmin)
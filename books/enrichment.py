@@ -0,0 +1,309 @@
+"""Background enrichment of Books, outside the request/response cycle.
+
+Search only creates the core Book rows and enqueues EnrichmentJobs for the
+slow parts. The run_enrichment_worker management command then mirrors the
+cover (or only probes its dimensions, see THUMBNAIL_MIRROR) and refreshes
+description/page count, retrying failed jobs with exponential backoff.
+Until then, tiles use Google's cover and the 2:3 fallback of
+Book.thumbnail_ratio.
+"""
+
+import logging
+import random
+from datetime import timedelta
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import thumbnails
+from .google_books import search_google_books
+from .models import Book, EnrichmentJob, _get_image_dimensions_from_url
+from .page_cache import evict_owner_pages
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentError(Exception):
+    """A job failed in a way that is worth retrying."""
+
+
+class CoverChanged(Exception):
+    """The Book got a new cover while its thumbnail job was running."""
+
+
+def enqueue_book_enrichment(books: Iterable[Book]):
+    """Enqueue whatever the given Books are still missing, at most one job each.
+
+    A changed cover resets its thumbnail dimensions (see books.ingest), so
+    thumbnail jobs that ran for the previous cover are requeued. Metadata is
+    only fetched once per Book, Google rarely has more to say the second time.
+    """
+    books = list(books)
+    if settings.THUMBNAIL_MIRROR:
+        # Mirroring records the dimensions as well, no need for a probe.
+        _enqueue(
+            [
+                book
+                for book in books
+                if book.thumbnail_url
+                and not (book.thumbnail_digest and book.thumbnail_placeholder)
+            ],
+            EnrichmentJob.Kinds.THUMBNAIL_MIRROR,
+            requeue=True,
+        )
+    else:
+        _enqueue(
+            [book for book in books if book.thumbnail_url and not book.thumbnail_width],
+            EnrichmentJob.Kinds.THUMBNAIL_DIMENSIONS,
+            requeue=True,
+        )
+    _enqueue(
+        [
+            book
+            for book in books
+            if book.isbn and not (book.description and book.num_pages)
+        ],
+        EnrichmentJob.Kinds.METADATA,
+        requeue=False,
+    )
+
+
+def _enqueue(books: List[Book], kind: str, requeue: bool):
+    """Create the missing jobs, with ``requeue`` also rerun finished ones.
+
+    Only DONE and FAILED jobs are requeued, and only if the Book has a new
+    cover since. Pending and running jobs pick up the current cover anyway.
+    """
+    if not books:
+        return
+
+    EnrichmentJob.objects.bulk_create(
+        [
+            EnrichmentJob(book=book, kind=kind, thumbnail_url=book.thumbnail_url)
+            for book in books
+        ],
+        ignore_conflicts=True,
+    )
+    if not requeue:
+        return
+
+    thumbnail_urls = {book.id: book.thumbnail_url for book in books}
+    finished_jobs = EnrichmentJob.objects.filter(
+        book__in=thumbnail_urls,
+        kind=kind,
+        state__in=[EnrichmentJob.States.DONE, EnrichmentJob.States.FAILED],
+    ).only("id", "book_id", "thumbnail_url")
+    now = timezone.now()
+    jobs = []
+    for job in finished_jobs:
+        if job.thumbnail_url == thumbnail_urls[job.book_id]:
+            continue
+        job.state = EnrichmentJob.States.PENDING
+        job.attempts = 0
+        job.run_after = now
+        job.thumbnail_url = thumbnail_urls[job.book_id]
+        job.last_error = ""
+        job.modified_at = now  # bulk_update() skips auto_now.
+        jobs.append(job)
+    EnrichmentJob.objects.bulk_update(
+        jobs,
+        [
+            "state",
+            "attempts",
+            "run_after",
+            "thumbnail_url",
+            "last_error",
+            "modified_at",
+        ],
+    )
+
+
+def run_pending_jobs(limit: int = 100) -> int:
+    """Process up to ``limit`` due jobs, return how many were processed."""
+    release_stale_jobs()
+    due_jobs = EnrichmentJob.objects.filter(
+        state=EnrichmentJob.States.PENDING, run_after__lte=timezone.now()
+    ).order_by("run_after")[:limit]
+
+    num_processed = 0
+    for job_id in list(due_jobs.values_list("id", flat=True)):
+        # Claiming with a conditional update keeps concurrent workers from
+        # running the same job twice.
+        claimed = EnrichmentJob.objects.filter(
+            id=job_id, state=EnrichmentJob.States.PENDING
+        ).update(
+            state=EnrichmentJob.States.RUNNING,
+            attempts=F("attempts") + 1,
+            claimed_at=timezone.now(),
+            modified_at=timezone.now(),
+        )
+        if claimed:
+            run_job(EnrichmentJob.objects.select_related("book").get(id=job_id))
+            num_processed += 1
+    return num_processed
+
+
+def release_stale_jobs() -> int:
+    """Take back jobs whose worker died, return how many there were.
+
+    A job still running ENRICHMENT_LEASE_TIMEOUT seconds after it was
+    claimed counts as a failed attempt. Jobs without claimed_at were claimed
+    before there were leases.
+    """
+    now = timezone.now()
+    stale_jobs = EnrichmentJob.objects.filter(
+        Q(claimed_at__lt=now - timedelta(seconds=settings.ENRICHMENT_LEASE_TIMEOUT))
+        | Q(claimed_at=None),
+        state=EnrichmentJob.States.RUNNING,
+    )
+    error = "Lease expired, the worker stopped while running the job"
+    num_failed = stale_jobs.filter(
+        attempts__gte=settings.ENRICHMENT_MAX_ATTEMPTS
+    ).update(state=EnrichmentJob.States.FAILED, last_error=error, modified_at=now)
+    num_released = stale_jobs.update(
+        state=EnrichmentJob.States.PENDING,
+        run_after=now,
+        last_error=error,
+        modified_at=now,
+    )
+    if num_failed or num_released:
+        logger.warning(
+            "Took back %s stale enrichment job(s)", num_failed + num_released
+        )
+    return num_failed + num_released
+
+
+def run_job(job: EnrichmentJob):
+    handler = JOB_HANDLERS[job.kind]
+    job.thumbnail_url = job.book.thumbnail_url
+    try:
+        handler(job.book)
+    except CoverChanged as error:
+        # A new cover, not a failure: start over right away.
+        logger.info("Enrichment job %s requeued: %s", job.id, error)
+        job.state = EnrichmentJob.States.PENDING
+        job.attempts = 0
+        job.run_after = timezone.now()
+        job.last_error = ""
+        job.save(
+            update_fields=[
+                "state",
+                "attempts",
+                "run_after",
+                "thumbnail_url",
+                "last_error",
+                "modified_at",
+            ]
+        )
+    except Exception as error:
+        logger.warning("Enrichment job %s failed: %r", job.id, error)
+        job.last_error = repr(error)
+        if job.attempts >= settings.ENRICHMENT_MAX_ATTEMPTS:
+            job.state = EnrichmentJob.States.FAILED
+        else:
+            job.state = EnrichmentJob.States.PENDING
+            job.run_after = timezone.now() + _get_retry_delay(job.attempts)
+        job.save(
+            update_fields=[
+                "state",
+                "run_after",
+                "thumbnail_url",
+                "last_error",
+                "modified_at",
+            ]
+        )
+    else:
+        job.state = EnrichmentJob.States.DONE
+        job.last_error = ""
+        job.save(update_fields=["state", "thumbnail_url", "last_error", "modified_at"])
+
+
+def _get_retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff with jitter, so failed jobs do not retry in lockstep."""
+    seconds = settings.ENRICHMENT_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=seconds * random.uniform(0.5, 1.5))
+
+
+def update_thumbnail_dimensions(book: Book):
+    if not book.thumbnail_url:
+        return
+
+    thumbnail_url = book.thumbnail_url
+    thumbnail_dimensions = _get_image_dimensions_from_url(
+        thumbnail_url, timeout=settings.THUMBNAIL_PROBE_TIMEOUT
+    )
+    if thumbnail_dimensions:
+        thumbnail_width, thumbnail_height = thumbnail_dimensions
+        _update_thumbnail(
+            book,
+            thumbnail_url,
+            thumbnail_width=thumbnail_width,
+            thumbnail_height=thumbnail_height,
+        )
+
+
+def mirror_thumbnail(book: Book):
+    if not book.thumbnail_url:
+        return
+
+    thumbnail_url = book.thumbnail_url
+    thumbnail = thumbnails.mirror_thumbnail(thumbnail_url)
+    _update_thumbnail(
+        book,
+        thumbnail_url,
+        thumbnail_digest=thumbnail.digest,
+        thumbnail_width=thumbnail.width,
+        thumbnail_height=thumbnail.height,
+        thumbnail_placeholder=thumbnail.placeholder,
+    )
+
+
+def _update_thumbnail(book: Book, thumbnail_url: str, **fields):
+    """Save what was found out about ``thumbnail_url``, if still the cover.
+
+    A search may have replaced the cover meanwhile, CoverChanged then
+    requeues the job for the new one.
+    """
+    num_updated = Book.objects.filter(id=book.id, thumbnail_url=thumbnail_url).update(
+        **fields, modified_at=timezone.now()
+    )
+    if not num_updated:
+        raise CoverChanged(f"Cover of Book {book.id} is no longer {thumbnail_url}")
+    # Bulk updates send no signals.
+    evict_owner_pages([book.id])
+
+
+def update_metadata(book: Book):
+    """Fill in description and page count from the full ISBN volume."""
+    if not book.isbn:
+        return
+
+    google_books_data = search_google_books(isbn=book.isbn, max_results=1)
+    if "error" in google_books_data:
+        raise EnrichmentError(google_books_data["error"])
+
+    volumes = google_books_data.get("items")
+    if not volumes:
+        return
+
+    volume_info = volumes[0]["volumeInfo"]
+    update_fields = []
+    description = volume_info.get("description")
+    if description and not book.description:
+        book.description = description
+        update_fields.append("description")
+    num_pages = volume_info.get("pageCount")
+    if num_pages and not book.num_pages:
+        book.num_pages = num_pages
+        update_fields.append("num_pages")
+    if update_fields:
+        book.save(update_fields=update_fields + ["modified_at"])
+
+
+JOB_HANDLERS = {
+    EnrichmentJob.Kinds.THUMBNAIL_DIMENSIONS: update_thumbnail_dimensions,
+    EnrichmentJob.Kinds.THUMBNAIL_MIRROR: mirror_thumbnail,
+    EnrichmentJob.Kinds.METADATA: update_metadata,
+}
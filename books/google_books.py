@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .performance import propagate_context
+from .upstream import UpstreamClient, UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def search_google_books(
+    isbn: Optional[str] = None,
+    title: Optional[str] = None,
+    author: Optional[str] = None,
+    max_results: Optional[int] = settings.GOOGLE_BOOKS_MAX_RESULTS,
+    language: Optional[str] = settings.GOOGLE_BOOKS_LANGUAGE_RESTRICT,
+) -> dict:
+    """Query the Google Books volumes API, answering repeats from the cache.
+
+    Responses without any items are cached as well (for a shorter time), so
+    hopeless queries do not keep eating into the upstream quota either.
+    Raises UpstreamUnavailable when Google Books is rate limited, failing or
+    its circuit is open, see get_google_books_client().
+    """
+    if not any([isbn, title, author]):
+        raise ValueError("Must search by either ISBN or title/author")
+
+    cache = caches[settings.GOOGLE_BOOKS_CACHE_ALIAS]
+    cache_key = _get_cache_key(isbn, title, author, max_results, language)
+    data = cache.get(cache_key)
+    if data is not None:
+        return data
+
+    url = settings.GOOGLE_BOOKS_BASE_URL
+    query = "?q="
+    if isbn:
+        query += f"isbn:{isbn}"
+    elif title or author:
+        if title:
+            query += f"intitle:{title}"
+        if title and author:
+            query += ","
+        if author:
+            query += f"inauthor:{author}"
+
+    query += f"&maxResults={max_results}"
+    if language:
+        query += f"&langRestrict={language}"
+    url += query
+
+    response = get_google_books_client().get(url)
+    if not response.ok:
+        # Not cached. The body may not be JSON, e.g. an HTML error page, which
+        # counts as no results.
+        logger.warning("Google Books answered %s to %s", response.status_code, url)
+        return _get_json(response) or {}
+
+    data = _get_json(response)
+    if data is None:
+        logger.warning("Google Books answered without JSON to %s", url)
+        return {}
+
+    if "error" not in data:
+        if data.get("items"):
+            timeout = settings.GOOGLE_BOOKS_CACHE_TIMEOUT
+        else:
+            timeout = settings.GOOGLE_BOOKS_CACHE_NEGATIVE_TIMEOUT
+        cache.set(cache_key, data, timeout=timeout)
+
+    return data
+
+
+def lookup_volumes(
+    queries: List[dict], return_exceptions: bool = False
+) -> List[Union[dict, None, UpstreamUnavailable]]:
+    """Best matching volume per query (search_google_books() kwargs) or None.
+
+    Runs up to GOOGLE_BOOKS_MAX_CONCURRENCY requests at once, the shared
+    rate limit spaces them out. While Google Books is unavailable, queries
+    not answered from the cache get None, or with ``return_exceptions`` the
+    UpstreamUnavailable error, to tell them apart from volumes not found.
+    """
+    if not queries:
+        return []
+
+    def lookup(query):
+        try:
+            volumes = search_google_books(**query, max_results=1).get("items")
+        except UpstreamUnavailable as error:
+            logger.warning("Google Books lookup of %s failed: %s", query, error)
+            return error if return_exceptions else None
+        return volumes[0] if volumes else None
+
+    max_workers = min(settings.GOOGLE_BOOKS_MAX_CONCURRENCY, len(queries))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(propagate_context(lookup), queries))
+
+
+def get_google_books_client() -> UpstreamClient:
+    """Client sharing rate limit and circuit with every process, see upstream."""
+    return UpstreamClient(
+        "google-books",
+        cache_alias=settings.GOOGLE_BOOKS_STATE_CACHE_ALIAS,
+        rate=settings.GOOGLE_BOOKS_RATE_LIMIT,
+        burst=settings.GOOGLE_BOOKS_RATE_LIMIT_BURST,
+        rate_limit_wait=settings.GOOGLE_BOOKS_RATE_LIMIT_WAIT,
+        connect_timeout=settings.GOOGLE_BOOKS_CONNECT_TIMEOUT,
+        read_timeout=settings.GOOGLE_BOOKS_READ_TIMEOUT,
+        max_retries=settings.GOOGLE_BOOKS_MAX_RETRIES,
+        retry_backoff=settings.GOOGLE_BOOKS_RETRY_BACKOFF,
+        failure_threshold=settings.GOOGLE_BOOKS_CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=settings.GOOGLE_BOOKS_CIRCUIT_RESET_TIMEOUT,
+    )
+
+
+def _get_json(response) -> Optional[dict]:
+    """The JSON object of the response body, None if it is not one."""
+    try:
+        data = response.json()
+    except ValueError:  # Including requests' JSONDecodeError.
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _get_cache_key(isbn, title, author, max_results, language) -> str:
+    """Equivalent queries differing only in case or whitespace share a key."""
+
+    def normalize(value):
+        return " ".join(str(value).lower().split()) if value else None
+
+    query = [normalize(isbn)]
+    if not isbn:
+        # An ISBN query ignores title/author, see search_google_books().
+        query += [normalize(title), normalize(author)]
+    query += [max_results, normalize(language)]
+    digest = hashlib.sha256(json.dumps(query).encode()).hexdigest()
+    return f"google-books:{digest}"
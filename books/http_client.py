@@ -0,0 +1,33 @@
+"""Pooled keep-alive HTTP session shared by all upstream requests.
+
+Module level requests.get() opens a new TCP/TLS connection per call, while
+a shared session reuses connections to Google Books and its image hosts.
+"""
+
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .performance import record_upstream_response
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.hooks["response"].append(record_upstream_response)
+                _session = session
+    return _session
@@ -0,0 +1,133 @@
+"""Cheap image dimension detection from the first bytes of an image file.
+
+Most formats store their width and height in a fixed header near the start
+of the file, so there is no need to download a whole cover just to learn
+its size.
+"""
+
+import struct
+from typing import Iterable, Optional, Tuple
+
+from PIL import ImageFile
+
+Dimensions = Tuple[int, int]
+
+SNIFF_HEADER_LIMIT = 64 * 1024
+"""Stop buffering for the fast paths after this many bytes (huge EXIF etc.)."""
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_GIF_SIGNATURES = (b"GIF87a", b"GIF89a")
+_JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3,
+    0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB,
+    0xCD, 0xCE, 0xCF,
+}  # fmt: skip
+_JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xDA)}
+
+
+def sniff_image_dimensions(header: bytes) -> Optional[Dimensions]:
+    """Return (width, height) if ``header`` already contains them.
+
+    Returns None for unknown formats as well as for headers that are still
+    too short, in which case the caller should feed more bytes.
+    """
+    if header.startswith(_PNG_SIGNATURE):
+        return _sniff_png(header)
+    if header[:6] in _GIF_SIGNATURES:
+        return _sniff_gif(header)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return _sniff_webp(header)
+    if header[:2] == b"\xff\xd8":
+        return _sniff_jpeg(header)
+    return None
+
+
+def read_image_dimensions(
+    chunks: Iterable[bytes], max_bytes: Optional[int] = None
+) -> Tuple[Optional[Dimensions], int]:
+    """Consume ``chunks`` only until the image dimensions are known.
+
+    Tries the header fast paths first and falls back to Pillow's incremental
+    parser for everything else. Returns the dimensions (or None) and the
+    number of bytes that had to be read.
+    """
+    parser = ImageFile.Parser()
+    header = b""
+    bytes_read = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        bytes_read += len(chunk)
+
+        if len(header) < SNIFF_HEADER_LIMIT:
+            header += chunk
+            dimensions = sniff_image_dimensions(header)
+            if dimensions:
+                return dimensions, bytes_read
+
+        parser.feed(chunk)
+        if parser.image:
+            return parser.image.size, bytes_read
+
+        if max_bytes is not None and bytes_read >= max_bytes:
+            break
+    return None, bytes_read
+
+
+def _sniff_png(header: bytes) -> Optional[Dimensions]:
+    # Signature, IHDR chunk length and type, then width and height.
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def _sniff_gif(header: bytes) -> Optional[Dimensions]:
+    if len(header) < 10:
+        return None
+    return struct.unpack("<HH", header[6:10])
+
+
+def _sniff_webp(header: bytes) -> Optional[Dimensions]:
+    if len(header) < 30:
+        return None
+    chunk_type = header[12:16]
+    if chunk_type == b"VP8 ":
+        # Lossy: 14 bit dimensions after the keyframe start code.
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk_type == b"VP8L":
+        # Lossless: 14 bit (dimension - 1) values packed after the signature.
+        b0, b1, b2, b3 = header[21:25]
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        return width, height
+    if chunk_type == b"VP8X":
+        # Extended: 24 bit (canvas dimension - 1) values.
+        width = 1 + int.from_bytes(header[24:27], "little")
+        height = 1 + int.from_bytes(header[27:30], "little")
+        return width, height
+    return None
+
+
+def _sniff_jpeg(header: bytes) -> Optional[Dimensions]:
+    """Walk the marker segments until the first start-of-frame."""
+    offset = 2
+    while offset + 4 <= len(header):
+        if header[offset] != 0xFF:
+            return None  # Corrupt, let Pillow decide.
+        marker = header[offset + 1]
+        if marker == 0xFF:
+            offset += 1  # Fill byte.
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > len(header):
+                return None
+            height, width = struct.unpack(">HH", header[offset + 5 : offset + 9])
+            return width, height
+        (segment_length,) = struct.unpack(">H", header[offset + 2 : offset + 4])
+        offset += 2 + segment_length
+    return None
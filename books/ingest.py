@@ -0,0 +1,285 @@
+"""Turn Google Books volumes into Book rows with a fixed number of queries."""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Author, Book, Publisher
+from .page_cache import touch_books
+from .search_index import get_search_backend
+
+
+@dataclass
+class VolumeRecord:
+    title: str
+    author_names: List[str] = field(default_factory=list)
+    isbn: Optional[str] = None
+    publisher_name: Optional[str] = None
+    description: str = ""
+    num_pages: int = 0
+    thumbnail_url: Optional[str] = None
+    info_url: Optional[str] = None
+
+    @classmethod
+    def from_volume(cls, volume: dict) -> "VolumeRecord":
+        volume_info = volume["volumeInfo"]
+
+        description = ""
+        search_info = volume.get("searchInfo")
+        if search_info:
+            description = search_info.get("textSnippet", "")
+
+        thumbnail_url = None
+        image_links = volume_info.get("imageLinks")
+        if image_links:
+            thumbnail_url = image_links.get(
+                "thumbnail", image_links.get("smallThumbnail")
+            )
+
+        return cls(
+            title=volume_info["title"],
+            author_names=volume_info.get("authors", []),
+            isbn=_get_isbn_from_volume(volume),
+            publisher_name=volume_info.get("publisher"),
+            description=description,
+            num_pages=volume_info.get("pageCount", 0),
+            thumbnail_url=thumbnail_url,
+            info_url=volume_info.get("infoLink"),
+        )
+
+    def apply_to(self, book: Book) -> bool:
+        """Copy the fields Google may have updated, keeping what we know.
+
+        Returns whether any of them changed.
+        """
+        old_values = _get_updated_values(book)
+        if self.description:
+            book.description = self.description
+        if self.num_pages:
+            book.num_pages = self.num_pages
+        if self.thumbnail_url and self.thumbnail_url != book.thumbnail_url:
+            book.thumbnail_url = self.thumbnail_url
+            # Needs a new probe or mirror.
+            book.thumbnail_width = book.thumbnail_height = 0
+            book.thumbnail_digest = book.thumbnail_placeholder = ""
+        book.info_url = self.info_url
+        return _get_updated_values(book) != old_values
+
+
+UPDATED_BOOK_FIELDS = [
+    "description",
+    "num_pages",
+    "thumbnail_url",
+    "thumbnail_width",
+    "thumbnail_height",
+    "thumbnail_digest",
+    "thumbnail_placeholder",
+    "info_url",
+    "modified_at",
+]
+
+
+def ingest_volumes(volumes: List[dict]) -> List[Book]:
+    """Create or update the Books of a Google Books result page.
+
+    Returns the Books in the order of ``volumes`` (without duplicates).
+    """
+    return ingest_records([VolumeRecord.from_volume(volume) for volume in volumes])
+
+
+@transaction.atomic()
+def ingest_records(records: List[VolumeRecord]) -> List[Book]:
+    """Bulk version of a get_or_create per record, authors and publisher.
+
+    Existing Books keep their title and publisher, only the metadata listed
+    in UPDATED_BOOK_FIELDS is refreshed. Books Google has nothing new on are
+    not written, reindexed or evicted from the caches of their owners, so
+    searches do not invalidate the tiles and pages of popular Books. The
+    number of queries does not depend on the number of records (up to the
+    search index chunk size).
+    """
+    if not records:
+        return []
+
+    publishers = _get_or_create_publishers(
+        {record.publisher_name for record in records if record.publisher_name}
+    )
+    authors = _get_or_create_authors(
+        {name for record in records for name in record.author_names}
+    )
+
+    changed_book_ids = set()
+    books_by_isbn = _upsert_books_by_isbn(
+        [record for record in records if record.isbn], publishers, changed_book_ids
+    )
+    books_by_title = _get_or_create_books_by_publisher_and_title(
+        [record for record in records if not record.isbn],
+        publishers,
+        changed_book_ids,
+    )
+
+    books: Dict[int, Book] = {}
+    author_ids_by_book_id: Dict[int, List[int]] = {}
+    for record in records:
+        if record.isbn:
+            book = books_by_isbn[record.isbn]
+        else:
+            book = books_by_title[_get_publisher_and_title_key(record, publishers)]
+        books.setdefault(book.id, book)
+        if record.author_names:
+            author_ids_by_book_id[book.id] = [
+                authors[name].id for name in dict.fromkeys(record.author_names)
+            ]
+
+    changed_book_ids.update(_set_book_authors(author_ids_by_book_id))
+    # Bulk writes send no signals.
+    get_search_backend().index_books(changed_book_ids)
+    # Also bumps modified_at of Books whose authors were all that changed.
+    touch_books(changed_book_ids)
+    return list(books.values())
+
+
+def _get_or_create_publishers(names) -> Dict[str, Publisher]:
+    publishers = Publisher.objects.in_bulk(names, field_name="name")
+    missing = [name for name in names if name not in publishers]
+    if missing:
+        # Names are unique, a concurrent search may have created some already.
+        Publisher.objects.bulk_create(
+            [Publisher(name=name) for name in missing], ignore_conflicts=True
+        )
+        publishers.update(Publisher.objects.in_bulk(missing, field_name="name"))
+    return publishers
+
+
+def _get_or_create_authors(full_names) -> Dict[str, Author]:
+    authors = Author.objects.in_bulk(full_names, field_name="full_name")
+    missing = [name for name in full_names if name not in authors]
+    if missing:
+        Author.objects.bulk_create(
+            [Author(full_name=name) for name in missing], ignore_conflicts=True
+        )
+        authors.update(Author.objects.in_bulk(missing, field_name="full_name"))
+    return authors
+
+
+def _upsert_books_by_isbn(records, publishers, changed_book_ids) -> Dict[str, Book]:
+    """Create or update the Books by ISBN, adding the IDs of those written."""
+    if not records:
+        return {}
+
+    books = Book.objects.in_bulk({record.isbn for record in records}, field_name="isbn")
+    changed_books = {}
+    for record in records:
+        book = books.get(record.isbn)
+        if book is None:
+            book = books[record.isbn] = Book(
+                isbn=record.isbn,
+                title=record.title,
+                publisher=publishers.get(record.publisher_name),
+            )
+        if record.apply_to(book) or book.pk is None:
+            changed_books[record.isbn] = book
+
+    # Upserting rather than splitting into create/update keeps concurrent
+    # searches for the same ISBN from failing on the unique constraint.
+    Book.objects.bulk_create(
+        list(changed_books.values()),
+        update_conflicts=True,
+        unique_fields=["isbn"],
+        update_fields=UPDATED_BOOK_FIELDS,
+    )
+    changed_book_ids.update(book.id for book in changed_books.values())
+    return books
+
+
+def _get_or_create_books_by_publisher_and_title(
+    records, publishers, changed_book_ids
+) -> Dict:
+    """Like _upsert_books_by_isbn(), by publisher and title instead."""
+    if not records:
+        return {}
+
+    books = {}
+    for book in Book.objects.filter(
+        title__in={record.title for record in records}
+    ).order_by("id"):
+        books.setdefault((book.publisher_id, book.title), book)
+
+    new_books = {}
+    changed_books = {}
+    for record in records:
+        key = _get_publisher_and_title_key(record, publishers)
+        book = books.get(key)
+        if book is None:
+            book = books[key] = new_books[key] = Book(
+                title=record.title, publisher=publishers.get(record.publisher_name)
+            )
+        if record.apply_to(book) and key not in new_books:
+            changed_books[key] = book
+
+    now = timezone.now()
+    for book in changed_books.values():
+        book.modified_at = now  # bulk_update() skips auto_now.
+
+    Book.objects.bulk_create(list(new_books.values()))
+    Book.objects.bulk_update(list(changed_books.values()), UPDATED_BOOK_FIELDS)
+    changed_book_ids.update(
+        book.id for book in [*new_books.values(), *changed_books.values()]
+    )
+    return books
+
+
+def _get_publisher_and_title_key(record, publishers):
+    publisher = publishers.get(record.publisher_name)
+    return (publisher.id if publisher else None, record.title)
+
+
+def _set_book_authors(author_ids_by_book_id: Dict[int, List[int]]) -> Set[int]:
+    """Replace the authors of the given Books, like authors.set() per Book.
+
+    Only Books whose authors differ are written, their IDs are returned.
+    """
+    if not author_ids_by_book_id:
+        return set()
+
+    BookAuthor = Book.authors.through
+    old_author_ids_by_book_id = defaultdict(set)
+    for book_id, author_id in BookAuthor.objects.filter(
+        book_id__in=author_ids_by_book_id
+    ).values_list("book_id", "author_id"):
+        old_author_ids_by_book_id[book_id].add(author_id)
+    author_ids_by_book_id = {
+        book_id: author_ids
+        for book_id, author_ids in author_ids_by_book_id.items()
+        if set(author_ids) != old_author_ids_by_book_id[book_id]
+    }
+
+    BookAuthor.objects.filter(book_id__in=author_ids_by_book_id).delete()
+    BookAuthor.objects.bulk_create(
+        [
+            BookAuthor(book_id=book_id, author_id=author_id)
+            for book_id, author_ids in author_ids_by_book_id.items()
+            for author_id in author_ids
+        ]
+    )
+    return set(author_ids_by_book_id)
+
+
+def _get_updated_values(book: Book) -> list:
+    return [
+        getattr(book, field_name)
+        for field_name in UPDATED_BOOK_FIELDS
+        if field_name != "modified_at"
+    ]
+
+
+def _get_isbn_from_volume(volume):
+    """Prefer ISBN_13 over ISBN_10."""
+    identifier_objs = volume["volumeInfo"].get("industryIdentifiers", [])
+    for identifier_obj in identifier_objs:
+        if identifier_obj["type"] == "ISBN_13":
+            return identifier_obj["identifier"]
+    return identifier_objs[0]["identifier"] if len(identifier_objs) else None
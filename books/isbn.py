@@ -0,0 +1,15 @@
+from typing import List
+
+
+def normalize_isbn(isbn) -> str:
+    return str(isbn).replace(" ", "").replace("-", "").replace("_", "").replace(".", "")
+
+
+def get_isbn_variants(isbn: str) -> List[str]:
+    """The ISBN itself plus its ISBN-13 form, which Books are stored with."""
+    isbns = [isbn]
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        digits = "978" + isbn[:9]
+        checksum = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits))
+        isbns.append(digits + str((10 - checksum % 10) % 10))
+    return isbns
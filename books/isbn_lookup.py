@@ -0,0 +1,108 @@
+"""Batch lookup of Books by ISBN, e.g. for a barcode scanning session.
+
+ISBNs already in the catalog are answered with a single query. Only the
+misses go to Google Books, concurrently and rate limited (see
+google_books.lookup_volumes()), and the volumes found are ingested so the
+next lookup is local. ISBNs that could not be looked up while Google Books
+was unavailable are told apart from those not found, to retry them later.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db import transaction
+
+from .enrichment import enqueue_book_enrichment
+from .google_books import lookup_volumes
+from .ingest import VolumeRecord, ingest_records
+from .isbn import get_isbn_variants, normalize_isbn
+from .models import Book, OwnedBook, User
+from .page_cache import evict_user_pages
+from .upstream import UpstreamUnavailable
+
+ISBN_PATTERN = re.compile(r"\d{9}[\dX]|\d{13}")
+
+
+def lookup_books_by_isbn(
+    isbns: Iterable[str],
+) -> Tuple[Dict[str, Optional[Book]], Set[str]]:
+    """Map each normalized ISBN to its Book, or None if there is none.
+
+    Values that do not look like an ISBN-10 or ISBN-13 are never sent
+    upstream and map to None as well. Also returns the ISBNs that map to
+    None only because Google Books was unavailable.
+    """
+    books_by_isbn: Dict[str, Optional[Book]] = dict.fromkeys(
+        normalize_isbn(isbn).upper() for isbn in isbns
+    )
+    valid_isbns = [isbn for isbn in books_by_isbn if ISBN_PATTERN.fullmatch(isbn)]
+
+    books_by_isbn.update(find_local_books_by_isbn(valid_isbns))
+    google_books_by_isbn, unavailable_isbns = _find_google_books_by_isbn(
+        [isbn for isbn in valid_isbns if books_by_isbn[isbn] is None]
+    )
+    books_by_isbn.update(google_books_by_isbn)
+    return books_by_isbn, unavailable_isbns
+
+
+def find_local_books_by_isbn(isbns: Iterable[str]) -> Dict[str, Book]:
+    """Match ISBNs (including ISBN-10 forms) against the catalog in one query."""
+    isbn_variants = {isbn: get_isbn_variants(isbn) for isbn in isbns}
+    books = Book.objects.in_bulk(
+        {variant for variants in isbn_variants.values() for variant in variants},
+        field_name="isbn",
+    )
+
+    books_by_isbn = {}
+    for isbn, variants in isbn_variants.items():
+        for variant in variants:
+            if variant in books:
+                books_by_isbn[isbn] = books[variant]
+                break
+    return books_by_isbn
+
+
+def add_owned_books(user: User, books: Iterable[Book]) -> List[Book]:
+    """Add Books to the user's library in one transaction, return the new ones."""
+    books = {book.id: book for book in books}
+    with transaction.atomic():
+        owned_book_ids = set(
+            OwnedBook.objects.filter(user=user, book__in=books.values()).values_list(
+                "book_id", flat=True
+            )
+        )
+        new_books = [book for book in books.values() if book.id not in owned_book_ids]
+        OwnedBook.objects.bulk_create(
+            [OwnedBook(user=user, book=book) for book in new_books],
+            ignore_conflicts=True,
+        )
+    if new_books:
+        evict_user_pages([user.id])  # Bulk writes send no signals.
+    return new_books
+
+
+def _find_google_books_by_isbn(isbns: List[str]) -> Tuple[Dict[str, Book], Set[str]]:
+    volumes = lookup_volumes([{"isbn": isbn} for isbn in isbns], return_exceptions=True)
+    unavailable_isbns = {
+        isbn
+        for isbn, volume in zip(isbns, volumes)
+        if isinstance(volume, UpstreamUnavailable)
+    }
+    records_by_isbn = {
+        isbn: VolumeRecord.from_volume(volume)
+        for isbn, volume in zip(isbns, volumes)
+        if volume and isbn not in unavailable_isbns
+    }
+    books = ingest_records(
+        [record for record in records_by_isbn.values() if record.isbn]
+    )
+    enqueue_book_enrichment(books)
+
+    # Google may answer with another edition or the ISBN-13 form.
+    books = {book.isbn: book for book in books}
+    books_by_isbn = {
+        isbn: books[record.isbn]
+        for isbn, record in records_by_isbn.items()
+        if record.isbn
+    }
+    return books_by_isbn, unavailable_isbns
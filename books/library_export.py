@@ -0,0 +1,87 @@
+"""Streaming export of a user's library as CSV or JSON Lines.
+
+Owned Books are read in chunks of LIBRARY_EXPORT_CHUNK_SIZE, each with its
+own authors prefetch, and serialized one line at a time. Memory use does not
+depend on the size of the library and the first bytes go out right away.
+
+The CSV columns are a superset of what books.library_import understands, so
+an export can be imported again.
+"""
+
+import csv
+import json
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Author, OwnedBook, User
+
+EXPORT_FIELDS = [
+    "isbn",
+    "title",
+    "author",
+    "publisher",
+    "num_pages",
+    "progress",
+    "rating",
+    "review",
+    "added_at",
+]
+
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/jsonl",
+}
+
+
+def export_rows(user: User) -> Iterator[dict]:
+    ownedbooks = (
+        OwnedBook.objects.filter(user=user)
+        .select_related("book", "book__publisher")
+        .prefetch_related(
+            Prefetch("book__authors", queryset=Author.objects.order_by("full_name"))
+        )
+        .order_by("book__title", "id")
+    )
+    for ownedbook in ownedbooks.iterator(chunk_size=settings.LIBRARY_EXPORT_CHUNK_SIZE):
+        book = ownedbook.book
+        yield {
+            "isbn": book.isbn or "",
+            "title": book.title,
+            "author": ", ".join(author.full_name for author in book.authors.all()),
+            "publisher": book.publisher.name if book.publisher else "",
+            "num_pages": book.num_pages,
+            "progress": ownedbook.progress,
+            "rating": ownedbook.rating,
+            "review": ownedbook.review,
+            "added_at": ownedbook.created_at.isoformat(),
+        }
+
+
+def export_lines(user: User, format: str) -> Iterator[str]:
+    """Serialized export, one line per owned Book (plus the CSV header)."""
+    if format == "csv":
+        return _iter_csv(export_rows(user))
+    if format == "jsonl":
+        return _iter_jsonl(export_rows(user))
+    raise ValueError(f"Unknown export format {format!r}")
+
+
+def _iter_csv(rows: Iterable[dict]) -> Iterator[str]:
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _iter_jsonl(rows: Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each line back instead."""
+
+    def write(self, value):
+        return value
@@ -0,0 +1,263 @@
+"""Bulk import of a user's library from CSV, including Goodreads exports.
+
+Rows are parsed lazily and processed in batches, so memory use does not
+depend on the size of the file. Per batch, known ISBNs are resolved from the
+local catalog with one query and only the misses are looked up on Google
+Books, concurrently and rate limited. Rows that could not be looked up while
+Google Books was unavailable are reported apart from those not found.
+
+Besides the Goodreads export, a generic CSV with the (case-insensitive)
+columns isbn, title, author, progress, rating and review is understood.
+"""
+
+import csv
+import re
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from django.conf import settings
+
+from .enrichment import enqueue_book_enrichment
+from .google_books import lookup_volumes
+from .ingest import VolumeRecord, ingest_records
+from .isbn import normalize_isbn
+from .isbn_lookup import find_local_books_by_isbn
+from .models import Book, OwnedBook, Publisher, User
+from .page_cache import evict_user_pages
+from .upstream import UpstreamUnavailable
+
+GOODREADS_SHELVES = {
+    "read": OwnedBook.ReadStates.FULLY_READ,
+    "currently-reading": OwnedBook.ReadStates.PARTIALLY_READ,
+    "to-read": OwnedBook.ReadStates.UNREAD,
+}
+# Generic CSVs may use either the stored value or the label, e.g. "Fully Read".
+READ_STATES = {
+    **{value: value for value in OwnedBook.ReadStates.values},
+    **{label.lower(): value for value, label in OwnedBook.ReadStates.choices},
+}
+GOODREADS_MAX_RATING = 5
+MAX_RATING = 9
+
+
+@dataclass
+class ImportRow:
+    isbn: Optional[str] = None
+    title: str = ""
+    author: str = ""
+    progress: str = OwnedBook.ReadStates.UNREAD
+    rating: int = 0
+    review: str = ""
+
+
+@dataclass
+class ImportResult:
+    num_rows: int = 0
+    num_added: int = 0
+    num_already_owned: int = 0
+    not_found: List[str] = field(default_factory=list)
+    """ISBN or title of rows that could not be matched to a Book."""
+    unavailable: List[str] = field(default_factory=list)
+    """ISBN or title of rows not looked up, Google Books was unavailable.
+
+    Unlike the rows not found, importing these again later may add them.
+    """
+
+
+def parse_rows(lines: Iterable[str]) -> Iterator[ImportRow]:
+    """Parse CSV lines lazily, detecting the Goodreads format by its header."""
+    reader = csv.DictReader(lines)
+    fieldnames = reader.fieldnames or []
+    if "Book Id" in fieldnames and "Exclusive Shelf" in fieldnames:
+        parse_row = _parse_goodreads_row
+    else:
+        reader.fieldnames = [name.strip().lower() for name in fieldnames]
+        parse_row = _parse_generic_row
+
+    for values in reader:
+        row = parse_row(values)
+        if row.isbn or row.title:
+            yield row
+
+
+def import_library(user: User, rows: Iterable[ImportRow]) -> ImportResult:
+    result = ImportResult()
+    rows = iter(rows)
+    while batch := list(islice(rows, settings.LIBRARY_IMPORT_BATCH_SIZE)):
+        _import_batch(user, batch, result)
+    return result
+
+
+def _import_batch(user: User, rows: List[ImportRow], result: ImportResult):
+    result.num_rows += len(rows)
+
+    # Later rows win, e.g. a re-read book listed twice.
+    rows_by_key: Dict[str, ImportRow] = {}
+    for row in rows:
+        rows_by_key[_get_row_key(row)] = row
+
+    books_by_key = _find_local_books(rows_by_key)
+    google_books_by_key, unavailable_keys = _find_google_books(
+        {key: row for key, row in rows_by_key.items() if key not in books_by_key}
+    )
+    books_by_key.update(google_books_by_key)
+    for key, row in rows_by_key.items():
+        if key in unavailable_keys:
+            result.unavailable.append(row.isbn or row.title)
+        elif key not in books_by_key:
+            result.not_found.append(row.isbn or row.title)
+
+    owned_book_ids = set(
+        OwnedBook.objects.filter(user=user, book__in=books_by_key.values()).values_list(
+            "book_id", flat=True
+        )
+    )
+    new_ownedbooks = {}
+    for key, book in books_by_key.items():
+        if book.id in owned_book_ids:
+            result.num_already_owned += 1
+            continue
+        row = rows_by_key[key]
+        new_ownedbooks[book.id] = OwnedBook(
+            user=user,
+            book=book,
+            progress=row.progress,
+            rating=row.rating,
+            review=row.review,
+        )
+    OwnedBook.objects.bulk_create(new_ownedbooks.values(), ignore_conflicts=True)
+    if new_ownedbooks:
+        evict_user_pages([user.id])  # Bulk writes send no signals.
+    result.num_added += len(new_ownedbooks)
+
+
+def _get_row_key(row: ImportRow) -> str:
+    return row.isbn or f"{row.title}\0{row.author}"
+
+
+def _find_local_books(rows_by_key: Dict[str, ImportRow]) -> Dict[str, Book]:
+    """Match rows with ISBN against the catalog in a single query."""
+    books_by_isbn = find_local_books_by_isbn(
+        {row.isbn for row in rows_by_key.values() if row.isbn}
+    )
+    return {
+        key: books_by_isbn[row.isbn]
+        for key, row in rows_by_key.items()
+        if row.isbn in books_by_isbn
+    }
+
+
+def _find_google_books(
+    rows_by_key: Dict[str, ImportRow],
+) -> Tuple[Dict[str, Book], Set[str]]:
+    """Look rows up by ISBN, falling back to title/author for the misses.
+
+    Also returns the keys of rows that could not be looked up, as Google
+    Books was unavailable.
+    """
+    volumes_by_key = _lookup_volumes(
+        {key: {"isbn": row.isbn} for key, row in rows_by_key.items() if row.isbn}
+    )
+    volumes_by_key.update(
+        _lookup_volumes(
+            {
+                key: {"title": row.title, "author": row.author}
+                for key, row in rows_by_key.items()
+                if not isinstance(volumes_by_key.get(key), dict) and row.title
+            }
+        )
+    )
+    unavailable_keys = {
+        key
+        for key, volume in volumes_by_key.items()
+        if isinstance(volume, UpstreamUnavailable)
+    }
+
+    records_by_key = {
+        key: VolumeRecord.from_volume(volume)
+        for key, volume in volumes_by_key.items()
+        if key not in unavailable_keys
+    }
+    books = ingest_records(list(records_by_key.values()))
+    enqueue_book_enrichment(books)
+
+    books_by_isbn = {book.isbn: book for book in books if book.isbn}
+    # Like books.ingest, which may also match a Book with ISBN to a record
+    # without. Books without ISBN win, as they were created for the record.
+    books_by_publisher_and_title = {
+        (book.publisher_id, book.title): book
+        for book in sorted(books, key=lambda book: book.isbn is None)
+    }
+    publisher_ids = dict(
+        Publisher.objects.filter(
+            name__in={
+                record.publisher_name
+                for record in records_by_key.values()
+                if not record.isbn and record.publisher_name
+            }
+        ).values_list("name", "id")
+    )
+    books_by_key = {
+        key: (
+            books_by_isbn[record.isbn]
+            if record.isbn
+            else books_by_publisher_and_title[
+                (publisher_ids.get(record.publisher_name), record.title)
+            ]
+        )
+        for key, record in records_by_key.items()
+    }
+    return books_by_key, unavailable_keys
+
+
+def _lookup_volumes(
+    queries_by_key: Dict[str, dict],
+) -> Dict[str, Union[dict, UpstreamUnavailable]]:
+    """Volumes found by key, or the UpstreamUnavailable error of the lookup."""
+    volumes = lookup_volumes(list(queries_by_key.values()), return_exceptions=True)
+    return {key: volume for key, volume in zip(queries_by_key, volumes) if volume}
+
+
+def _parse_goodreads_row(values: dict) -> ImportRow:
+    isbn = _strip_goodreads_quoting(values.get("ISBN13")) or _strip_goodreads_quoting(
+        values.get("ISBN")
+    )
+    rating = _parse_int(values.get("My Rating"))
+    return ImportRow(
+        isbn=normalize_isbn(isbn) if isbn else None,
+        title=(values.get("Title") or "").strip(),
+        author=(values.get("Author") or "").strip(),
+        progress=GOODREADS_SHELVES.get(
+            values.get("Exclusive Shelf"), OwnedBook.ReadStates.UNREAD
+        ),
+        rating=round(
+            min(rating, GOODREADS_MAX_RATING) * MAX_RATING / GOODREADS_MAX_RATING
+        ),
+        review=re.sub(r"<br\s*/?>", "\n", values.get("My Review") or "").strip(),
+    )
+
+
+def _parse_generic_row(values: dict) -> ImportRow:
+    isbn = (values.get("isbn") or "").strip()
+    progress = (values.get("progress") or "").strip().lower()
+    return ImportRow(
+        isbn=normalize_isbn(isbn) if isbn else None,
+        title=(values.get("title") or "").strip(),
+        author=(values.get("author") or "").strip(),
+        progress=READ_STATES.get(progress, OwnedBook.ReadStates.UNREAD),
+        rating=min(_parse_int(values.get("rating")), MAX_RATING),
+        review=(values.get("review") or "").strip(),
+    )
+
+
+def _strip_goodreads_quoting(value: Optional[str]) -> str:
+    """Goodreads writes ISBNs as Excel formulas, e.g. '="0439023483"'."""
+    return (value or "").strip().lstrip("=").strip('"')
+
+
+def _parse_int(value: Optional[str]) -> int:
+    try:
+        return max(int(float(value)), 0)
+    except (TypeError, ValueError):
+        return 0
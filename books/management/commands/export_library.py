@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.library_export import FORMATS, export_lines
+from books.models import User
+
+
+class Command(BaseCommand):
+    help = "Export a user's owned books as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument(
+            "--output", help="File to write to, standard output by default."
+        )
+
+    def handle(self, *args, username, format, output, **options):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User {username!r} does not exist")
+
+        if output:
+            with open(output, "w", encoding="utf-8", newline="") as export_file:
+                export_file.writelines(export_lines(user, format))
+        else:
+            for line in export_lines(user, format):
+                self.stdout.write(line, ending="")
@@ -0,0 +1,37 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.library_import import import_library, parse_rows
+from books.models import User
+
+
+class Command(BaseCommand):
+    help = "Import a CSV or Goodreads export into a user's owned books."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path", help="CSV file to import.")
+
+    def handle(self, *args, username, path, **options):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User {username!r} does not exist")
+
+        with open(path, encoding="utf-8-sig", newline="") as csv_file:
+            try:
+                result = import_library(user, parse_rows(csv_file))
+            except (UnicodeDecodeError, csv.Error) as error:
+                raise CommandError(f"{path} is not a UTF-8 encoded CSV file: {error}")
+
+        self.stdout.write(
+            f"Read {result.num_rows} row(s): added {result.num_added}, "
+            f"{result.num_already_owned} already owned, "
+            f"{len(result.not_found)} not found, "
+            f"{len(result.unavailable)} unavailable"
+        )
+        for isbn_or_title in result.not_found:
+            self.stdout.write(f"  Not found: {isbn_or_title}")
+        for isbn_or_title in result.unavailable:
+            self.stdout.write(f"  Unavailable, retry later: {isbn_or_title}")
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books.enrichment import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Process queued Book enrichment jobs (thumbnail sizes, metadata)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no due jobs left instead of polling.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of jobs to claim per round.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.ENRICHMENT_POLL_INTERVAL,
+            help="Seconds to sleep when there are no due jobs.",
+        )
+
+    def handle(self, *args, once, batch_size, poll_interval, **options):
+        while True:
+            num_processed = run_pending_jobs(limit=batch_size)
+            if num_processed:
+                self.stdout.write(f"Processed {num_processed} job(s)")
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.seeding import seed_library
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic catalog and user libraries for scale testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=1_000_000)
+        parser.add_argument("--authors", type=int, default=200_000)
+        parser.add_argument("--publishers", type=int, default=20_000)
+        parser.add_argument("--users", type=int, default=1_000)
+        parser.add_argument(
+            "--library-size",
+            type=int,
+            default=200,
+            help="Median number of owned books per user.",
+        )
+        parser.add_argument(
+            "--zipf-exponent",
+            type=float,
+            default=1.0,
+            help="Skew of book, author and publisher popularity.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seeding again with the same seed adds nothing.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=2000, help="Rows per INSERT."
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=50_000, help="Rows per transaction."
+        )
+        parser.add_argument(
+            "--no-index",
+            action="store_false",
+            dest="index",
+            help="Leave the Books out of the local search index.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        log = self.stdout.write if options["verbosity"] > 1 else lambda message: None
+        result = seed_library(
+            num_books=options["books"],
+            num_authors=options["authors"],
+            num_publishers=options["publishers"],
+            num_users=options["users"],
+            library_size=options["library_size"],
+            zipf_exponent=options["zipf_exponent"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            chunk_size=options["chunk_size"],
+            index=options["index"],
+            log=log,
+        )
+        self.stdout.write(
+            f"Seeded {result.num_books} book(s), {result.num_authors} author(s), "
+            f"{result.num_publishers} publisher(s), {result.num_users} user(s), "
+            f"added {result.num_owned_books} owned book(s) "
+            f"in {time.monotonic() - start:.0f}s"
+        )
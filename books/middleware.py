@@ -0,0 +1,160 @@
+import json
+import logging
+import random
+import re
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from . import performance
+
+logger = logging.getLogger("books.performance")
+
+# Whitespace is significant in these, or might be in the case of scripts.
+_PRESERVED_ELEMENTS = re.compile(
+    r"(<(pre|textarea|script|style)\b.*?</\2\s*>)", re.DOTALL | re.IGNORECASE
+)
+_INDENTED_LINE_BREAKS = re.compile(r"\s*\n\s*")
+
+
+class HtmlMinifyMiddleware:
+    """Strip template indentation from HTML responses, see MINIFY_HTML.
+
+    Each run of whitespace containing a line break becomes a single line
+    break, which renders the same. Tiles of large grids are mostly
+    indentation, so this saves more than its cost even before compression.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            # Under ASGI, Django would otherwise run the middleware in a thread.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(await self.get_response(request))
+
+    def process_response(self, response):
+        if (
+            settings.MINIFY_HTML
+            and not response.streaming
+            and response.get("Content-Type", "").startswith("text/html")
+            and not response.has_header("Content-Encoding")
+        ):
+            response.content = minify_html(response.content.decode(response.charset))
+            if response.has_header("Content-Length"):
+                response["Content-Length"] = str(len(response.content))
+        return response
+
+
+def minify_html(html: str) -> str:
+    parts = _PRESERVED_ELEMENTS.split(html)
+    # split() returns text, element, tag name, text, element, tag name, ...
+    return "".join(
+        _INDENTED_LINE_BREAKS.sub("\n", part) if i % 3 == 0 else part
+        for i, part in enumerate(parts)
+        if i % 3 != 2
+    )
+
+
+class PerformanceMiddleware:
+    """Account time of a sample of requests to database, upstream and templates.
+
+    Results go out as a Server-Timing header (shown by browser dev tools)
+    and as a JSON log line on the books.performance logger. Only a
+    PERFORMANCE_SAMPLE_RATE fraction of requests is instrumented.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with self.instrument() as metrics, self.record_queries():
+            response = self.get_response(request)
+        return self.report(request, response, metrics)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        # Database connections belong to threads, the wrappers have to be
+        # installed in the one sync views and the ORM run in.
+        with self.instrument() as metrics:
+            queries = ExitStack()
+            await sync_to_async(queries.enter_context)(self.record_queries())
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(queries.close)()
+        return self.report(request, response, metrics)
+
+    @contextmanager
+    def instrument(self):
+        metrics = performance.start_request()
+        start = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            performance.end_request()
+            metrics.total_time = time.perf_counter() - start
+
+    @contextmanager
+    def record_queries(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(performance.record_query)
+                )
+            yield
+
+    def report(self, request, response, metrics):
+        num_upstream_calls = sum(metrics.upstream_calls.values())
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.db_queries} queries"',
+                f"upstream;dur={metrics.upstream_time * 1000:.1f};"
+                f'desc="{num_upstream_calls} calls, {metrics.upstream_bytes} bytes"',
+                f"template;dur={metrics.template_time * 1000:.1f}",
+                f"total;dur={metrics.total_time * 1000:.1f}",
+            ]
+        )
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "total_ms": round(metrics.total_time * 1000, 1),
+                    "db_queries": metrics.db_queries,
+                    "db_ms": round(metrics.db_time * 1000, 1),
+                    "upstream_calls": metrics.upstream_calls,
+                    "upstream_bytes": metrics.upstream_bytes,
+                    "upstream_ms": round(metrics.upstream_time * 1000, 1),
+                    "template_ms": round(metrics.template_time * 1000, 1),
+                }
+            )
+        )
+        return response
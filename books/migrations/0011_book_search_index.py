@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 table for books.search_index.SqliteFTS5SearchBackend."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    schema_editor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_book_fts USING fts5(
+            title,
+            description,
+            authors,
+            publisher,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """)
+    schema_editor.execute("""
+        INSERT INTO books_book_fts (rowid, title, description, authors, publisher)
+        SELECT
+            book.id,
+            book.title,
+            book.description,
+            COALESCE((
+                SELECT group_concat(author.full_name, ' ')
+                FROM books_book_authors book_author
+                JOIN books_author author ON author.id = book_author.author_id
+                WHERE book_author.book_id = book.id
+            ), ''),
+            COALESCE(publisher.name, '')
+        FROM books_book book
+        LEFT JOIN books_publisher publisher ON publisher.id = book.publisher_id
+        """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    schema_editor.execute("DROP TABLE IF EXISTS books_book_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0010_ownedbook_progress"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            code=create_search_index,
+            reverse_code=drop_search_index,
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 6.1.2 on 2026-10-17 20:46
+
+from django.db import migrations, models
+
+
+def merge_duplicates(apps, schema_editor):
+    """Make existing rows satisfy the new unique constraints.
+
+    Duplicates are merged into the oldest row, moving their relations over.
+    """
+    Author = apps.get_model("books", "Author")
+    Book = apps.get_model("books", "Book")
+    OwnedBook = apps.get_model("books", "OwnedBook")
+    Publisher = apps.get_model("books", "Publisher")
+    BookAuthor = Book.authors.through
+
+    kept_author_ids = {}
+    for author in Author.objects.order_by("id"):
+        kept_author_id = kept_author_ids.setdefault(author.full_name, author.id)
+        if kept_author_id != author.id:
+            book_ids = BookAuthor.objects.filter(author_id=author.id).values_list(
+                "book_id", flat=True
+            )
+            BookAuthor.objects.bulk_create(
+                [
+                    BookAuthor(book_id=book_id, author_id=kept_author_id)
+                    for book_id in book_ids
+                ],
+                ignore_conflicts=True,
+            )
+            author.delete()
+
+    kept_publisher_ids = {}
+    for publisher in Publisher.objects.order_by("id"):
+        kept_publisher_id = kept_publisher_ids.setdefault(publisher.name, publisher.id)
+        if kept_publisher_id != publisher.id:
+            Book.objects.filter(publisher_id=publisher.id).update(
+                publisher_id=kept_publisher_id
+            )
+            publisher.delete()
+
+    kept_ownedbook_ids = {}
+    for ownedbook in OwnedBook.objects.order_by("id"):
+        key = (ownedbook.user_id, ownedbook.book_id)
+        if kept_ownedbook_ids.setdefault(key, ownedbook.id) != ownedbook.id:
+            ownedbook.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0012_enrichmentjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            code=merge_duplicates,
+            reverse_code=migrations.RunPython.noop,
+        ),
+        migrations.AlterField(
+            model_name="author",
+            name="full_name",
+            field=models.CharField(max_length=128, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="title",
+            field=models.CharField(db_index=True, max_length=128),
+        ),
+        migrations.AlterField(
+            model_name="publisher",
+            name="name",
+            field=models.CharField(max_length=128, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["publisher", "title"], name="books_book_publish_af8922_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ownedbook",
+            constraint=models.UniqueConstraint(
+                fields=("user", "book"), name="unique_owned_book"
+            ),
+        ),
+    ]
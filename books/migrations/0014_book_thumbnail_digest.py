@@ -0,0 +1,30 @@
+# Generated by Django 6.1.2 on 2026-10-17 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0013_add_indexes_and_unique_constraints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="thumbnail_digest",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="enrichmentjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("thumbnail_dimensions", "Thumbnail Dimensions"),
+                    ("thumbnail_mirror", "Thumbnail Mirror"),
+                    ("metadata", "Metadata"),
+                ],
+                max_length=32,
+            ),
+        ),
+    ]
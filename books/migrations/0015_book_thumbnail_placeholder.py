@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-17 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0014_book_thumbnail_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="thumbnail_placeholder",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-17 21:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0015_book_thumbnail_placeholder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="enrichmentjob",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
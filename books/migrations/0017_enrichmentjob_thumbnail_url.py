@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-17 21:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0016_enrichmentjob_claimed_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="enrichmentjob",
+            name="thumbnail_url",
+            field=models.URLField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -1,11 +1,15 @@
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from fractions import Fraction
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MaxValueValidator
 from django.db import models
-from PIL import ImageFile
-import requests
+from django.utils import timezone
+
+from .http_client import get_http_session
+from .images import read_image_dimensions
+from .thumbnails import get_thumbnail_srcsets, get_thumbnail_url
 
 
 class BaseModel(models.Model):
@@ -23,21 +27,21 @@ class User(BaseModel, AbstractUser):
 
 
 class Author(BaseModel):
-    full_name = models.CharField(max_length=128)
+    full_name = models.CharField(max_length=128, unique=True)
 
     def __str__(self):
         return self.full_name
 
 
 class Publisher(BaseModel):
-    name = models.CharField(max_length=128)
+    name = models.CharField(max_length=128, unique=True)
 
     def __str__(self):
         return self.name
 
 
 class Book(BaseModel):
-    title = models.CharField(max_length=128)
+    title = models.CharField(max_length=128, db_index=True)
     isbn = models.CharField(
         unique=True,
         blank=True,
@@ -59,19 +63,34 @@ class Book(BaseModel):
     thumbnail_url = models.URLField(default=None, blank=True, null=True)
     thumbnail_width = models.PositiveIntegerField(default=0)
     thumbnail_height = models.PositiveIntegerField(default=0)
+    thumbnail_digest = models.CharField(default="", blank=True, max_length=64)
+    """SHA-256 of the mirrored cover, see books.thumbnails."""
+    thumbnail_placeholder = models.TextField(default="", blank=True)
+    """Data URI of a tiny blurred version of the cover."""
     info_url = models.URLField(default=None, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Matching Books without ISBN, see books.ingest.
+            models.Index(fields=["publisher", "title"]),
+        ]
+
     def __str__(self):
         return f"{self.title} {self.isbn or ''}"
 
-    def update_thumbnail_dimensions_from_url(self) -> bool:
-        if self.thumbnail_url:
-            thumbnail_dimensions = _get_image_dimensions_from_url(self.thumbnail_url)
-            if thumbnail_dimensions:
-                self.thumbnail_width, self.thumbnail_height = thumbnail_dimensions
-                self.save(update_fields=["thumbnail_width", "thumbnail_height"])
-                return True
-        return False
+    @property
+    def display_thumbnail_url(self) -> Optional[str]:
+        """The mirrored cover if there is one, otherwise Google's."""
+        if self.thumbnail_digest:
+            return get_thumbnail_url(self.thumbnail_digest, self.thumbnail_width)
+        return self.thumbnail_url
+
+    @property
+    def thumbnail_srcsets(self) -> Dict[str, str]:
+        """``srcset`` values per format of the mirrored cover, if any."""
+        if self.thumbnail_digest:
+            return get_thumbnail_srcsets(self.thumbnail_digest, self.thumbnail_width)
+        return {}
 
     @property
     def thumbnail_ratio(self):
@@ -110,16 +129,76 @@ class OwnedBook(BaseModel):
     rating = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(9)])
     """User's rating between 0-9."""
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "book"], name="unique_owned_book"),
+        ]
+
     def __str__(self):
         return f"{self.user} -> {self.book} {'[x]' if self.progress == self.ReadStates.FULLY_READ else '[ ]'}"
 
 
-def _get_image_dimensions_from_url(image_url: str) -> Optional[Tuple[int, int]]:
-    # https://stackoverflow.com/a/70514550
-    resume_header = {"Range": "bytes=0-2000000"}
-    data = requests.get(image_url, stream=True, headers=resume_header).content
-    parser = ImageFile.Parser()
-    parser.feed(data)
-    if parser.image:
-        return parser.image.size
-    return None
+class EnrichmentJob(BaseModel):
+    """Deferred work on a Book, processed by the run_enrichment_worker command.
+
+    There is at most one job per Book and kind, enqueueing again reuses it.
+    """
+
+    class Kinds(models.TextChoices):
+        THUMBNAIL_DIMENSIONS = "thumbnail_dimensions", "Thumbnail Dimensions"
+        THUMBNAIL_MIRROR = "thumbnail_mirror", "Thumbnail Mirror"
+        METADATA = "metadata", "Metadata"
+
+    class States(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    book = models.ForeignKey(
+        "books.Book", on_delete=models.CASCADE, related_name="enrichment_jobs"
+    )
+    kind = models.CharField(choices=Kinds.choices, max_length=32)
+    state = models.CharField(
+        default=States.PENDING, choices=States.choices, max_length=16
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(default=None, blank=True, null=True)
+    """When a worker started running the job, see ENRICHMENT_LEASE_TIMEOUT."""
+    thumbnail_url = models.URLField(default=None, blank=True, null=True)
+    """The Book's cover when the job last ran, a new one requeues thumbnail jobs."""
+    last_error = models.TextField(default="", blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "kind"], name="unique_enrichment_job_per_book"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["state", "run_after"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.book_id} [{self.state}]"
+
+
+def _get_image_dimensions_from_url(
+    image_url: str, timeout: Optional[float] = None
+) -> Optional[Tuple[int, int]]:
+    """Stream the image only until its header reveals the dimensions.
+
+    Leaving the `with` block early closes the connection, so usually only
+    the first few hundred bytes of a cover are ever transferred.
+    """
+    max_bytes = settings.THUMBNAIL_PROBE_MAX_BYTES
+    resume_header = {"Range": f"bytes=0-{max_bytes - 1}"}
+    with get_http_session().get(
+        image_url, stream=True, headers=resume_header, timeout=timeout
+    ) as response:
+        dimensions, _ = read_image_dimensions(
+            response.iter_content(chunk_size=settings.THUMBNAIL_PROBE_CHUNK_SIZE),
+            max_bytes=max_bytes,
+        )
+    return dimensions
@@ -0,0 +1,59 @@
+"""Cached pages of the Owned Books grid, see views.OwnedBookList.
+
+Rendered pages are cached per user under a version token. Evicting a
+user's pages deletes the token, so the next request starts a new version
+and the old pages are never looked up again (LRU culling removes them).
+Receivers in books.signals evict the owners of anything shown on the
+tiles; bulk writes send no signals and evict explicitly.
+
+The tiles themselves are cached separately, by Owned Book id and the
+Book's modified_at (see books/ownedbook_list_page.html), so a page rebuilt
+after an eviction still reuses every tile that did not change.
+"""
+
+import uuid
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import Book, OwnedBook
+
+
+def get_page_cache_key(user_id: int, cursor: str) -> str:
+    cache = caches[settings.OWNED_BOOKS_PAGE_CACHE_ALIAS]
+    version_key = _get_version_key(user_id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(version_key)
+    return f"ownedbook-list:{user_id}:{version}:{cursor}"
+
+
+def evict_user_pages(user_ids: Iterable[int]):
+    caches[settings.OWNED_BOOKS_PAGE_CACHE_ALIAS].delete_many(
+        [_get_version_key(user_id) for user_id in set(user_ids)]
+    )
+
+
+def evict_owner_pages(book_ids: Iterable[int]):
+    """Evict the pages of everyone owning one of the given Books."""
+    book_ids = list(book_ids)
+    if book_ids:
+        evict_user_pages(
+            OwnedBook.objects.filter(book__in=book_ids)
+            .values_list("user_id", flat=True)
+            .distinct()
+        )
+
+
+def touch_books(book_ids: Iterable[int]):
+    """Bump modified_at of Books whose tiles changed without a save()."""
+    book_ids = list(book_ids)
+    Book.objects.filter(id__in=book_ids).update(modified_at=timezone.now())
+    evict_owner_pages(book_ids)
+
+
+def _get_version_key(user_id: int) -> str:
+    return f"ownedbook-list-version:{user_id}"
@@ -0,0 +1,128 @@
+"""Per-request accounting of where the time goes, see PerformanceMiddleware.
+
+The middleware puts a RequestMetrics into a context variable for sampled
+requests. Database queries, upstream HTTP calls (through the shared session
+of books.http_client) and template renders add themselves to it. Outside of
+a sampled request every hook is a single context variable lookup.
+"""
+
+import threading
+import time
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as DjangoTemplate
+
+
+@dataclass
+class RequestMetrics:
+    db_queries: int = 0
+    db_time: float = 0.0
+    upstream_calls: Dict[str, int] = field(default_factory=dict)
+    """Number of calls per host."""
+    upstream_bytes: int = 0
+    upstream_time: float = 0.0
+    template_time: float = 0.0
+    total_time: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    """Upstream calls may come from worker threads, see propagate_context()."""
+
+
+_current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "current_metrics", default=None
+)
+
+
+def start_request() -> RequestMetrics:
+    metrics = RequestMetrics()
+    _current_metrics.set(metrics)
+    return metrics
+
+
+def end_request():
+    _current_metrics.set(None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute_wrapper, see connection.execute_wrapper()."""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def record_upstream_response(response, *args, stream=False, **kwargs):
+    """Response hook of the shared HTTP session.
+
+    Latency is the time until the headers arrived. For streamed responses
+    only a Content-Length is known up front, the probe may read less.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return
+
+    if stream:
+        num_bytes = int(response.headers.get("Content-Length") or 0)
+    else:
+        num_bytes = len(response.content)
+    host = urlsplit(response.url).hostname or ""
+    with metrics.lock:
+        metrics.upstream_calls[host] = metrics.upstream_calls.get(host, 0) + 1
+        metrics.upstream_bytes += num_bytes
+        metrics.upstream_time += response.elapsed.total_seconds()
+
+
+def propagate_context(function: Callable) -> Callable:
+    """Run ``function`` in a copy of the caller's context, e.g. in a thread pool.
+
+    Thread pools do not inherit context variables, so upstream calls made
+    from their threads would not be accounted to the request otherwise.
+    """
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates recording the render time of top level templates.
+
+    Included templates render as part of their parent and are not counted
+    twice.
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class _TimedTemplate:
+    def __init__(self, template: DjangoTemplate):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return self.template.render(context, request)
+
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
@@ -0,0 +1,144 @@
+"""Local full-text search over the Book catalog.
+
+Everything users have ever found through Google Books already lives in the
+Book, Author and Publisher tables, so Search asks the local index first and
+only goes upstream when it does not know enough matches.
+
+The backend is configured via settings.BOOKS_SEARCH_BACKEND and kept in
+sync by the receivers in books/signals.py plus explicit index_books() calls
+for bulk writes, which do not send signals.
+"""
+
+import re
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .models import Author, Book, Publisher
+
+FTS_TABLE = "books_book_fts"
+"""Created by migration 0011_book_search_index on SQLite."""
+
+
+def get_search_backend() -> "SearchBackend":
+    return import_string(settings.BOOKS_SEARCH_BACKEND)()
+
+
+class SearchBackend:
+    """Interface of local catalog search backends."""
+
+    def index_books(self, book_ids: Iterable[int]):
+        """(Re)index the given Books, e.g. after they have been saved."""
+        raise NotImplementedError
+
+    def remove_books(self, book_ids: Iterable[int]):
+        raise NotImplementedError
+
+    def search(
+        self,
+        title: Optional[str] = None,
+        author: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[int]:
+        """Return the IDs of matching Books, best matches first."""
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """Index-less fallback for databases without a full-text engine."""
+
+    def index_books(self, book_ids):
+        pass
+
+    def remove_books(self, book_ids):
+        pass
+
+    def search(self, title=None, author=None, limit=10):
+        if not any([title, author]):
+            return []
+
+        books = Book.objects.all()
+        for token in _tokenize(title):
+            books = books.filter(title__icontains=token)
+        for token in _tokenize(author):
+            books = books.filter(authors__full_name__icontains=token)
+        return list(
+            books.order_by("title").values_list("id", flat=True).distinct()[:limit]
+        )
+
+
+class SqliteFTS5SearchBackend(SearchBackend):
+    """Inverted index in an SQLite FTS5 table, ranked by bm25.
+
+    Indexes title, description, author full names and publisher name, with
+    prefix matching so partially typed words find their books as well.
+    """
+
+    chunk_size = 500
+
+    def index_books(self, book_ids):
+        book_ids = list(book_ids)
+        for offset in range(0, len(book_ids), self.chunk_size):
+            chunk = book_ids[offset : offset + self.chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk
+                )
+                cursor.execute(
+                    f"""
+                    INSERT INTO {FTS_TABLE}
+                        (rowid, title, description, authors, publisher)
+                    SELECT
+                        book.id,
+                        book.title,
+                        book.description,
+                        COALESCE((
+                            SELECT group_concat(author.full_name, ' ')
+                            FROM {Book.authors.through._meta.db_table} book_author
+                            JOIN {Author._meta.db_table} author
+                                ON author.id = book_author.author_id
+                            WHERE book_author.book_id = book.id
+                        ), ''),
+                        COALESCE(publisher.name, '')
+                    FROM {Book._meta.db_table} book
+                    LEFT JOIN {Publisher._meta.db_table} publisher
+                        ON publisher.id = book.publisher_id
+                    WHERE book.id IN ({placeholders})
+                    """,
+                    chunk,
+                )
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        for offset in range(0, len(book_ids), self.chunk_size):
+            chunk = book_ids[offset : offset + self.chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk
+                )
+
+    def search(self, title=None, author=None, limit=10):
+        expressions = [
+            f'{column} : "{token}"*'
+            for column, text in (("title", title), ("authors", author))
+            for token in _tokenize(text)
+        ]
+        if not expressions:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                "ORDER BY rank LIMIT %s",
+                [" AND ".join(expressions), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def _tokenize(text: Optional[str]) -> List[str]:
+    """Split into words, which also keeps FTS5 query syntax out of MATCH."""
+    return re.findall(r"\w+", text or "")
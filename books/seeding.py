@@ -0,0 +1,308 @@
+"""Synthetic catalogs and libraries for scale testing, see seed_library.
+
+Popularity follows a Zipf distribution: a few publishers, authors and
+books account for most of the publications and owned books, like in a real
+catalog. Library sizes are log-normal around a median, progress and
+ratings vary the way readers use them.
+
+Rows are written with bulk_create() in batches, one transaction per chunk,
+and named deterministically from the seed. Seeding again with the same
+seed adds nothing, existing rows are reused through their unique names,
+ISBNs and usernames.
+"""
+
+import itertools
+import math
+import random
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Sequence
+
+from django.contrib.auth.hashers import make_password
+from django.db import models, transaction
+
+from .models import Author, Book, OwnedBook, Publisher, User
+from .page_cache import evict_user_pages
+from .search_index import get_search_backend
+
+# fmt: off
+FIRST_NAMES = (
+    "Ada", "Alan", "Anna", "Boris", "Carmen", "Chinua", "Clara", "Daniel",
+    "Elena", "Emil", "Frank", "Grace", "Haruki", "Ines", "Isaac", "Jane",
+    "Jorge", "Kazuo", "Leo", "Lin", "Margaret", "Maya", "Nadia", "Olga",
+    "Omar", "Paul", "Rosa", "Sofia", "Tomas", "Ursula", "Virginia", "Yuki",
+)
+LAST_NAMES = (
+    "Achebe", "Atwood", "Borges", "Calvino", "Ishiguro", "Dickens", "Eco",
+    "Ferrante", "Garcia", "Herbert", "Hesse", "Kafka", "Le Guin", "Lem",
+    "Mann", "Morrison", "Murakami", "Nabokov", "Orwell", "Pamuk", "Rowling",
+    "Sagan", "Smith", "Tolstoy", "Tokarczuk", "Twain", "Woolf", "Zola",
+)
+TITLE_ADJECTIVES = (
+    "Silent", "Last", "Broken", "Hidden", "Golden", "Lost", "Northern",
+    "Burning", "Endless", "Quiet", "Secret", "Distant", "Small", "Final",
+)
+TITLE_NOUNS = (
+    "River", "Garden", "Empire", "Winter", "House", "Machine", "Ocean",
+    "Library", "Station", "Kingdom", "Forest", "Letter", "Island", "Night",
+    "Mountain", "City", "Mirror", "Archive", "Harbor", "Storm",
+)
+PUBLISHER_NAMES = (
+    "Penguin", "Vintage", "Tor", "Faber", "Gallimard", "Suhrkamp", "Orbit",
+    "Picador", "Hachette", "Anchor", "Bloomsbury", "Harper", "Macmillan",
+)
+# fmt: on
+
+# Weights of choices, roughly what a reading tracker sees.
+PROGRESS_WEIGHTS = {
+    OwnedBook.ReadStates.UNREAD: 45,
+    OwnedBook.ReadStates.PARTIALLY_READ: 15,
+    OwnedBook.ReadStates.FULLY_READ: 40,
+}
+RATING_WEIGHTS = [55, 1, 1, 2, 3, 5, 8, 10, 9, 6]  # 0 is unrated.
+AUTHOR_COUNT_WEIGHTS = [0, 80, 15, 5]
+REVIEW_PROBABILITY = 0.1
+COVER_PROBABILITY = 0.8
+
+
+@dataclass
+class SeedResult:
+    num_authors: int = 0
+    num_publishers: int = 0
+    num_books: int = 0
+    num_users: int = 0
+    num_owned_books: int = 0
+    """Owned Books added, existing ones are not counted."""
+
+
+def seed_library(
+    num_books: int,
+    num_authors: int,
+    num_publishers: int,
+    num_users: int,
+    library_size: int,
+    zipf_exponent: float = 1.0,
+    seed: int = 0,
+    batch_size: int = 2000,
+    chunk_size: int = 50_000,
+    index: bool = True,
+    log: Callable[[str], None] = lambda message: None,
+) -> SeedResult:
+    """Create a catalog and libraries of ``num_users`` users.
+
+    ``library_size`` is the median number of owned books per user. Without
+    ``index``, the Books are left out of the local search index, e.g. to
+    index them later or when search is not under test.
+    """
+    rng = random.Random(seed)
+    result = SeedResult()
+
+    publisher_ids = _create_named(
+        Publisher,
+        "name",
+        (_get_publisher_name(i) for i in range(num_publishers)),
+        batch_size,
+        chunk_size,
+    )
+    result.num_publishers = len(publisher_ids)
+    log(f"Publishers: {result.num_publishers}")
+
+    author_ids = _create_named(
+        Author,
+        "full_name",
+        (_get_author_name(i) for i in range(num_authors)),
+        batch_size,
+        chunk_size,
+    )
+    result.num_authors = len(author_ids)
+    log(f"Authors: {result.num_authors}")
+
+    book_ids = []
+    publisher_weights = _get_zipf_cum_weights(len(publisher_ids), zipf_exponent)
+    author_weights = _get_zipf_cum_weights(len(author_ids), zipf_exponent)
+    isbn_offset = rng.randrange(10**9)
+    for chunk in _chunked(range(num_books), chunk_size):
+        books = [
+            _make_book(rng, i, isbn_offset, publisher_ids, publisher_weights)
+            for i in chunk
+        ]
+        with transaction.atomic():
+            ids_by_isbn = _create_unique(Book, "isbn", books, batch_size)
+            chunk_book_ids = [ids_by_isbn[book.isbn] for book in books]
+            if author_ids:
+                Book.authors.through.objects.bulk_create(
+                    [
+                        Book.authors.through(book_id=book_id, author_id=author_id)
+                        for book_id in chunk_book_ids
+                        for author_id in _sample_distinct(
+                            rng,
+                            author_ids,
+                            author_weights,
+                            rng.choices(
+                                range(len(AUTHOR_COUNT_WEIGHTS)),
+                                AUTHOR_COUNT_WEIGHTS,
+                            )[0],
+                        )
+                    ],
+                    batch_size=batch_size,
+                    ignore_conflicts=True,
+                )
+            if index:
+                get_search_backend().index_books(chunk_book_ids)
+        book_ids += chunk_book_ids
+        log(f"Books: {len(book_ids)}/{num_books}")
+    result.num_books = len(book_ids)
+
+    users = [
+        User(username=f"reader{seed}-{i}", password=make_password(None))
+        for i in range(num_users)
+    ]
+    user_ids = list(_create_unique(User, "username", users, batch_size).values())
+    result.num_users = len(user_ids)
+    log(f"Users: {result.num_users}")
+
+    book_weights = _get_zipf_cum_weights(len(book_ids), zipf_exponent)
+    # Sampling distinct books gets slow as a library approaches the catalog.
+    max_library_size = max(1, len(book_ids) // 4)
+    ownedbooks = []
+    for user_id in user_ids:
+        size = round(rng.lognormvariate(math.log(library_size), 1.0))
+        size = min(max(size, 1), max_library_size) if book_ids else 0
+        ownedbooks += [
+            _make_ownedbook(rng, user_id, book_id)
+            for book_id in _sample_distinct(rng, book_ids, book_weights, size)
+        ]
+        if len(ownedbooks) >= chunk_size:
+            result.num_owned_books += _create_ownedbooks(ownedbooks, batch_size)
+            ownedbooks = []
+            log(f"Owned Books added: {result.num_owned_books}")
+    result.num_owned_books += _create_ownedbooks(ownedbooks, batch_size)
+    log(f"Owned Books added: {result.num_owned_books}")
+
+    # Bulk writes send no signals.
+    evict_user_pages(user_ids)
+    return result
+
+
+def _make_book(rng, i, isbn_offset, publisher_ids, publisher_weights) -> Book:
+    title = (
+        f"The {rng.choice(TITLE_ADJECTIVES)} {rng.choice(TITLE_NOUNS)}"
+        if rng.random() < 0.5
+        else f"{rng.choice(TITLE_NOUNS)} of the {rng.choice(TITLE_NOUNS)}"
+    )
+    isbn = f"979{(isbn_offset + i) % 10**10:010d}"
+    has_cover = rng.random() < COVER_PROBABILITY
+    return Book(
+        title=f"{title} {i}" if i >= 1000 else title,
+        isbn=isbn,
+        publisher_id=(
+            rng.choices(publisher_ids, cum_weights=publisher_weights)[0]
+            if publisher_ids
+            else None
+        ),
+        description=f"A novel about a {title.lower()}.",
+        num_pages=int(rng.triangular(60, 1200, 280)),
+        # Reserved domain, nothing is ever fetched from it.
+        thumbnail_url=f"https://covers.invalid/{isbn}.jpg" if has_cover else None,
+        thumbnail_width=128 if has_cover else 0,
+        thumbnail_height=192 if has_cover else 0,
+    )
+
+
+def _make_ownedbook(rng, user_id, book_id) -> OwnedBook:
+    progress = rng.choices(list(PROGRESS_WEIGHTS), list(PROGRESS_WEIGHTS.values()))[0]
+    rating = 0
+    if progress != OwnedBook.ReadStates.UNREAD:
+        rating = rng.choices(range(len(RATING_WEIGHTS)), RATING_WEIGHTS)[0]
+    review = ""
+    if rating and rng.random() < REVIEW_PROBABILITY:
+        review = f"Rated {rating}. " + " ".join(
+            rng.choices(TITLE_NOUNS, k=rng.randint(5, 60))
+        )
+    return OwnedBook(
+        user_id=user_id,
+        book_id=book_id,
+        progress=progress,
+        rating=rating,
+        review=review,
+    )
+
+
+def _create_ownedbooks(ownedbooks: List[OwnedBook], batch_size: int) -> int:
+    """Create the Owned Books not owned yet, return how many were."""
+    libraries = OwnedBook.objects.filter(
+        user__in={ownedbook.user_id for ownedbook in ownedbooks}
+    )
+    with transaction.atomic():
+        num_owned_books = libraries.count()
+        OwnedBook.objects.bulk_create(
+            ownedbooks, batch_size=batch_size, ignore_conflicts=True
+        )
+        return libraries.count() - num_owned_books
+
+
+def _create_named(
+    model, field_name: str, names: Iterable[str], batch_size, chunk_size
+) -> List[int]:
+    ids = []
+    for chunk in _chunked(names, chunk_size):
+        with transaction.atomic():
+            ids += _create_unique(
+                model,
+                field_name,
+                [model(**{field_name: name}) for name in chunk],
+                batch_size,
+            ).values()
+    return ids
+
+
+def _create_unique(
+    model, field_name: str, objs: List[models.Model], batch_size
+) -> Dict[str, int]:
+    """bulk_create() skipping existing rows, return all IDs by ``field_name``.
+
+    Primary keys are not set with ignore_conflicts, so they are read back.
+    """
+    model.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+    ids = {}
+    for batch in _chunked([getattr(obj, field_name) for obj in objs], batch_size):
+        ids.update(
+            model.objects.filter(**{f"{field_name}__in": batch}).values_list(
+                field_name, "id"
+            )
+        )
+    return ids
+
+
+def _get_zipf_cum_weights(n: int, exponent: float) -> List[float]:
+    """Cumulative weights of ranks 1 to n, for random.choices()."""
+    return list(itertools.accumulate(1 / rank**exponent for rank in range(1, n + 1)))
+
+
+def _sample_distinct(rng, population: Sequence, cum_weights, k: int) -> set:
+    chosen = set()
+    k = min(k, len(population))
+    while len(chosen) < k:
+        chosen.update(
+            rng.choices(population, cum_weights=cum_weights, k=k - len(chosen))
+        )
+    return chosen
+
+
+def _get_author_name(i: int) -> str:
+    first_name = FIRST_NAMES[i % len(FIRST_NAMES)]
+    last_name = LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]
+    # Unique names, Author.full_name is.
+    generation = i // (len(FIRST_NAMES) * len(LAST_NAMES))
+    return f"{first_name} {last_name}" + (f" {generation + 1}" if generation else "")
+
+
+def _get_publisher_name(i: int) -> str:
+    name = PUBLISHER_NAMES[i % len(PUBLISHER_NAMES)]
+    generation = i // len(PUBLISHER_NAMES)
+    return f"{name} {generation + 1}" if generation else name
+
+
+def _chunked(iterable: Iterable, chunk_size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
@@ -0,0 +1,104 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Author, Book, OwnedBook, Publisher
+from .page_cache import evict_owner_pages, evict_user_pages, touch_books
+from .search_index import get_search_backend
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, **kwargs):
+    get_search_backend().index_books([instance.id])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    get_search_backend().remove_books([instance.id])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def index_books_with_changed_authors(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if not reverse:
+        # Changed via book.authors, instance is the Book.
+        if action in ("post_add", "post_remove", "post_clear"):
+            get_search_backend().index_books([instance.id])
+    elif action == "pre_clear":
+        # Changed via author.books, the Books are unknown after the clear.
+        instance._search_index_book_ids = list(
+            instance.books.values_list("id", flat=True)
+        )
+    elif action == "post_clear":
+        get_search_backend().index_books(instance._search_index_book_ids)
+    elif action in ("post_add", "post_remove"):
+        get_search_backend().index_books(pk_set)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+def index_books_of_renamed_author_or_publisher(sender, instance, created, **kwargs):
+    if not created:
+        get_search_backend().index_books(instance.books.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Publisher)
+def remember_books_of_deleted_author_or_publisher(sender, instance, **kwargs):
+    instance._search_index_book_ids = list(instance.books.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+def index_books_of_deleted_author_or_publisher(sender, instance, **kwargs):
+    get_search_backend().index_books(getattr(instance, "_search_index_book_ids", []))
+
+
+# Grid pages, see books.page_cache. Only what is shown on the tiles matters,
+# e.g. rating and review changes leave the pages alone.
+
+
+@receiver(post_save, sender=OwnedBook)
+def evict_pages_of_new_owned_book(sender, instance, created, **kwargs):
+    if created:
+        evict_user_pages([instance.user_id])
+
+
+@receiver(post_delete, sender=OwnedBook)
+def evict_pages_of_deleted_owned_book(sender, instance, **kwargs):
+    evict_user_pages([instance.user_id])
+
+
+@receiver(post_save, sender=Book)
+def evict_pages_of_saved_book(sender, instance, created, **kwargs):
+    if not created:
+        evict_owner_pages([instance.id])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def touch_books_with_changed_authors(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            touch_books([instance.id])
+    elif action == "pre_clear":
+        instance._page_cache_book_ids = list(
+            instance.books.values_list("id", flat=True)
+        )
+    elif action == "post_clear":
+        touch_books(instance._page_cache_book_ids)
+    elif action in ("post_add", "post_remove"):
+        touch_books(pk_set)
+
+
+@receiver(post_save, sender=Author)
+def touch_books_of_renamed_author(sender, instance, created, **kwargs):
+    if not created:
+        touch_books(instance.books.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def touch_books_of_deleted_author(sender, instance, **kwargs):
+    # Remembered by remember_books_of_deleted_author_or_publisher().
+    touch_books(getattr(instance, "_search_index_book_ids", []))
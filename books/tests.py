@@ -1,3 +1,1532 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .google_books import get_google_books_client, search_google_books
+from .images import read_image_dimensions, sniff_image_dimensions
+from .enrichment import enqueue_book_enrichment, release_stale_jobs, run_pending_jobs
+from .ingest import ingest_volumes
+from . import admin as admin_module
+from . import library_export, performance, thumbnails
+from .library_import import import_library, parse_rows
+from .middleware import HtmlMinifyMiddleware, minify_html
+from .page_cache import evict_user_pages, get_page_cache_key
+from .routers import ReadReplicaRouter
+from .thumbnails import get_thumbnail_name
+from .upstream import UpstreamUnavailable
+from .search_index import get_search_backend
+from .models import Author, Book, EnrichmentJob, OwnedBook, Publisher, User
+
+
+def _make_image(image_format, size, **save_kwargs):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format=image_format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def _make_volume(
+    index, isbn=True, authors=("Jane Doe",), publisher="Penguin", **volume_info
+):
+    volume = {
+        "volumeInfo": {
+            "title": f"Book {index}",
+            "authors": list(authors),
+            "publisher": publisher,
+            "industryIdentifiers": (
+                [{"type": "ISBN_13", "identifier": f"978{index:010d}"}] if isbn else []
+            ),
+            "pageCount": 100 + index,
+            "imageLinks": {"thumbnail": f"https://img/{index}.jpg"},
+            "infoLink": f"https://books/{index}",
+            **volume_info,
+        },
+        "searchInfo": {"textSnippet": f"Snippet {index}"},
+    }
+    return volume
+
+
+def _create_library(user, size):
+    """Give ``user`` ``size`` Books, half with a cover and all with authors."""
+    publisher, _ = Publisher.objects.get_or_create(name="Penguin")
+    authors = [
+        Author.objects.get_or_create(full_name=f"Author {i}")[0] for i in range(3)
+    ]
+    books = Book.objects.bulk_create(
+        [
+            Book(
+                title=f"Book {i:05d}",
+                isbn=f"979{i:010d}",
+                publisher=publisher,
+                description=f"Description {i}",
+                thumbnail_url=f"https://img/{i}.jpg" if i % 2 else None,
+            )
+            for i in range(size)
+        ]
+    )
+    Book.authors.through.objects.bulk_create(
+        [
+            Book.authors.through(book_id=book.id, author_id=author.id)
+            for i, book in enumerate(books)
+            for author in authors[: 1 + i % 3]
+        ]
+    )
+    ownedbooks = OwnedBook.objects.bulk_create(
+        [OwnedBook(user=user, book=book) for book in books]
+    )
+    evict_user_pages([user.id])  # Bulk writes send no signals.
+    return ownedbooks
+
+
+def _chunked(data, chunk_size):
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset : offset + chunk_size]
+
+
+class ImageDimensionSniffingTest(SimpleTestCase):
+    def test_fast_paths(self):
+        cases = [
+            ("JPEG", {}),
+            ("JPEG", {"progressive": True}),
+            ("PNG", {}),
+            ("GIF", {}),
+            ("WEBP", {}),
+            ("WEBP", {"lossless": True}),
+        ]
+        for image_format, save_kwargs in cases:
+            with self.subTest(image_format=image_format, **save_kwargs):
+                data = _make_image(image_format, (321, 457), **save_kwargs)
+                self.assertEqual(sniff_image_dimensions(data), (321, 457))
+
+    def test_truncated_header_needs_more_data(self):
+        data = _make_image("PNG", (10, 20))
+        self.assertIsNone(sniff_image_dimensions(data[:16]))
+
+    def test_reads_only_the_header_of_large_images(self):
+        data = _make_image("PNG", (2000, 3000))
+        dimensions, bytes_read = read_image_dimensions(_chunked(data, 1024))
+        self.assertEqual(dimensions, (2000, 3000))
+        self.assertEqual(bytes_read, 1024)
+
+    def test_falls_back_to_pillow_for_other_formats(self):
+        data = _make_image("BMP", (30, 40))
+        dimensions, _ = read_image_dimensions(_chunked(data, 16))
+        self.assertEqual(dimensions, (30, 40))
+
+    def test_gives_up_after_max_bytes(self):
+        dimensions, bytes_read = read_image_dimensions(
+            _chunked(b"\0" * 10_000, 1000), max_bytes=3000
+        )
+        self.assertIsNone(dimensions)
+        self.assertEqual(bytes_read, 3000)
+
+
+class SearchGoogleBooksCacheTest(SimpleTestCase):
+    def setUp(self):
+        caches[settings.GOOGLE_BOOKS_CACHE_ALIAS].clear()
+        caches[settings.GOOGLE_BOOKS_STATE_CACHE_ALIAS].clear()
+
+    def _mock_get(self, data, ok=True):
+        response = mock.Mock(ok=ok, status_code=200 if ok else 400)
+        response.json.return_value = data
+        return mock.patch("requests.Session.get", return_value=response)
+
+    def test_repeat_queries_are_served_from_cache(self):
+        data = {"items": [{"id": "1"}]}
+        with self._mock_get(data) as get:
+            self.assertEqual(search_google_books(title="Dune", author="Herbert"), data)
+            self.assertEqual(
+                search_google_books(title="  dune ", author="HERBERT"), data
+            )
+        self.assertEqual(get.call_count, 1)
+
+    def test_different_queries_are_cached_separately(self):
+        with self._mock_get({"items": [{"id": "1"}]}) as get:
+            search_google_books(isbn="9780441013593")
+            search_google_books(isbn="9780441013594")
+            search_google_books(isbn="9780441013593", max_results=1)
+        self.assertEqual(get.call_count, 3)
+
+    def test_empty_results_are_cached_briefly(self):
+        cache = caches[settings.GOOGLE_BOOKS_CACHE_ALIAS]
+        with self._mock_get({"totalItems": 0}) as get:
+            with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+                search_google_books(isbn="0000000000")
+            search_google_books(isbn="0000000000")
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(
+            cache_set.call_args.kwargs["timeout"],
+            settings.GOOGLE_BOOKS_CACHE_NEGATIVE_TIMEOUT,
+        )
+
+    def test_errors_are_not_cached(self):
+        with self._mock_get({"error": {"code": 400}}, ok=False) as get:
+            search_google_books(isbn="9780441013593")
+            search_google_books(isbn="9780441013593")
+        self.assertEqual(get.call_count, 2)
+
+    def test_error_pages_count_as_no_results(self):
+        with self._mock_get(None, ok=False) as get:
+            get.return_value.json.side_effect = ValueError("Expecting value")
+            with self.assertLogs("books.google_books", "WARNING"):
+                self.assertEqual(search_google_books(isbn="9780441013593"), {})
+            search_google_books(isbn="9780441013593")
+        self.assertEqual(get.call_count, 2)
+
+
+class IngestVolumesTest(TestCase):
+    def test_creates_books_authors_and_publishers(self):
+        volumes = [
+            _make_volume(1, authors=["Jane Doe", "John Roe"]),
+            _make_volume(2, isbn=False, publisher="Tor"),
+        ]
+        books = ingest_volumes(volumes)
+
+        self.assertEqual([book.title for book in books], ["Book 1", "Book 2"])
+        book_1 = Book.objects.get(isbn="9780000000001")
+        self.assertEqual(book_1.publisher.name, "Penguin")
+        self.assertEqual(book_1.description, "Snippet 1")
+        self.assertEqual(book_1.num_pages, 101)
+        self.assertEqual(book_1.thumbnail_url, "https://img/1.jpg")
+        self.assertEqual(book_1.info_url, "https://books/1")
+        self.assertEqual(
+            sorted(book_1.authors.values_list("full_name", flat=True)),
+            ["Jane Doe", "John Roe"],
+        )
+        self.assertEqual(Book.objects.get(isbn=None).publisher.name, "Tor")
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(Publisher.objects.count(), 2)
+
+    def test_updates_existing_books_without_duplicating(self):
+        ingest_volumes([_make_volume(1), _make_volume(2, isbn=False)])
+        Book.objects.update(thumbnail_width=128, thumbnail_height=192)
+
+        volume_1 = _make_volume(1, title="Renamed", authors=["Other Author"])
+        volume_1["volumeInfo"]["imageLinks"]["thumbnail"] = "https://img/new.jpg"
+        del volume_1["searchInfo"]
+        books = ingest_volumes([volume_1, _make_volume(2, isbn=False, pageCount=7)])
+
+        self.assertEqual(Book.objects.count(), 2)
+        book_1, book_2 = books
+        book_1.refresh_from_db()
+        book_2.refresh_from_db()
+        self.assertEqual(book_1.title, "Book 1")
+        self.assertEqual(book_1.description, "Snippet 1")
+        self.assertEqual(book_1.thumbnail_url, "https://img/new.jpg")
+        self.assertEqual(book_1.thumbnail_width, 0)
+        self.assertEqual(
+            list(book_1.authors.all()), [Author.objects.get(full_name="Other Author")]
+        )
+        self.assertEqual(book_2.num_pages, 7)
+        self.assertEqual(book_2.thumbnail_width, 128)
+
+    def test_unchanged_books_are_not_written_or_evicted(self):
+        volumes = [_make_volume(1), _make_volume(2, isbn=False)]
+        book_1, book_2 = ingest_volumes(volumes)
+
+        with (
+            mock.patch("books.ingest.touch_books") as touch_books,
+            mock.patch("books.ingest.get_search_backend") as get_search_backend,
+        ):
+            ingest_volumes(volumes)
+            touch_books.assert_called_once_with(set())
+            # Google not listing the authors keeps them.
+            ingest_volumes(
+                [_make_volume(1, pageCount=7), _make_volume(2, isbn=False, authors=[])]
+            )
+            touch_books.assert_called_with({book_1.id})
+            ingest_volumes(
+                [
+                    _make_volume(1, pageCount=7),
+                    _make_volume(2, isbn=False, authors=["John Roe"]),
+                ]
+            )
+            touch_books.assert_called_with({book_2.id})
+        get_search_backend().index_books.assert_called_with({book_2.id})
+        self.assertEqual(Book.objects.get(id=book_1.id).num_pages, 7)
+
+    def test_number_of_queries_does_not_depend_on_number_of_volumes(self):
+        ingest_volumes([_make_volume(0), _make_volume(0, isbn=False)])
+
+        def count_queries(volumes):
+            with CaptureQueriesContext(connection) as context:
+                ingest_volumes(volumes)
+            return len(context)
+
+        def make_volumes(indices):
+            # New and existing Books with and without ISBN, new Authors and
+            # new Publishers, so every stage has some work to do.
+            return [
+                _make_volume(
+                    i,
+                    isbn=i % 2 == 0,
+                    authors=[f"Author {i}", "Jane Doe"],
+                    publisher=f"Publisher {i}",
+                )
+                for i in indices
+            ] + [_make_volume(0), _make_volume(0, isbn=False)]
+
+        few = make_volumes(range(10, 12))
+        many = make_volumes(range(20, 70))
+        self.assertEqual(count_queries(few), count_queries(many))
+
+
+class OwnedBookListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+
+    def test_renders_books_with_authors(self):
+        _create_library(self.user, 3)
+        response = self.client.get("/books")
+        self.assertContains(response, 'title="Book 00001, Author 0, Author 1"')
+        self.assertContains(response, "<strong>Book 00002</strong>")
+
+    def test_number_of_queries_does_not_depend_on_library_size(self):
+        for size in (10, 1000):
+            with self.subTest(size=size):
+                OwnedBook.objects.all().delete()
+                Book.objects.all().delete()
+                Author.objects.all().delete()
+                Publisher.objects.all().delete()
+                _create_library(self.user, size)
+
+                # Session, User, validator, OwnedBooks with Books and
+                # Publishers, Authors.
+                with self.assertNumQueries(5):
+                    response = self.client.get("/books")
+                self.assertEqual(
+                    len(response.context["ownedbook_list"]),
+                    min(size, settings.OWNED_BOOKS_PAGE_SIZE),
+                )
+
+    @override_settings(OWNED_BOOKS_PAGE_SIZE=4)
+    def test_pages_through_library_by_cursor(self):
+        _create_library(self.user, 10)
+        # Same title as an earlier Book, the id has to break the tie.
+        OwnedBook.objects.create(
+            user=self.user,
+            book=Book.objects.create(title="Book 00003"),
+        )
+
+        titles = []
+        url = "/books"
+        while url:
+            response = self.client.get(url, headers={"HX-Request": "true"})
+            self.assertTemplateUsed(response, "books/ownedbook_list_page.html")
+            page = response.context["ownedbook_list"]
+            self.assertLessEqual(len(page), 4)
+            titles += [ownedbook.book.title for ownedbook in page]
+            next_page_url = response.context["next_page_url"]
+            url = "/books" + next_page_url if next_page_url else None
+
+        expected = sorted([f"Book {i:05d}" for i in range(10)] + ["Book 00003"])
+        self.assertEqual(titles, expected)
+
+    def test_rejects_invalid_cursor(self):
+        response = self.client.get("/books?after_title=x&after_id=abc")
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(OWNED_BOOKS_PAGE_SIZE=4)
+    def test_first_page_links_next_page_for_htmx(self):
+        _create_library(self.user, 5)
+        response = self.client.get("/books")
+        self.assertTemplateUsed(response, "books/ownedbook_list.html")
+        self.assertContains(response, 'hx-trigger="revealed"')
+        self.assertContains(response, "after_title=Book+00003&amp;after_id=")
+
+    def test_empty_library(self):
+        response = self.client.get("/books")
+        self.assertContains(response, "No owned books yet")
+        self.assertNotContains(response, 'hx-trigger="revealed"')
+
+
+@mock.patch("books.views.search_google_books")
+class SearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+
+    def test_creates_and_lists_matching_books(self, search_google_books):
+        search_google_books.return_value = {"items": [_make_volume(1), _make_volume(2)]}
+        response = self.client.get("/search", {"isbn": "978-0000000001"})
+
+        search_google_books.assert_called_once_with(isbn="9780000000001")
+        self.assertEqual(
+            sorted(book.title for book in response.context["matching_books"]),
+            ["Book 1", "Book 2"],
+        )
+        self.assertContains(response, "Add to owned Books", count=2)
+
+    def test_owned_check_does_not_depend_on_library_size(self, search_google_books):
+        search_google_books.return_value = {
+            "items": [_make_volume(1), _make_volume(2), _make_volume(3)]
+        }
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get("/search", {"author": "Jane Doe"})
+            return response, len(context)
+
+        count_queries()  # Let the first search create the Books.
+        response, num_queries = count_queries()
+        self.assertContains(response, "Add to owned Books", count=3)
+
+        _create_library(self.user, 3000)
+        OwnedBook.objects.create(
+            user=self.user, book=Book.objects.get(isbn="9780000000002")
+        )
+        response, num_queries_with_library = count_queries()
+
+        self.assertEqual(num_queries_with_library, num_queries)
+        self.assertContains(response, "Add to owned Books", count=2)
+        self.assertContains(response, "Already in owned Books", count=1)
+
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        self.publisher = Publisher.objects.create(name="Ace Books")
+        self.author = Author.objects.create(full_name="Frank Herbert")
+        self.book = Book.objects.create(
+            title="Dune Messiah", publisher=self.publisher, description="Sequel."
+        )
+        self.book.authors.add(self.author)
+        Book.objects.create(title="Children of Dune")
+
+    def search(self, **query):
+        return get_search_backend().search(**query)
+
+    def test_finds_books_by_title_and_author_prefixes(self):
+        self.assertEqual(self.search(title="dune mess"), [self.book.id])
+        self.assertEqual(len(self.search(title="Dune")), 2)
+        self.assertEqual(self.search(title="dune", author="herb"), [self.book.id])
+        self.assertEqual(self.search(author="Frank"), [self.book.id])
+        self.assertEqual(self.search(title="Foundation"), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search(title='dune" OR "*'), [])
+        self.assertEqual(self.search(title="***"), [])
+
+    def test_follows_changes_to_books_authors_and_publishers(self):
+        self.book.title = "Foundation"
+        self.book.save()
+        self.assertEqual(self.search(title="foundation"), [self.book.id])
+
+        self.author.full_name = "Isaac Asimov"
+        self.author.save()
+        self.assertEqual(self.search(author="asimov"), [self.book.id])
+
+        self.author.books.clear()
+        self.assertEqual(self.search(author="asimov"), [])
+
+        self.book.delete()
+        self.assertEqual(self.search(title="foundation"), [])
+
+    def test_bulk_ingested_books_are_indexed(self):
+        ingest_volumes([_make_volume(1, title="Hyperion", authors=["Dan Simmons"])])
+        self.assertEqual(
+            self.search(title="hyperion", author="simmons"),
+            [Book.objects.get(title="Hyperion").id],
+        )
+
+    @override_settings(BOOKS_SEARCH_BACKEND="books.search_index.DatabaseSearchBackend")
+    def test_database_backend(self):
+        self.assertEqual(self.search(title="dune mess"), [self.book.id])
+        self.assertEqual(self.search(title="dune", author="herbert"), [self.book.id])
+        self.assertEqual(self.search(title="Foundation"), [])
+
+
+@mock.patch("books.views.search_google_books")
+class LocalFirstSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        ingest_volumes([_make_volume(i, title=f"Dune {i}") for i in range(5)])
+
+    def test_serves_enough_local_matches_without_google(self, search_google_books):
+        response = self.client.get("/search", {"title": "dune"})
+        search_google_books.assert_not_called()
+        self.assertEqual(len(response.context["matching_books"]), 5)
+
+    def test_asks_google_when_local_matches_are_too_few(self, search_google_books):
+        search_google_books.return_value = {"items": [_make_volume(9)]}
+        response = self.client.get("/search", {"title": "dune", "author": "nobody"})
+        search_google_books.assert_called_once_with(title="dune", author="nobody")
+        self.assertEqual(
+            [book.title for book in response.context["matching_books"]], ["Book 9"]
+        )
+
+    def test_serves_local_matches_while_google_is_unavailable(
+        self, search_google_books
+    ):
+        search_google_books.side_effect = UpstreamUnavailable
+        response = self.client.get("/search", {"title": "dune 3"})
+        self.assertEqual(
+            [book.title for book in response.context["matching_books"]], ["Dune 3"]
+        )
+
+    def test_serves_known_isbn_without_google(self, search_google_books):
+        response = self.client.get("/search", {"isbn": "978-0000000003"})
+        search_google_books.assert_not_called()
+        self.assertEqual(
+            [book.title for book in response.context["matching_books"]], ["Dune 3"]
+        )
+
+    def test_matches_isbn_10_against_stored_isbn_13(self, search_google_books):
+        book = Book.objects.create(title="Dune", isbn="9780441013593")
+        response = self.client.get("/search", {"isbn": "0-441-01359-7"})
+        search_google_books.assert_not_called()
+        self.assertEqual(list(response.context["matching_books"]), [book])
+
+    def test_requires_login(self, search_google_books):
+        self.client.logout()
+        response = self.client.get("/search", {"title": "dune"})
+        self.assertRedirects(response, "/login?next=/search%3Ftitle%3Ddune")
+        search_google_books.assert_not_called()
+
+    async def test_serves_asgi_requests(self, search_google_books):
+        search_google_books.return_value = {"items": [_make_volume(9)]}
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get("/search", {"isbn": "9780000000009"})
+        self.assertEqual(
+            [book.title for book in response.context["matching_books"]], ["Book 9"]
+        )
+        self.assertContains(response, "Add to owned Books", count=1)
+
+
+@override_settings(THUMBNAIL_MIRROR=False)
+class EnrichmentTest(TestCase):
+    def setUp(self):
+        (self.book,) = ingest_volumes([_make_volume(1)])
+        Book.objects.filter(id=self.book.id).update(description="")
+        self.book.refresh_from_db()
+
+    def test_search_enqueues_jobs_instead_of_probing(self):
+        user = User.objects.create_user("reader")
+        self.client.force_login(user)
+        with (
+            mock.patch(
+                "books.views.search_google_books",
+                return_value={"items": [_make_volume(2)]},
+            ),
+            mock.patch("books.models._get_image_dimensions_from_url") as probe,
+        ):
+            self.client.get("/search", {"isbn": "9780000000002"})
+        probe.assert_not_called()
+        self.assertEqual(
+            set(
+                EnrichmentJob.objects.filter(book__isbn="9780000000002").values_list(
+                    "kind", "state"
+                )
+            ),
+            {("thumbnail_dimensions", "pending")},
+        )
+
+    def test_enqueue_deduplicates_per_book(self):
+        enqueue_book_enrichment([self.book])
+        enqueue_book_enrichment([self.book])
+        self.assertEqual(
+            sorted(self.book.enrichment_jobs.values_list("kind", flat=True)),
+            ["metadata", "thumbnail_dimensions"],
+        )
+
+    def test_worker_fills_in_thumbnail_dimensions_and_metadata(self):
+        enqueue_book_enrichment([self.book])
+        full_volume = _make_volume(1, description="Full description.")
+        with (
+            mock.patch(
+                "books.enrichment._get_image_dimensions_from_url",
+                return_value=(128, 192),
+            ),
+            mock.patch(
+                "books.enrichment.search_google_books",
+                return_value={"items": [full_volume]},
+            ),
+        ):
+            call_command("run_enrichment_worker", once=True, stdout=io.StringIO())
+
+        self.book.refresh_from_db()
+        self.assertEqual(
+            (self.book.thumbnail_width, self.book.thumbnail_height), (128, 192)
+        )
+        self.assertEqual(self.book.description, "Full description.")
+        self.assertEqual(
+            set(self.book.enrichment_jobs.values_list("state", flat=True)), {"done"}
+        )
+
+    def test_only_finished_jobs_of_a_new_cover_are_requeued(self):
+        enqueue_book_enrichment([self.book])
+        job = self.book.enrichment_jobs.get(kind="thumbnail_dimensions")
+        for state in ("pending", "running", "done", "failed"):
+            with self.subTest(state):
+                EnrichmentJob.objects.filter(id=job.id).update(
+                    state=state, attempts=3, last_error="down"
+                )
+                enqueue_book_enrichment([self.book])
+                job.refresh_from_db()
+                self.assertEqual(
+                    (job.state, job.attempts, job.last_error), (state, 3, "down")
+                )
+
+        self.book.thumbnail_url = "https://img/new.jpg"
+        self.book.save()
+        enqueue_book_enrichment([self.book])
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts, job.last_error), ("pending", 0, ""))
+        self.assertEqual(job.thumbnail_url, "https://img/new.jpg")
+
+    @override_settings(ENRICHMENT_MAX_ATTEMPTS=2)
+    def test_failed_jobs_are_retried_with_backoff(self):
+        Book.objects.filter(id=self.book.id).update(num_pages=1, description="x")
+        self.book.refresh_from_db()
+        enqueue_book_enrichment([self.book])
+        job = self.book.enrichment_jobs.get()
+
+        with (
+            mock.patch(
+                "books.enrichment._get_image_dimensions_from_url",
+                side_effect=requests.ConnectionError("down"),
+            ),
+            self.assertLogs("books.enrichment", "WARNING"),
+        ):
+            self.assertEqual(run_pending_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.state, job.attempts), ("pending", 1))
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertEqual(run_pending_jobs(), 0)  # Not due yet.
+
+            EnrichmentJob.objects.update(run_after=timezone.now())
+            self.assertEqual(run_pending_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.state, job.attempts), ("failed", 2))
+            self.assertIn("down", job.last_error)
+
+    @override_settings(ENRICHMENT_MAX_ATTEMPTS=2, ENRICHMENT_LEASE_TIMEOUT=60)
+    def test_stale_running_jobs_are_taken_back(self):
+        enqueue_book_enrichment([self.book])
+        EnrichmentJob.objects.update(
+            state=EnrichmentJob.States.RUNNING,
+            attempts=1,
+            claimed_at=timezone.now() - timedelta(seconds=30),
+        )
+        self.assertEqual(release_stale_jobs(), 0)  # Still within the lease.
+
+        EnrichmentJob.objects.filter(kind="metadata").update(attempts=2)
+        EnrichmentJob.objects.update(claimed_at=timezone.now() - timedelta(minutes=5))
+        with self.assertLogs("books.enrichment", "WARNING"):
+            self.assertEqual(release_stale_jobs(), 2)
+        self.assertEqual(
+            dict(self.book.enrichment_jobs.values_list("kind", "state")),
+            {"thumbnail_dimensions": "pending", "metadata": "failed"},
+        )
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite")
+class QueryPlanTest(TestCase):
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertIn("USING", plan)
+        self.assertNotIn("SCAN", plan)
+
+    def test_hot_queries_use_indexes(self):
+        user = User.objects.create_user("reader")
+        publisher = Publisher.objects.create(name="Penguin")
+        hot_querysets = {
+            "author lookup": Author.objects.filter(full_name__in=["A", "B"]),
+            "publisher lookup": Publisher.objects.filter(name__in=["A", "B"]),
+            "book by title": Book.objects.filter(title__in=["A", "B"]),
+            "book by publisher and title": Book.objects.filter(
+                publisher=publisher, title="A"
+            ),
+            "owned books of user": OwnedBook.objects.filter(user=user)
+            .select_related("book")
+            .order_by("book__title", "id"),
+            "owned check": OwnedBook.objects.filter(user=user, book_id__in=[1, 2]),
+            "due enrichment jobs": EnrichmentJob.objects.filter(
+                state="pending", run_after__lte=timezone.now()
+            ).order_by("run_after"),
+        }
+        for name, queryset in hot_querysets.items():
+            with self.subTest(name):
+                self.assertUsesIndex(queryset)
+
+
+class UniqueConstraintTest(TestCase):
+    def test_user_owns_a_book_only_once(self):
+        user = User.objects.create_user("reader")
+        book = Book.objects.create(title="Dune")
+        OwnedBook.objects.create(user=user, book=book)
+        with self.assertRaises(IntegrityError):
+            OwnedBook.objects.create(user=user, book=book)
+
+
+class ReadReplicaRouterTest(SimpleTestCase):
+    def test_routes_reads_to_replica_outside_transactions(self):
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Book), "replica")
+        self.assertEqual(router.db_for_write(Book), "default")
+        self.assertTrue(router.allow_migrate("default", "books"))
+        self.assertFalse(router.allow_migrate("replica", "books"))
+
+        with mock.patch.object(connection, "in_atomic_block", True):
+            self.assertEqual(router.db_for_read(Book), "default")
+
+
+GOODREADS_CSV = '''\
+Book Id,Title,Author,ISBN,ISBN13,My Rating,Exclusive Shelf,My Review
+1,Book 1,Jane Doe,"=""0000000001""","=""9780000000001""",5,read,Great<br/>read
+2,Book 2,Jane Doe,"=""""","=""""",0,currently-reading,
+3,Unknown,Nobody,"=""""","=""""",3,to-read,
+'''
+
+
+class LibraryImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+
+    def test_parses_goodreads_export(self):
+        rows = list(parse_rows(io.StringIO(GOODREADS_CSV)))
+        self.assertEqual(
+            [(row.isbn, row.title, row.progress, row.rating) for row in rows],
+            [
+                ("9780000000001", "Book 1", OwnedBook.ReadStates.FULLY_READ, 9),
+                (None, "Book 2", OwnedBook.ReadStates.PARTIALLY_READ, 0),
+                (None, "Unknown", OwnedBook.ReadStates.UNREAD, 5),
+            ],
+        )
+        self.assertEqual(rows[0].review, "Great\nread")
+
+    def test_parses_generic_csv(self):
+        rows = list(
+            parse_rows(
+                io.StringIO(
+                    "ISBN,Title,Progress,Rating\n"
+                    "978-0-00-000000-2,Book 2,Fully Read,12\n"
+                    ",,,\n"
+                )
+            )
+        )
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].isbn, "9780000000002")
+        self.assertEqual(rows[0].progress, OwnedBook.ReadStates.FULLY_READ)
+        self.assertEqual(rows[0].rating, 9)
+
+    def test_imports_local_and_google_books(self):
+        (book,) = ingest_volumes([_make_volume(1)])
+        OwnedBook.objects.create(user=self.user, book=book)
+
+        def search(isbn=None, title=None, author=None, max_results=None):
+            return {"items": [_make_volume(2)]} if title == "Book 2" else {}
+
+        with mock.patch(
+            "books.google_books.search_google_books", side_effect=search
+        ) as search_mock:
+            result = import_library(self.user, parse_rows(io.StringIO(GOODREADS_CSV)))
+
+        # The ISBN row was found locally, only the others hit Google.
+        self.assertEqual(search_mock.call_count, 2)
+        self.assertEqual(result.num_rows, 3)
+        self.assertEqual(result.num_added, 1)
+        self.assertEqual(result.num_already_owned, 1)
+        self.assertEqual(result.not_found, ["Unknown"])
+        ownedbook = OwnedBook.objects.get(user=self.user, book__title="Book 2")
+        self.assertEqual(ownedbook.progress, OwnedBook.ReadStates.PARTIALLY_READ)
+        self.assertTrue(ownedbook.book.enrichment_jobs.exists())
+
+    def test_rows_google_books_was_unavailable_for_are_reported_apart(self):
+        def search(isbn=None, title=None, author=None, max_results=None):
+            if title == "Unknown":
+                return {}
+            raise UpstreamUnavailable("Circuit of google-books is open")
+
+        with (
+            mock.patch("books.google_books.search_google_books", side_effect=search),
+            self.assertLogs("books.google_books", "WARNING"),
+        ):
+            result = import_library(self.user, parse_rows(io.StringIO(GOODREADS_CSV)))
+
+        self.assertEqual(result.num_added, 0)
+        self.assertEqual(result.not_found, ["Unknown"])
+        self.assertEqual(result.unavailable, ["9780000000001", "Book 2"])
+
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile("library.csv", GOODREADS_CSV.encode())
+        with (
+            mock.patch("books.google_books.search_google_books", side_effect=search),
+            self.assertLogs("books.google_books", "WARNING"),
+        ):
+            response = self.client.post("/books/import", {"file": upload})
+        self.assertContains(response, "1 not found,\n  2 unavailable.")
+
+    def test_rows_without_isbn_match_books_by_publisher_and_title(self):
+        def search(isbn=None, title=None, author=None, max_results=None):
+            volume = _make_volume(
+                0, isbn=False, title="Poems", authors=[author], publisher=author
+            )
+            return {"items": [volume]}
+
+        csv_file = io.StringIO("title,author\nPoems,Tor\nPoems,Penguin\n")
+        with mock.patch("books.google_books.search_google_books", side_effect=search):
+            result = import_library(self.user, parse_rows(csv_file))
+
+        self.assertEqual(result.num_added, 2)
+        self.assertEqual(
+            sorted(
+                OwnedBook.objects.filter(user=self.user).values_list(
+                    "book__publisher__name", flat=True
+                )
+            ),
+            ["Penguin", "Tor"],
+        )
+
+    def test_duplicate_rows_are_added_once(self):
+        ingest_volumes([_make_volume(1)])
+        csv_file = io.StringIO("isbn,rating\n9780000000001,3\n978-0-00-000000-1,4\n")
+        with mock.patch("books.google_books.search_google_books") as search_mock:
+            result = import_library(self.user, parse_rows(csv_file))
+
+        search_mock.assert_not_called()
+        self.assertEqual(result.num_added, 1)
+        self.assertEqual(OwnedBook.objects.get(user=self.user).rating, 4)
+
+    def test_upload_view(self):
+        ingest_volumes([_make_volume(1)])
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile("library.csv", b"isbn\n9780000000001\n")
+        response = self.client.post("/books/import", {"file": upload})
+        self.assertContains(response, "added 1")
+        self.assertTrue(OwnedBook.objects.filter(user=self.user).exists())
+
+    def test_upload_view_rejects_files_it_cannot_read(self):
+        self.client.force_login(self.user)
+        files = {
+            "Latin-1": "title\nL\u00e9lia\n".encode("latin-1"),
+            "oversized field": b'title\n"' + b"x" * 200_000 + b'"\n',
+        }
+        for name, data in files.items():
+            with self.subTest(name):
+                upload = SimpleUploadedFile("library.csv", data)
+                response = self.client.post("/books/import", {"file": upload})
+                self.assertContains(
+                    response, "is not a UTF-8 encoded CSV file", status_code=400
+                )
+
+    def test_command(self):
+        ingest_volumes([_make_volume(1)])
+        with mock.patch(
+            "builtins.open", return_value=io.StringIO("isbn\n9780000000001\n")
+        ):
+            stdout = io.StringIO()
+            call_command("import_library", "reader", "library.csv", stdout=stdout)
+        self.assertIn("added 1", stdout.getvalue())
+
+
+class LibraryExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        _create_library(self.user, 3)
+
+    def test_streams_csv(self):
+        self.client.force_login(self.user)
+        response = self.client.get("/books/export")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(library_export.EXPORT_FIELDS))
+        self.assertEqual(len(lines), 4)
+        self.assertIn("Book 00000,Author 0,Penguin", lines[1])
+        self.assertIn('Book 00001,"Author 0, Author 1",Penguin', lines[2])
+
+    @override_settings(LIBRARY_EXPORT_CHUNK_SIZE=2)
+    def test_prefetches_per_chunk(self):
+        # One streamed query for the Owned Books, plus authors per chunk.
+        with self.assertNumQueries(3):
+            rows = list(library_export.export_rows(self.user))
+        self.assertEqual(
+            [row["title"] for row in rows], ["Book 00000", "Book 00001", "Book 00002"]
+        )
+
+    def test_exported_csv_can_be_imported(self):
+        other_user = User.objects.create_user("other")
+        csv_file = io.StringIO("".join(library_export.export_lines(self.user, "csv")))
+        with mock.patch("books.google_books.search_google_books") as search_mock:
+            result = import_library(other_user, parse_rows(csv_file))
+        search_mock.assert_not_called()
+        self.assertEqual(result.num_added, 3)
+
+    def test_command_writes_json_lines(self):
+        stdout = io.StringIO()
+        call_command("export_library", "reader", "--format=jsonl", stdout=stdout)
+        rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1]["author"], "Author 0, Author 1")
+
+    def test_rejects_unknown_format(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/books/export?format=xml").status_code, 400)
+
+
+class IsbnLookupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        (self.local_book,) = ingest_volumes([_make_volume(1)])
+
+    def lookup(self, **data):
+        return self.client.post(
+            "/books/lookup", json.dumps(data), content_type="application/json"
+        )
+
+    def test_answers_known_isbns_locally(self):
+        def search(isbn=None, **kwargs):
+            return {"items": [_make_volume(2)]} if isbn == "9780000000002" else {}
+
+        with mock.patch(
+            "books.google_books.search_google_books", side_effect=search
+        ) as search_mock:
+            response = self.lookup(
+                isbns=["978-0-00-000000-1", "9780000000002", "9780000000003", "nope"]
+            )
+
+        self.assertEqual(
+            sorted(call.kwargs["isbn"] for call in search_mock.call_args_list),
+            ["9780000000002", "9780000000003"],
+        )
+        results = response.json()["results"]
+        self.assertEqual(
+            [(r["isbn"], r["book"] and r["book"]["title"]) for r in results],
+            [
+                ("9780000000001", "Book 1"),
+                ("9780000000002", "Book 2"),
+                ("9780000000003", None),
+                ("NOPE", None),
+            ],
+        )
+        self.assertEqual(results[0]["book"]["authors"], ["Jane Doe"])
+        self.assertFalse(OwnedBook.objects.exists())
+
+    def test_tells_unavailable_isbns_from_unknown_ones(self):
+        def search(isbn=None, **kwargs):
+            if isbn == "9780000000002":
+                raise UpstreamUnavailable("Circuit of google-books is open")
+            return {}
+
+        with (
+            mock.patch("books.google_books.search_google_books", side_effect=search),
+            self.assertLogs("books.google_books", "WARNING"),
+        ):
+            response = self.lookup(
+                isbns=["9780000000001", "9780000000002", "9780000000003"]
+            )
+
+        self.assertEqual(
+            [
+                (r["isbn"], r["book"] is not None, r["unavailable"])
+                for r in response.json()["results"]
+            ],
+            [
+                ("9780000000001", True, False),
+                ("9780000000002", False, True),
+                ("9780000000003", False, False),
+            ],
+        )
+
+    def test_adds_matches_to_owned_books(self):
+        OwnedBook.objects.create(user=self.user, book=self.local_book)
+        with mock.patch(
+            "books.google_books.search_google_books",
+            return_value={"items": [_make_volume(2)]},
+        ):
+            response = self.lookup(isbns=["9780000000001", "9780000000002"], add=True)
+
+        self.assertEqual(response.json()["num_added"], 1)
+        self.assertTrue(all(r["owned"] for r in response.json()["results"]))
+        self.assertEqual(OwnedBook.objects.filter(user=self.user).count(), 2)
+
+    @override_settings(ISBN_LOOKUP_MAX_ISBNS=2)
+    def test_rejects_invalid_requests(self):
+        self.assertEqual(self.lookup(isbns=["1", "2", "3"]).status_code, 400)
+        self.assertEqual(self.lookup(isbns="9780000000001").status_code, 400)
+        self.assertEqual(self.lookup().status_code, 400)
+
+
+class ThumbnailMirrorTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        (self.book,) = ingest_volumes([_make_volume(1)])
+        enqueue_book_enrichment([self.book])
+        self.image = _make_image("PNG", (400, 600))
+
+    def mirror(self):
+        response = mock.Mock(ok=True)
+        response.__enter__ = mock.Mock(return_value=response)
+        response.__exit__ = mock.Mock(return_value=False)
+        response.iter_content.return_value = [self.image[:100], self.image[100:]]
+        with mock.patch("requests.Session.get", return_value=response):
+            run_pending_jobs()
+        self.book.refresh_from_db()
+
+    def test_worker_mirrors_cover_with_derivatives(self):
+        self.assertTrue(
+            self.book.enrichment_jobs.filter(kind="thumbnail_mirror").exists()
+        )
+        self.mirror()
+
+        digest = self.book.thumbnail_digest
+        self.assertEqual(len(digest), 64)
+        self.assertEqual(
+            (self.book.thumbnail_width, self.book.thumbnail_height), (400, 600)
+        )
+        with Image.open(
+            os.path.join(settings.MEDIA_ROOT, get_thumbnail_name(digest, 160, "webp"))
+        ) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (160, 240)))
+        self.assertEqual(
+            self.book.display_thumbnail_url,
+            f"/media/thumbnails/{digest[:2]}/{digest}-320.jpeg",
+        )
+        self.assertIn(f"{digest}-160.webp 160w", self.book.thumbnail_srcsets["webp"])
+
+        self.assertTrue(
+            self.book.thumbnail_placeholder.startswith("data:image/webp;base64,")
+        )
+        self.assertLess(len(self.book.thumbnail_placeholder), 1000)
+
+    def test_small_covers_are_not_scaled_up(self):
+        self.image = _make_image("PNG", (200, 300))
+        self.mirror()
+
+        digest = self.book.thumbnail_digest
+        self.assertEqual(
+            self.book.thumbnail_srcsets["webp"],
+            f"/media/thumbnails/{digest[:2]}/{digest}-160.webp 160w, "
+            f"/media/thumbnails/{digest[:2]}/{digest}-320.webp 200w",
+        )
+        with Image.open(
+            os.path.join(settings.MEDIA_ROOT, get_thumbnail_name(digest, 320, "jpeg"))
+        ) as image:
+            self.assertEqual(image.size, (200, 300))
+
+        self.image = _make_image("PNG", (100, 150))
+        self.book.enrichment_jobs.update(state="pending")
+        self.mirror()
+        digest = self.book.thumbnail_digest
+        self.assertEqual(
+            self.book.thumbnail_srcsets["jpeg"],
+            f"/media/thumbnails/{digest[:2]}/{digest}-160.jpeg 100w",
+        )
+        self.assertTrue(self.book.display_thumbnail_url.endswith("-160.jpeg"))
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(
+                    settings.MEDIA_ROOT, get_thumbnail_name(digest, 320, "jpeg")
+                )
+            )
+        )
+
+    @override_settings(OWNED_BOOKS_EAGER_TILES=1)
+    def test_tiles_have_dimensions_placeholder_and_lazy_loading(self):
+        self.mirror()
+        user = User.objects.create_user("reader")
+        self.client.force_login(user)
+        (other_book,) = ingest_volumes([_make_volume(2)])
+        OwnedBook.objects.create(user=user, book=self.book)
+        OwnedBook.objects.create(user=user, book=other_book)
+
+        response = self.client.get("/books")
+        self.assertContains(response, 'width="400"')
+        self.assertContains(response, 'height="600"')
+        self.assertContains(
+            response, f"background-image: url({self.book.thumbnail_placeholder})"
+        )
+        self.assertContains(response, 'loading="eager"', count=1)
+        self.assertContains(response, 'loading="lazy"', count=1)
+
+    def test_serves_mirrored_covers_as_immutable(self):
+        self.mirror()
+        response = self.client.get(self.book.display_thumbnail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", response["Cache-Control"])
+        # Nothing outside the thumbnail directory is served.
+        self.assertEqual(
+            self.client.get("/media/thumbnails/../db.sqlite3").status_code, 400
+        )
+
+    def test_changed_cover_is_mirrored_again(self):
+        self.mirror()
+        (book,) = ingest_volumes(
+            [_make_volume(1, imageLinks={"thumbnail": "https://img/new.jpg"})]
+        )
+        enqueue_book_enrichment([book])
+        self.assertEqual(book.thumbnail_digest, "")
+        self.assertEqual(book.thumbnail_placeholder, "")
+        self.assertEqual(
+            book.enrichment_jobs.get(kind="thumbnail_mirror").state, "pending"
+        )
+
+    def test_cover_changed_while_mirroring_is_mirrored_again(self):
+        mirror_thumbnail = thumbnails.mirror_thumbnail
+
+        def mirror_while_cover_changes(url):
+            Book.objects.filter(id=self.book.id).update(
+                thumbnail_url="https://img/new.jpg"
+            )
+            return mirror_thumbnail(url)
+
+        with (
+            mock.patch(
+                "books.thumbnails.mirror_thumbnail",
+                side_effect=mirror_while_cover_changes,
+            ),
+            self.assertLogs("books.enrichment", "INFO"),
+        ):
+            self.mirror()
+        self.assertEqual(self.book.thumbnail_digest, "")
+        job = self.book.enrichment_jobs.get(kind="thumbnail_mirror")
+        self.assertEqual((job.state, job.attempts), ("pending", 0))
+
+        self.mirror()
+        self.assertEqual(len(self.book.thumbnail_digest), 64)
+
+    def test_invalid_image_is_retried(self):
+        self.image = b"not an image"
+        with self.assertLogs("books.enrichment", "WARNING"):
+            self.mirror()
+        self.assertEqual(self.book.thumbnail_digest, "")
+        job = self.book.enrichment_jobs.get(kind="thumbnail_mirror")
+        self.assertEqual((job.state, job.attempts), ("pending", 1))
+
+
+class ResponseSizeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        _create_library(self.user, 20)
+
+    def test_tiles_share_one_stylesheet(self):
+        response = self.client.get("/books")
+        self.assertNotContains(response, "<style")
+        self.assertContains(response, "/static/books/books.css", count=1)
+
+    @override_settings(MINIFY_HTML=True)
+    def test_minifies_and_compresses_html(self):
+        plain = self.client.get("/books")
+        compressed = self.client.get("/books", headers={"accept-encoding": "gzip"})
+        self.assertIn('\n<div class="book">\n<picture>\n', plain.content.decode())
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertLess(len(compressed.content), len(plain.content) / 4)
+
+    @override_settings(MINIFY_HTML=True)
+    async def test_minifies_without_adapting_to_sync_under_asgi(self):
+        async def get_response(request):
+            return HttpResponse("<div>\n    <p>Dune</p>\n</div>")
+
+        middleware = HtmlMinifyMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get("/books"))
+        self.assertEqual(response.content, b"<div>\n<p>Dune</p>\n</div>")
+
+    def test_minify_keeps_preformatted_text(self):
+        html = "<div>\n    <textarea>\n  a\n    b</textarea>\n  <pre> x\n  y </pre>\n</div>"
+        self.assertEqual(
+            minify_html(html),
+            "<div>\n<textarea>\n  a\n    b</textarea>\n<pre> x\n  y </pre>\n</div>",
+        )
+
+    def test_serves_fingerprinted_static_files_as_immutable(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        for name in ("books.0123456789ab.css", "books.css"):
+            with open(os.path.join(static_root.name, name), "w") as static_file:
+                static_file.write(".book {}")
+
+        with override_settings(STATIC_ROOT=static_root.name):
+            fingerprinted = self.client.get("/static/books.0123456789ab.css")
+            plain = self.client.get("/static/books.css")
+        self.assertIn("immutable", fingerprinted["Cache-Control"])
+        self.assertEqual(plain["Cache-Control"], "no-cache")
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        self.ownedbooks = _create_library(self.user, 3)
+
+    def test_cached_page_skips_queries(self):
+        first = self.client.get("/books")
+        with self.assertNumQueries(3):  # Session, user and validator.
+            second = self.client.get("/books")
+        self.assertContains(second, "Book 00002")
+        self.assertEqual(
+            first.content.split(b"X-CSRFToken")[0],
+            second.content.split(b"X-CSRFToken")[0],
+        )
+
+    def test_adding_and_removing_evict_pages(self):
+        (book,) = ingest_volumes([_make_volume(1)])
+        self.client.get("/books")
+        self.client.post("/books/add", {"book_id": book.id})
+        self.assertContains(self.client.get("/books"), "Book 1")
+        self.client.post(f"/books/{self.ownedbooks[0].id}/remove")
+        self.assertNotContains(self.client.get("/books"), "Book 00000")
+
+    def test_rating_and_review_keep_pages(self):
+        key = get_page_cache_key(self.user.id, "")
+        self.client.post(f"/books/{self.ownedbooks[0].id}/rate", {"rating": 7})
+        self.client.post(f"/books/{self.ownedbooks[0].id}/review", {"review": "Hm"})
+        self.assertEqual(get_page_cache_key(self.user.id, ""), key)
+
+    def test_changed_authors_and_books_evict_pages(self):
+        self.client.get("/books")
+        author = Author.objects.get(full_name="Author 0")
+        author.full_name = "Renamed Author"
+        author.save()
+        self.assertContains(self.client.get("/books"), "Renamed Author")
+
+        book = self.ownedbooks[1].book
+        book.authors.add(Author.objects.create(full_name="New Author"))
+        self.assertContains(self.client.get("/books"), "New Author")
+
+        book.refresh_from_db()
+        book.description = "New description"
+        book.thumbnail_url = None
+        book.save()
+        self.assertContains(self.client.get("/books"), "New description")
+
+    def test_unchanged_tiles_are_reused(self):
+        self.client.get("/books")
+        # Neither a new modified_at nor any signal, so the tile stays cached.
+        Book.objects.filter(title="Book 00000").update(description="Changed")
+        evict_user_pages([self.user.id])
+        response = self.client.get("/books")
+        self.assertContains(response, "Description 0")
+        self.assertNotContains(response, "Changed")
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        self.ownedbooks = _create_library(self.user, 3)
+
+    def revalidate(self, url, response, **headers):
+        return self.client.get(
+            url, headers={"if-none-match": response["ETag"], **headers}
+        )
+
+    def test_unchanged_library_is_not_modified(self):
+        response = self.client.get("/books")
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with self.assertNumQueries(3):  # Session, user and validator.
+            revalidated = self.revalidate("/books", response)
+        self.assertEqual(revalidated.status_code, 304)
+
+        # Other pages and htmx fragments have their own ETags.
+        self.assertEqual(
+            self.revalidate("/books?after_id=1", response).status_code, 200
+        )
+        self.assertEqual(
+            self.revalidate("/books", response, hx_request="true").status_code, 200
+        )
+
+    def test_changes_to_library_or_books_modify_it(self):
+        response = self.client.get("/books")
+        self.client.post(f"/books/{self.ownedbooks[0].id}/remove")
+        response = self.revalidate("/books", response)
+        self.assertEqual(response.status_code, 200)
+
+        author = Author.objects.get(full_name="Author 1")
+        author.full_name = "Renamed Author"
+        author.save()
+        self.assertEqual(self.revalidate("/books", response).status_code, 200)
+
+    def test_edit_page(self):
+        url = f"/books/{self.ownedbooks[0].id}"
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        self.client.post(f"{url}/rate", {"rating": 5})
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        other_url = f"/books/{self.ownedbooks[1].id}"
+        self.assertEqual(self.revalidate(other_url, response).status_code, 200)
+
+
+class PerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        _create_library(self.user, 3)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=1)
+    def test_reports_server_timing_and_logs(self):
+        with self.assertLogs("books.performance", "INFO") as logs:
+            response = self.client.get("/books")
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="5 queries", upstream;dur=0.0;desc="0 calls, 0 bytes"'
+            r", template;dur=[\d.]+, total;dur=[\d.]+$",
+        )
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual((data["path"], data["db_queries"]), ("/books", 5))
+        self.assertGreater(data["template_ms"], 0)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=1, DEBUG=True)
+    async def test_instruments_asgi_requests_without_adapting_to_sync(self):
+        await self.async_client.aforce_login(self.user)
+        # With DEBUG, Django logs "Asynchronous handler adapted for middleware".
+        with (
+            self.assertNoLogs("django.request", "DEBUG"),
+            self.assertLogs("books.performance", "INFO"),
+        ):
+            response = await self.async_client.get("/books")
+        self.assertIn('desc="5 queries"', response["Server-Timing"])
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        self.assertFalse(self.client.get("/books").has_header("Server-Timing"))
+
+    def test_accounts_upstream_calls_from_worker_threads(self):
+        response = requests.Response()
+        response.url = "https://www.googleapis.com/books/v1/volumes?q=x"
+        response._content = b"{}"
+        response.elapsed = timedelta(milliseconds=20)
+
+        metrics = performance.start_request()
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(
+                    executor.map(
+                        performance.propagate_context(
+                            performance.record_upstream_response
+                        ),
+                        [response, response],
+                    )
+                )
+        finally:
+            performance.end_request()
+        self.assertEqual(metrics.upstream_calls, {"www.googleapis.com": 2})
+        self.assertEqual(metrics.upstream_bytes, 4)
+        self.assertAlmostEqual(metrics.upstream_time, 0.04)
+
+
+class SeedLibraryTest(TestCase):
+    def seed(self):
+        stdout = io.StringIO()
+        call_command(
+            "seed_library",
+            "--books=200",
+            "--authors=20",
+            "--publishers=5",
+            "--users=3",
+            "--library-size=10",
+            "--batch-size=30",
+            "--chunk-size=70",
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def test_seeds_catalog_and_libraries(self):
+        output = self.seed()
+        self.assertIn("Seeded 200 book(s), 20 author(s), 5 publisher(s)", output)
+        self.assertIn(f"added {OwnedBook.objects.count()} owned book(s)", output)
+        self.assertEqual(Book.objects.count(), 200)
+        self.assertEqual(Author.objects.count(), 20)
+        self.assertEqual(Publisher.objects.count(), 5)
+        self.assertEqual(User.objects.count(), 3)
+        self.assertFalse(Book.objects.filter(authors=None).exists())
+        self.assertTrue(OwnedBook.objects.exists())
+        self.assertTrue(get_search_backend().search(title="the"))
+
+    def test_seeding_again_adds_nothing(self):
+        self.assertNotIn("added 0 owned book(s)", self.seed())
+        counts = [
+            model.objects.count()
+            for model in (Book, Book.authors.through, Author, OwnedBook, User)
+        ]
+        self.assertIn("added 0 owned book(s)", self.seed())
+        self.assertEqual(
+            [
+                model.objects.count()
+                for model in (Book, Book.authors.through, Author, OwnedBook, User)
+            ],
+            counts,
+        )
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin")
+        self.client.force_login(self.user)
+
+    def get_changelist(self, model, query=""):
+        response = self.client.get(reverse(f"admin:books_{model}_changelist") + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def test_queries_do_not_grow_with_rows(self):
+        _create_library(self.user, 5)
+        num_queries = {}
+        for model in ("book", "ownedbook", "author", "publisher"):
+            with CaptureQueriesContext(connection) as queries:
+                self.get_changelist(model)
+            num_queries[model] = len(queries)
+
+        Book.objects.all().delete()
+        _create_library(self.user, 30)
+        for model, expected_num_queries in num_queries.items():
+            with self.subTest(model), self.assertNumQueries(expected_num_queries):
+                self.get_changelist(model)
+
+    def test_prefix_search_ignores_case_of_first_letters(self):
+        _create_library(self.user, 30)
+        cl = self.get_changelist("book", "?q=book+0001")
+        self.assertEqual(
+            sorted(book.title for book in cl.result_list),
+            [f"Book {i:05d}" for i in range(10, 20)],
+        )
+        self.assertEqual(self.get_changelist("book", "?q=author+2").result_count, 10)
+        self.assertEqual(self.get_changelist("book", "?q=peng").result_count, 30)
+        self.assertEqual(self.get_changelist("book", "?q=ook").result_count, 0)
+
+    def test_prefix_search_uses_indexes(self):
+        book_admin = admin.site._registry[Book]
+        queryset, may_have_duplicates = book_admin.get_search_results(
+            None, Book.objects.all(), "dune"
+        )
+        self.assertFalse(may_have_duplicates)
+        QueryPlanTest.assertUsesIndex(self, queryset)
+
+    @override_settings(ADMIN_COUNT_ESTIMATE_THRESHOLD=0, ADMIN_COUNT_LIMIT=4)
+    def test_estimates_counts(self):
+        books = [ownedbook.book for ownedbook in _create_library(self.user, 10)]
+        books[0].delete()
+        self.assertEqual(self.get_changelist("book").result_count, books[-1].id)
+        self.assertEqual(self.get_changelist("book", "?q=Book").result_count, 4)
+
+    def test_truncates_reviews(self):
+        ownedbook = _create_library(self.user, 1)[0]
+        ownedbook.review = "Long " * 100
+        ownedbook.save()
+        cl = self.get_changelist("ownedbook")
+        excerpt = cl.model_admin.review_excerpt(cl.result_list[0])
+        self.assertEqual(len(excerpt), admin_module.REVIEW_EXCERPT_LENGTH)
+        self.assertTrue(excerpt.endswith("…"))
+
+
+@override_settings(
+    GOOGLE_BOOKS_MAX_RETRIES=2,
+    GOOGLE_BOOKS_RETRY_BACKOFF=0,
+    GOOGLE_BOOKS_CIRCUIT_FAILURE_THRESHOLD=3,
+)
+class UpstreamClientTest(TestCase):
+    def setUp(self):
+        caches[settings.GOOGLE_BOOKS_CACHE_ALIAS].clear()
+        caches[settings.GOOGLE_BOOKS_STATE_CACHE_ALIAS].clear()
+
+    def _response(self, status_code, data=None, headers=None):
+        response = mock.Mock(ok=status_code < 400, status_code=status_code)
+        response.json.return_value = data or {}
+        response.headers = headers or {}
+        return response
+
+    def _mock_get(self, *responses):
+        return mock.patch("requests.Session.get", side_effect=responses)
+
+    def test_retries_server_errors_with_timeouts(self):
+        data = {"items": [{"id": "1"}]}
+        with self._mock_get(self._response(503), self._response(200, data)) as get:
+            self.assertEqual(search_google_books(isbn="9780441013593"), data)
+        self.assertEqual(
+            get.call_args.kwargs["timeout"],
+            (settings.GOOGLE_BOOKS_CONNECT_TIMEOUT, settings.GOOGLE_BOOKS_READ_TIMEOUT),
+        )
+        stats = get_google_books_client().get_stats()
+        self.assertEqual(
+            [stats["requests"], stats["retries"], stats["failures"]], [2, 1, 1]
+        )
+        self.assertEqual(stats["circuit"], "closed")
+
+    def test_opens_circuit_after_failures_and_fails_fast(self):
+        with self._mock_get(*[requests.ConnectionError] * 3):
+            with self.assertRaises(UpstreamUnavailable):
+                search_google_books(isbn="9780441013593")
+        with self._mock_get() as get, self.assertRaises(UpstreamUnavailable):
+            search_google_books(isbn="9780441013594")
+        get.assert_not_called()
+        stats = get_google_books_client().get_stats()
+        self.assertEqual(stats["circuit"], "open")
+        self.assertEqual(stats["short_circuited"], 1)
+
+    def test_closes_circuit_after_successful_trial(self):
+        with self._mock_get(self._response(429, headers={"Retry-After": "120"})):
+            with self.assertRaises(UpstreamUnavailable):
+                search_google_books(isbn="9780441013593")
+        breaker = get_google_books_client().breaker
+        self.assertEqual(breaker.state, "open")
+
+        breaker.cache.set(breaker.open_until_key, time.time() - 1)
+        self.assertEqual(breaker.state, "half_open")
+        with self._mock_get(self._response(200, {"items": [{"id": "1"}]})):
+            search_google_books(isbn="9780441013593")
+        self.assertEqual(breaker.state, "closed")
+
+    def test_counts_when_a_counter_expires_before_increment(self):
+        cache = get_google_books_client().cache
+        with self._mock_get(*[requests.ConnectionError] * 3):
+            with mock.patch.object(cache, "incr", side_effect=ValueError):
+                with self.assertRaises(UpstreamUnavailable):
+                    search_google_books(isbn="9780441013593")
+        stats = get_google_books_client().get_stats()
+        self.assertEqual([stats["requests"], stats["failures"]], [1, 1])
+
+    @override_settings(
+        GOOGLE_BOOKS_RATE_LIMIT=1,
+        GOOGLE_BOOKS_RATE_LIMIT_BURST=2,
+        GOOGLE_BOOKS_RATE_LIMIT_WAIT=0,
+    )
+    def test_rate_limits_requests(self):
+        with self._mock_get(*[self._response(200, {"items": []})] * 2):
+            search_google_books(isbn="1")
+            search_google_books(isbn="2")
+            with self.assertRaises(UpstreamUnavailable):
+                search_google_books(isbn="3")
+        stats = get_google_books_client().get_stats()
+        self.assertEqual([stats["requests"], stats["rate_limited"]], [2, 1])
+        self.assertLess(stats["tokens"], 1)
+
+    def test_stats_are_for_staff(self):
+        user = User.objects.create_user("reader")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/upstream/stats").status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get("/upstream/stats")
+        self.assertEqual(response.json()["google_books"]["circuit"], "closed")
@@ -0,0 +1,157 @@
+"""Local mirror of Book covers, with resized derivatives.
+
+Each cover is downloaded once and stored in default_storage (MEDIA_ROOT)
+under the SHA-256 of its content, next to WebP and JPEG derivatives of
+THUMBNAIL_WIDTHS (see get_derivative_widths() for small covers). As a name
+never changes its content, the files are served with far-future immutable
+cache headers (see views.thumbnail) and tiles no longer depend on Google's
+CDN. Covers identical across editions share their files. A tiny blurred
+placeholder is stored on the Book itself, so tiles show something before
+the cover has loaded.
+"""
+
+import base64
+import hashlib
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+from .http_client import get_http_session
+
+THUMBNAIL_DIRECTORY = "thumbnails"
+DERIVATIVE_FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+}
+
+
+class ThumbnailError(Exception):
+    """The cover could not be downloaded or is not an image."""
+
+
+@dataclass
+class MirroredThumbnail:
+    digest: str
+    width: int
+    height: int
+    placeholder: str
+    """Tiny blurred preview as data URI, see make_placeholder()."""
+
+
+def mirror_thumbnail(url: str) -> MirroredThumbnail:
+    """Download and store a cover with its derivatives."""
+    data = _download(url)
+    digest = hashlib.sha256(data).hexdigest()
+
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError) as error:
+        raise ThumbnailError(f"{url} is not an image: {error}") from error
+    image = ImageOps.exif_transpose(image)
+
+    name = get_thumbnail_name(digest)
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    for width, actual_width in get_derivative_widths(image.width).items():
+        for extension, image_format in DERIVATIVE_FORMATS.items():
+            name = get_thumbnail_name(digest, width, extension)
+            if not default_storage.exists(name):
+                default_storage.save(
+                    name, ContentFile(_resize(image, actual_width, image_format))
+                )
+    return MirroredThumbnail(digest, *image.size, make_placeholder(image))
+
+
+def make_placeholder(image: Image.Image) -> str:
+    """Low quality image placeholder, small enough to inline into every tile.
+
+    Scaled up by the browser, a THUMBNAIL_PLACEHOLDER_WIDTH pixels wide
+    image is a blurred version of the cover in a few hundred bytes.
+    """
+    width = settings.THUMBNAIL_PLACEHOLDER_WIDTH
+    image = image.convert("RGB")
+    image.thumbnail((width, image.height * width // image.width or 1))
+    image = image.filter(ImageFilter.GaussianBlur(radius=1))
+    output = BytesIO()
+    image.save(output, "WEBP", quality=50)
+    return "data:image/webp;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def get_thumbnail_name(digest: str, width: int = None, extension: str = None) -> str:
+    """Storage name of the original (no width) or one of its derivatives."""
+    filename = digest if width is None else f"{digest}-{width}.{extension}"
+    # Fanning out keeps directories small on large catalogs.
+    return f"{THUMBNAIL_DIRECTORY}/{digest[:2]}/{filename}"
+
+
+def get_derivative_widths(source_width: int) -> Dict[int, int]:
+    """Actual width of the derivatives by the width they are named after.
+
+    Covers are never scaled up. The widths of THUMBNAIL_WIDTHS beyond that
+    of the cover would all be the cover itself, there is only one such
+    derivative, named after the smallest of them. An unknown (0) source
+    width is taken as large enough for all.
+    """
+    derivative_widths = {}
+    for width in sorted(settings.THUMBNAIL_WIDTHS):
+        actual_width = min(width, source_width or width)
+        if actual_width not in derivative_widths.values():
+            derivative_widths[width] = actual_width
+    return derivative_widths
+
+
+def get_thumbnail_srcsets(digest: str, source_width: int) -> Dict[str, str]:
+    """``srcset`` attribute values per derivative format, e.g. for <picture>.
+
+    The descriptors are the actual widths, so browsers do not pick a
+    derivative for more pixels than it has.
+    """
+    derivative_widths = get_derivative_widths(source_width)
+    return {
+        extension: ", ".join(
+            f"{default_storage.url(get_thumbnail_name(digest, width, extension))} "
+            f"{actual_width}w"
+            for width, actual_width in derivative_widths.items()
+        )
+        for extension in DERIVATIVE_FORMATS
+    }
+
+
+def get_thumbnail_url(digest: str, source_width: int, extension: str = "jpeg") -> str:
+    """URL of the largest derivative."""
+    width = max(get_derivative_widths(source_width))
+    return default_storage.url(get_thumbnail_name(digest, width, extension))
+
+
+def _download(url: str) -> bytes:
+    max_bytes = settings.THUMBNAIL_MIRROR_MAX_BYTES
+    with get_http_session().get(
+        url, stream=True, timeout=settings.THUMBNAIL_PROBE_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            data += chunk
+            if len(data) > max_bytes:
+                raise ThumbnailError(f"{url} is larger than {max_bytes} bytes")
+    return bytes(data)
+
+
+def _resize(image: Image.Image, width: int, image_format: str) -> bytes:
+    """Scale to exactly ``width`` keeping the aspect ratio."""
+    if width != image.width:
+        image = image.resize(
+            (width, round(image.height * width / image.width) or 1),
+            Image.Resampling.BICUBIC,
+        )
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    output = BytesIO()
+    image.save(output, image_format, quality=settings.THUMBNAIL_QUALITY)
+    return output.getvalue()
@@ -0,0 +1,251 @@
+"""Protection of the site against a slow, failing or throttling upstream.
+
+UpstreamClient wraps GET requests of the shared HTTP session with:
+
+- A token bucket rate limiter, so bursts from all workers together stay
+  within the upstream quota.
+- Explicit connect and read timeouts, so no worker hangs on a stalled
+  connection.
+- Retries with exponential backoff and full jitter for connection errors,
+  timeouts, 429 and 5xx responses (GET is idempotent).
+- A circuit breaker that opens after repeated failures (or on 429 with a
+  Retry-After) and fails fast while open, letting callers fall back to
+  cached or local results. After a while a single trial request is let
+  through to probe whether upstream is back.
+
+The bucket, the breaker and the counters of get_stats() live in a cache.
+With a shared backend (Redis, Memcached) they hold across all processes,
+with LocMemCache each process limits and trips on its own.
+"""
+
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import requests
+from django.core.cache import caches
+
+from .http_client import get_http_session
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("requests", "retries", "failures", "rate_limited", "short_circuited")
+
+
+class UpstreamUnavailable(Exception):
+    """Upstream is failing, throttling us or the circuit is open."""
+
+
+class TokenBucket:
+    """Up to ``capacity`` requests at once, refilled at ``rate`` per second."""
+
+    def __init__(self, cache, key: str, rate: float, capacity: int):
+        self.cache = cache
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+
+    def acquire(self, timeout: float) -> bool:
+        """Take a token, waiting up to ``timeout`` seconds for one."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def available(self) -> float:
+        with self._lock():
+            return self._refill()[0]
+
+    def _take(self) -> float:
+        """Take a token if there is one, else return seconds until there is."""
+        with self._lock():
+            tokens, now = self._refill()
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            # Expires when the bucket would be full again anyway.
+            self.cache.set(
+                self.key, (tokens - 1, now), timeout=int(self.capacity / self.rate) + 1
+            )
+            return 0
+
+    def _refill(self) -> Tuple[float, float]:
+        now = time.time()
+        tokens, updated_at = self.cache.get(self.key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated_at) * self.rate), now
+
+    @contextmanager
+    def _lock(self):
+        # add() is atomic. The lock expires, should its holder die.
+        lock_key = f"{self.key}:lock"
+        while not self.cache.add(lock_key, True, timeout=1):
+            time.sleep(0.001)
+        try:
+            yield
+        finally:
+            self.cache.delete(lock_key)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, cache, key: str, failure_threshold: int, reset_timeout: float):
+        self.cache = cache
+        self.failures_key = f"{key}:failures"
+        self.open_until_key = f"{key}:open-until"
+        self.trial_key = f"{key}:trial"
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    @property
+    def state(self) -> str:
+        open_until = self.cache.get(self.open_until_key)
+        if open_until is None:
+            return self.CLOSED
+        if time.time() < open_until:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == self.HALF_OPEN:
+            # Only one trial request, the others keep failing fast.
+            return self.cache.add(self.trial_key, True, timeout=self.reset_timeout)
+        return state == self.CLOSED
+
+    def record_success(self):
+        self.cache.delete_many([self.failures_key, self.open_until_key, self.trial_key])
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        # Failures count towards the threshold for reset_timeout seconds.
+        num_failures = _increment(self.cache, self.failures_key, self.reset_timeout)
+        if (
+            retry_after is not None
+            or num_failures >= self.failure_threshold
+            or self.state == self.HALF_OPEN
+        ):
+            open_for = max(self.reset_timeout, retry_after or 0)
+            logger.warning(
+                "Opening circuit %s for %ss after %s failure(s)",
+                self.open_until_key,
+                open_for,
+                num_failures,
+            )
+            self.cache.set(self.open_until_key, time.time() + open_for, timeout=None)
+            self.cache.delete(self.trial_key)
+
+
+class UpstreamClient:
+    def __init__(
+        self,
+        name: str,
+        cache_alias: str,
+        rate: float,
+        burst: int,
+        rate_limit_wait: float,
+        connect_timeout: float,
+        read_timeout: float,
+        max_retries: int,
+        retry_backoff: float,
+        failure_threshold: int,
+        reset_timeout: float,
+    ):
+        self.name = name
+        self.cache = caches[cache_alias]
+        self.bucket = TokenBucket(self.cache, f"upstream:{name}:tokens", rate, burst)
+        self.breaker = CircuitBreaker(
+            self.cache, f"upstream:{name}:circuit", failure_threshold, reset_timeout
+        )
+        self.rate_limit_wait = rate_limit_wait
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    def get(self, url: str) -> requests.Response:
+        """GET ``url``, raise UpstreamUnavailable instead of waiting on upstream.
+
+        Responses other than 429 and 5xx are returned as they are, e.g. a 400
+        for a bad query is not the upstream's fault.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+                time.sleep(random.uniform(0, self.retry_backoff * 2 ** (attempt - 1)))
+
+            if not self.breaker.allow_request():
+                self._count("short_circuited")
+                raise UpstreamUnavailable(f"Circuit of {self.name} is open") from error
+            if not self.bucket.acquire(self.rate_limit_wait):
+                self._count("rate_limited")
+                raise UpstreamUnavailable(f"Rate limit of {self.name} reached")
+
+            self._count("requests")
+            try:
+                response = get_http_session().get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as request_error:
+                error = request_error
+                self._count("failures")
+                self.breaker.record_failure()
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                error = requests.HTTPError(
+                    f"{response.status_code} from {self.name}", response=response
+                )
+                self._count("failures")
+                self.breaker.record_failure(_get_retry_after(response))
+                continue
+
+            self.breaker.record_success()
+            return response
+
+        raise UpstreamUnavailable(
+            f"{self.name} failed {self.max_retries + 1} time(s)"
+        ) from error
+
+    def get_stats(self) -> dict:
+        """Counters since the cache was cleared, circuit state and tokens left."""
+        counters = self.cache.get_many(
+            [self._get_counter_key(counter) for counter in COUNTERS]
+        )
+        return {
+            "circuit": self.breaker.state,
+            "tokens": round(self.bucket.available(), 2),
+            **{
+                counter: counters.get(self._get_counter_key(counter), 0)
+                for counter in COUNTERS
+            },
+        }
+
+    def _count(self, counter: str):
+        _increment(self.cache, self._get_counter_key(counter), timeout=None)
+
+    def _get_counter_key(self, counter: str) -> str:
+        return f"upstream:{self.name}:{counter}"
+
+
+def _increment(cache, key: str, timeout: Optional[float]) -> int:
+    """Increment a counter in the cache, starting it if missing."""
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key expired or was evicted since add().
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def _get_retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds of a Retry-After header, if given in seconds (not as a date)."""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
@@ -1,85 +1,59 @@
-from typing import List, Optional
-
-import requests
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db import transaction
-from django.shortcuts import redirect
+from django.core.cache import caches
+from django.core.exceptions import BadRequest
+from django.db.models import (
+    Case,
+    Count,
+    Max,
+    Prefetch,
+    Q,
+    When,
+    prefetch_related_objects,
+)
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
+from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.urls import reverse
-from django.views.decorators.http import require_http_methods
-from django.views.generic import ListView
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+from django.views import static
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
+from django.views.generic import ListView, View
 from django.views.generic.edit import UpdateView
 
-from .models import Author, Book, OwnedBook, Publisher
-
-
-def search_google_books(
-    isbn: Optional[str] = None,
-    title: Optional[str] = None,
-    author: Optional[str] = None,
-    max_results: Optional[int] = settings.GOOGLE_BOOKS_MAX_RESULTS,
-    language: Optional[str] = settings.GOOGLE_BOOKS_LANGUAGE_RESTRICT,
-) -> dict:
-    if not any([isbn, title, author]):
-        raise ValueError("Must search by either ISBN or title/author")
-
-    url = settings.GOOGLE_BOOKS_BASE_URL
-    query = "?q="
-    if isbn:
-        query += f"isbn:{isbn}"
-    elif title or author:
-        if title:
-            query += f"intitle:{title}"
-        if title and author:
-            query += ","
-        if author:
-            query += f"inauthor:{author}"
-
-    query += f"&maxResults={max_results}"
-    if language:
-        query += f"&langRestrict={language}"
-    url += query
-
-    response = requests.get(url)
-    return response.json()
-
-
-@transaction.atomic()
-def get_or_create_book(
-    title: str,
-    author_names: List[str],
-    isbn: Optional[str] = None,
-    publisher_name: Optional[str] = None,
-):
-    publisher = None
-    if publisher_name:
-        publisher, _ = Publisher.objects.get_or_create(name=publisher_name)
-
-    authors = []
-    for author_name in author_names:
-        author, _ = Author.objects.get_or_create(full_name=author_name)
-        authors.append(author)
-
-    if isbn:
-        book, created = Book.objects.get_or_create(
-            isbn=isbn,
-        )
-        if created:
-            book.publisher = publisher
-            book.title = title
-            book.save()
-    else:
-        book, created = Book.objects.get_or_create(
-            publisher=publisher,
-            title=title,
-        )
-
-    if authors:
-        book.authors.set(authors)
+from . import isbn_lookup, library_export, library_import, page_cache, thumbnails
+from .enrichment import enqueue_book_enrichment
+from .google_books import get_google_books_client, search_google_books
+from .ingest import ingest_volumes
+from .isbn import get_isbn_variants, normalize_isbn
+from .models import Author, Book, OwnedBook
+from .search_index import get_search_backend
+from .upstream import UpstreamUnavailable
 
-    return book
+FINGERPRINTED_NAME = re.compile(r"\.[0-9a-f]{12}\.\w+$")
 
 
 class LoginView(auth_views.LoginView):
@@ -90,19 +64,177 @@ class LogoutView(LoginRequiredMixin, auth_views.LogoutView):
     template_name = "logout.html"
 
 
+def _get_library_validator(request) -> Tuple[str, Optional[datetime]]:
+    """ETag and Last-Modified of the user's grid, from one aggregate query.
+
+    Adding an Owned Book or changing one of its Books (authors included,
+    see books.signals) moves the latest modified_at, removing one changes
+    the count.
+    """
+    if not hasattr(request, "_library_validator"):
+        library = OwnedBook.objects.filter(user=request.user).aggregate(
+            count=Count("id"),
+            ownedbook_modified_at=Max("modified_at"),
+            book_modified_at=Max("book__modified_at"),
+        )
+        last_modified = max(
+            filter(
+                None, [library["ownedbook_modified_at"], library["book_modified_at"]]
+            ),
+            default=None,
+        )
+        request._library_validator = (
+            _get_etag(request, library["count"], last_modified),
+            last_modified,
+        )
+    return request._library_validator
+
+
+def _get_ownedbook_validator(request, pk) -> Tuple[str, Optional[datetime]]:
+    if not hasattr(request, "_ownedbook_validator"):
+        modified_ats = (
+            OwnedBook.objects.filter(id=pk, user=request.user)
+            .values_list("modified_at", "book__modified_at")
+            .first()
+        )
+        last_modified = max(modified_ats) if modified_ats else None
+        request._ownedbook_validator = (
+            _get_etag(request, pk, last_modified),
+            last_modified,
+        )
+    return request._ownedbook_validator
+
+
+def _get_etag(request, *values) -> str:
+    """Hash ``values`` with whatever else the page depends on.
+
+    The page embeds a CSRF token, which changes with the CSRF secret.
+    """
+    get_token(request)  # Sets the secret the page would use if there is none.
+    validator = [
+        request.user.id,
+        request.get_full_path(),
+        bool(request.htmx),
+        request.META["CSRF_COOKIE"],
+        *values,
+    ]
+    return hashlib.sha256(json.dumps(validator, default=str).encode()).hexdigest()
+
+
+# Browsers revalidate on every load and get a 304 while nothing changed.
+@method_decorator(
+    [
+        cache_control(private=True, no_cache=True),
+        condition(
+            etag_func=lambda request: _get_library_validator(request)[0],
+            last_modified_func=lambda request: _get_library_validator(request)[1],
+        ),
+    ],
+    name="get",
+)
 class OwnedBookList(LoginRequiredMixin, ListView):
+    """Owned Books grid, loaded page by page as the user scrolls.
+
+    Pages are addressed by a (book title, id) cursor instead of an offset,
+    so each page costs the same no matter how deep into the library it is.
+    """
+
     model = OwnedBook
+    context_object_name = "ownedbook_list"
+    template_name = "books/ownedbook_list.html"
 
     def get_queryset(self):
         """Return only Books owned by current User."""
-        return (
+        queryset = (
             super()
             .get_queryset()
             .filter(user=self.request.user)
-            .order_by("book__title")
+            .select_related("book", "book__publisher")
+            .prefetch_related(
+                Prefetch("book__authors", queryset=Author.objects.order_by("full_name"))
+            )
+            .order_by("book__title", "id")
         )
 
+        after_title = self.request.GET.get("after_title")
+        after_id = self.request.GET.get("after_id")
+        if after_title is not None and after_id:
+            try:
+                after_id = int(after_id)
+            except ValueError:
+                raise BadRequest(f"Invalid cursor id {after_id!r}")
+            queryset = queryset.filter(
+                Q(book__title__gt=after_title)
+                | Q(book__title=after_title, id__gt=after_id)
+            )
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        """Add the rendered page of tiles, from the cache if possible."""
+        cache = caches[settings.OWNED_BOOKS_PAGE_CACHE_ALIAS]
+        cache_key = page_cache.get_page_cache_key(
+            self.request.user.id, self.request.GET.urlencode()
+        )
+        page = cache.get(cache_key)
+        if page is None:
+            page = render_to_string(
+                "books/ownedbook_list_page.html", self.get_page_context_data()
+            )
+            cache.set(cache_key, page, settings.OWNED_BOOKS_PAGE_CACHE_TIMEOUT)
+
+        # The queryset is only evaluated when the page was not cached.
+        context = super().get_context_data(**kwargs)
+        context["page"] = mark_safe(page)
+        return context
+
+    def get_page_context_data(self):
+        page_size = settings.OWNED_BOOKS_PAGE_SIZE
+        ownedbooks = list(self.object_list[: page_size + 1])
+
+        next_page_url = None
+        if len(ownedbooks) > page_size:
+            ownedbooks = ownedbooks[:page_size]
+            last_ownedbook = ownedbooks[-1]
+            next_page_url = "?" + urlencode(
+                {
+                    "after_title": last_ownedbook.book.title,
+                    "after_id": last_ownedbook.id,
+                }
+            )
 
+        # Covers above the fold load right away, the rest once scrolled to.
+        is_first_page = "after_id" not in self.request.GET
+        for i, ownedbook in enumerate(ownedbooks):
+            if is_first_page and i < settings.OWNED_BOOKS_EAGER_TILES:
+                ownedbook.loading = "eager"
+            else:
+                ownedbook.loading = "lazy"
+
+        return {
+            "ownedbook_list": ownedbooks,
+            "next_page_url": next_page_url,
+            "is_first_page": is_first_page,
+        }
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.htmx:
+            return HttpResponse(context["page"])
+
+        return super().render_to_response(context, **response_kwargs)
+
+
+@method_decorator(
+    [
+        cache_control(private=True, no_cache=True),
+        condition(
+            etag_func=lambda request, pk: _get_ownedbook_validator(request, pk)[0],
+            last_modified_func=lambda request, pk: _get_ownedbook_validator(
+                request, pk
+            )[1],
+        ),
+    ],
+    name="get",
+)
 class OwnedBookEdit(LoginRequiredMixin, UpdateView):
     model = OwnedBook
     fields = ["progress", "rating", "review"]
@@ -122,10 +254,150 @@ class OwnedBookEdit(LoginRequiredMixin, UpdateView):
 def add_owned_book(request):
     book_id = request.POST["book_id"]
     book = Book.objects.get(id=book_id)
-    request.user.owned_books.add(book)
+    # Unlike owned_books.add(), this sends post_save, which evicts the pages.
+    OwnedBook.objects.get_or_create(user=request.user, book=book)
     return redirect("ownedbook-list")
 
 
+@login_required
+@require_http_methods(("POST",))
+def lookup_isbns(request):
+    """Look up a JSON list of ISBNs, e.g. ``{"isbns": [...], "add": true}``.
+
+    With ``add``, all Books found are added to the user's library at once.
+    ISBNs marked ``unavailable`` could not be looked up while Google Books
+    was unavailable, unlike those without a Book they are worth a retry.
+    """
+    try:
+        data = json.loads(request.body)
+        isbns = data["isbns"]
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"error": "Expected a JSON object with isbns"}, status=400)
+    if not isinstance(isbns, list) or not all(isinstance(i, str) for i in isbns):
+        return JsonResponse({"error": "isbns must be a list of strings"}, status=400)
+    if len(isbns) > settings.ISBN_LOOKUP_MAX_ISBNS:
+        return JsonResponse(
+            {"error": f"At most {settings.ISBN_LOOKUP_MAX_ISBNS} ISBNs per request"},
+            status=400,
+        )
+
+    books_by_isbn, unavailable_isbns = isbn_lookup.lookup_books_by_isbn(isbns)
+    books = [book for book in books_by_isbn.values() if book]
+    prefetch_related_objects(
+        books, Prefetch("authors", queryset=Author.objects.order_by("full_name"))
+    )
+
+    num_added = 0
+    if data.get("add"):
+        num_added = len(isbn_lookup.add_owned_books(request.user, books))
+    owned_book_ids = set(
+        OwnedBook.objects.filter(user=request.user, book__in=books).values_list(
+            "book_id", flat=True
+        )
+    )
+
+    results = [
+        {
+            "isbn": isbn,
+            "book": _get_book_data(book) if book else None,
+            "owned": book is not None and book.id in owned_book_ids,
+            "unavailable": isbn in unavailable_isbns,
+        }
+        for isbn, book in books_by_isbn.items()
+    ]
+    return JsonResponse({"results": results, "num_added": num_added})
+
+
+def _get_book_data(book: Book) -> dict:
+    return {
+        "id": book.id,
+        "isbn": book.isbn,
+        "title": book.title,
+        "authors": [author.full_name for author in book.authors.all()],
+        "thumbnail_url": book.thumbnail_url,
+    }
+
+
+@staff_member_required
+@require_http_methods(("GET",))
+def upstream_stats(request):
+    """Rate limit, circuit breaker and request counters of Google Books."""
+    return JsonResponse({"google_books": get_google_books_client().get_stats()})
+
+
+@login_required
+@require_http_methods(("GET", "POST"))
+def import_library(request):
+    result = None
+    if request.method == "POST":
+        if "file" not in request.FILES:
+            return HttpResponseBadRequest("No file uploaded")
+        # Wrapping the upload streams it, Django spools big files to disk.
+        csv_file = io.TextIOWrapper(
+            request.FILES["file"], encoding="utf-8-sig", newline=""
+        )
+        try:
+            result = library_import.import_library(
+                request.user, library_import.parse_rows(csv_file)
+            )
+        except (UnicodeDecodeError, csv.Error) as error:
+            return render(
+                request,
+                "books/import.html",
+                {"error": f"The file is not a UTF-8 encoded CSV file: {error}"},
+                status=400,
+            )
+    return render(request, "books/import.html", {"result": result})
+
+
+@login_required
+@require_http_methods(("GET",))
+def export_library(request):
+    format = request.GET.get("format", "csv")
+    if format not in library_export.FORMATS:
+        return HttpResponseBadRequest(f"Unknown export format {format!r}")
+
+    response = StreamingHttpResponse(
+        library_export.export_lines(request.user, format),
+        content_type=library_export.FORMATS[format],
+    )
+    response["Content-Disposition"] = f'attachment; filename="library.{format}"'
+    return response
+
+
+@require_http_methods(("GET", "HEAD"))
+def thumbnail(request, path):
+    """Serve a mirrored cover, books.thumbnails names never change content.
+
+    Behind a web server, serve MEDIA_ROOT directly with the same headers.
+    """
+    response = static.serve(
+        request,
+        path,
+        document_root=os.path.join(settings.MEDIA_ROOT, thumbnails.THUMBNAIL_DIRECTORY),
+    )
+    patch_cache_control(
+        response, public=True, max_age=settings.THUMBNAIL_CACHE_MAX_AGE, immutable=True
+    )
+    return response
+
+
+@require_http_methods(("GET", "HEAD"))
+def static_file(request, path):
+    """Serve collected static files when DEBUG is off and there is no web server.
+
+    Fingerprinted names (see STORAGES) are cached forever, others revalidated.
+    """
+    response = static.serve(request, path, document_root=settings.STATIC_ROOT)
+    if FINGERPRINTED_NAME.search(path):
+        patch_cache_control(
+            response, public=True, max_age=settings.STATIC_CACHE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
 @login_required
 @require_http_methods(("POST",))
 def remove_owned_book(request, ownedbook_id):
@@ -149,7 +421,7 @@ def set_rating(request, ownedbook_id):
     rating = request.POST["rating"]
     ownedbook = OwnedBook.objects.get(id=ownedbook_id, user=request.user)
     ownedbook.rating = rating
-    ownedbook.save(update_fields=["rating"])
+    ownedbook.save(update_fields=["rating", "modified_at"])
     return redirect("ownedbook-list")
 
 
@@ -159,79 +431,102 @@ def set_review(request, ownedbook_id):
     review = request.POST["review"]
     ownedbook = OwnedBook.objects.get(id=ownedbook_id, user=request.user)
     ownedbook.review = review
-    ownedbook.save(update_fields=["review"])
+    ownedbook.save(update_fields=["review", "modified_at"])
     return redirect("ownedbook-list")
 
 
-class Search(LoginRequiredMixin, ListView):
-    model = Book
-    template_name = "books/search.html"
-    context_object_name = "matching_books"
+class Search(View):
+    """Search the local catalog first and Google Books second.
 
-    def get_queryset(self):
-        isbn = self.request.GET.get("isbn", None)
-        title = self.request.GET.get("title", None)
-        author = self.request.GET.get("author", None)
+    Asynchronous, so that waiting on Google Books does not tie up a worker:
+    upstream requests run in a thread pool via the shared HTTP session and
+    database access goes through the async ORM or thread-sensitive calls.
+    """
 
-        if not any([isbn, title, author]):
-            return Book.objects.none()
+    template_name = "books/search.html"
 
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # LoginRequiredMixin would touch request.user synchronously.
+        return login_required(super().as_view(**initkwargs))
+
+    async def get(self, request, *args, **kwargs):
+        isbn = request.GET.get("isbn", None)
+        title = request.GET.get("title", None)
+        author = request.GET.get("author", None)
+
+        matching_books = []
+        owned_book_ids = set()
+        if any([isbn, title, author]):
+            book_ids = await self._find_book_ids(isbn, title, author)
+            matching_books = [
+                book
+                async for book in Book.objects.filter(id__in=book_ids)
+                .prefetch_related(
+                    Prefetch("authors", queryset=Author.objects.order_by("full_name"))
+                )
+                .order_by(
+                    Case(
+                        *[
+                            When(id=book_id, then=i)
+                            for i, book_id in enumerate(book_ids)
+                        ]
+                    )
+                )
+            ]
+            user = await request.auser()
+            owned_book_ids = {
+                book_id
+                async for book_id in OwnedBook.objects.filter(
+                    user=user, book_id__in=book_ids
+                ).values_list("book_id", flat=True)
+            }
+
+        context = {
+            "matching_books": matching_books,
+            "owned_book_ids": owned_book_ids,
+        }
+        return await sync_to_async(render)(request, self.template_name, context)
+
+    async def _find_book_ids(self, isbn, title, author) -> List[int]:
         if isbn:
-            normalized_isbn = _normalize_isbn(isbn)
-            google_books_data = search_google_books(isbn=normalized_isbn)
+            normalized_isbn = normalize_isbn(isbn)
+            book_ids = [
+                book_id
+                async for book_id in Book.objects.filter(
+                    isbn__in=get_isbn_variants(normalized_isbn)
+                ).values_list("id", flat=True)
+            ]
+            if not book_ids:
+                book_ids = await self._search_google_books(isbn=normalized_isbn) or []
         else:
-            google_books_data = search_google_books(title=title, author=author)
-
-        book_ids = []
-        volumes = google_books_data.get("items")
-        if not volumes:
-            return Book.objects.none()
-
-        for volume in volumes:
-            book = get_or_create_book(
-                title=volume["volumeInfo"]["title"],
-                author_names=volume["volumeInfo"].get("authors", []),
-                publisher_name=volume["volumeInfo"].get("publisher"),
-                isbn=_get_isbn_from_volume(volume),
+            book_ids = await sync_to_async(get_search_backend().search)(
+                title=title, author=author, limit=settings.GOOGLE_BOOKS_MAX_RESULTS
             )
-
-            search_info = volume.get("searchInfo")
-            if search_info:
-                description = search_info.get("textSnippet", "")
-                if description:
-                    book.description = description
-                    book.save(update_fields=["description"])
-
-            num_pages = volume["volumeInfo"].get("pageCount", 0)
-            if num_pages:
-                book.num_pages = num_pages
-                book.save(update_fields=["num_pages"])
-
-            image_links = volume["volumeInfo"].get("imageLinks")
-            if image_links:
-                book.thumbnail_url = image_links.get(
-                    "thumbnail", image_links.get("smallThumbnail")
+            if len(book_ids) < settings.LOCAL_SEARCH_MIN_RESULTS:
+                google_book_ids = await self._search_google_books(
+                    title=title, author=author
                 )
-                book.save(update_fields=["thumbnail_url"])
-                book.update_thumbnail_dimensions_from_url()
-
-            book.info_url = volume["volumeInfo"]["infoLink"]
-            book.save(update_fields=["info_url"])
-
-            book_ids.append(book.id)
-
-        matching_books = Book.objects.filter(id__in=book_ids)
-        return matching_books
-
-
-def _normalize_isbn(isbn):
-    return str(isbn).replace(" ", "").replace("-", "").replace("_", "").replace(".", "")
-
+                # Without Google Books, the few local matches will have to do.
+                if google_book_ids is not None:
+                    book_ids = google_book_ids
+        return book_ids
+
+    async def _search_google_books(self, **query) -> Optional[List[int]]:
+        """Add the Google Books matches to the catalog, return their IDs.
+
+        Returns None while Google Books is unavailable.
+        """
+        try:
+            google_books_data = await sync_to_async(
+                search_google_books, thread_sensitive=False
+            )(**query)
+        except UpstreamUnavailable:
+            return None
+        volumes = google_books_data.get("items")
+        if not volumes:
+            return []
 
-def _get_isbn_from_volume(volume):
-    """Prefer ISBN_13 over ISBN_10."""
-    identifier_objs = volume["volumeInfo"]["industryIdentifiers"]
-    for identifier_obj in identifier_objs:
-        if identifier_obj["type"] == "ISBN_13":
-            return identifier_obj["identifier"]
-    return identifier_objs[0]["identifier"] if len(identifier_objs) else None
+        books = await sync_to_async(ingest_volumes)(volumes)
+        await sync_to_async(enqueue_book_enrichment)(books)
+        return [book.id for book in books]
@@ -41,6 +41,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Compresses what the middleware below returns, so it has to come first.
+    # The CSRF token in pages is masked per response, which defeats BREACH.
+    "django.middleware.gzip.GZipMiddleware",
+    "books.middleware.HtmlMinifyMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -49,13 +53,15 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django_htmx.middleware.HtmxMiddleware",
+    "books.middleware.PerformanceMiddleware",
 ]
 
 ROOT_URLCONF = "booksread.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates, plus render times for books.middleware.
+        "BACKEND": "books.performance.TimedDjangoTemplates",
         "DIRS": [
             BASE_DIR / "templates",
         ],
@@ -84,6 +90,91 @@ DATABASES = {
     }
 }
 
+# High-concurrency SQLite profile: with WAL, readers no longer block on
+# writers, and BEGIN IMMEDIATE makes write transactions take the lock up
+# front instead of failing on lock upgrade.
+SQLITE_HIGH_CONCURRENCY = True
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64_000,  # Negative means KiB, so 64 MB.
+    "mmap_size": 256 * 1024 * 1024,  # Bytes.
+    "busy_timeout": 5000,  # Milliseconds.
+    "temp_store": "MEMORY",
+}
+
+# Optional read-only second connection to the same file, see
+# books.routers.ReadReplicaRouter. Needs SQLITE_HIGH_CONCURRENCY (WAL).
+SQLITE_READ_REPLICA = False
+
+if SQLITE_HIGH_CONCURRENCY:
+    DATABASES["default"]["OPTIONS"] = {
+        "init_command": ";".join(
+            f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+        ),
+        "transaction_mode": "IMMEDIATE",
+    }
+
+    if SQLITE_READ_REPLICA:
+        DATABASES["replica"] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": f"file:{DATABASES['default']['NAME']}?mode=ro",
+            "OPTIONS": {
+                # The journal mode is a property of the file, set by default.
+                "init_command": ";".join(
+                    f"PRAGMA {name}={value}"
+                    for name, value in SQLITE_PRAGMAS.items()
+                    if name != "journal_mode"
+                ),
+            },
+            "TEST": {
+                "MIRROR": "default",
+            },
+        }
+        DATABASE_ROUTERS = ["books.routers.ReadReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Switch to FileBasedCache or DatabaseCache to keep responses across
+    # restarts. MAX_ENTRIES bounds the size, least recently used go first.
+    "google_books": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "google-books",
+        "OPTIONS": {
+            "MAX_ENTRIES": 10_000,
+        },
+    },
+    # Rendered grid pages, see books.page_cache. With several processes this
+    # has to be a shared cache (e.g. Redis), or evictions only reach one.
+    "pages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "pages",
+        "OPTIONS": {
+            "MAX_ENTRIES": 5_000,
+        },
+    },
+    # Rate limit and circuit state of upstream APIs, see books.upstream. Has
+    # to be a shared cache (e.g. Redis) to limit all processes together.
+    "upstream": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "upstream",
+    },
+    # Book tiles, used by the {% cache %} tag. Keys contain modified_at.
+    "template_fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "template-fragments",
+        "OPTIONS": {
+            "MAX_ENTRIES": 50_000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -122,6 +213,30 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = "/static/"
+STATIC_ROOT = BASE_DIR / "staticfiles"
+STATIC_CACHE_MAX_AGE = 60 * 60 * 24 * 365  # Seconds, for fingerprinted files.
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        # Fingerprinted names (books.3f2a9c1b7e4d.css) after collectstatic, so
+        # the files can be cached forever. runserver serves the plain names.
+        "BACKEND": (
+            "django.contrib.staticfiles.storage.StaticFilesStorage"
+            if DEBUG
+            else "django.contrib.staticfiles.storage.ManifestStaticFilesStorage"
+        ),
+    },
+}
+
+MINIFY_HTML = not DEBUG  # See books.middleware.HtmlMinifyMiddleware.
+# Fraction of requests instrumented by books.middleware.PerformanceMiddleware.
+PERFORMANCE_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+
+MEDIA_ROOT = BASE_DIR / "media"
+MEDIA_URL = "/media/"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -130,9 +245,59 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "books.User"
 
+HTTP_POOL_CONNECTIONS = 10  # Hosts to keep connection pools for.
+HTTP_POOL_MAXSIZE = 32  # Keep-alive connections per host.
+
 GOOGLE_BOOKS_BASE_URL = "https://www.googleapis.com/books/v1/volumes"
 GOOGLE_BOOKS_MAX_RESULTS = 10
 GOOGLE_BOOKS_LANGUAGE_RESTRICT = None  # E.g. 'de', 'en'.
+GOOGLE_BOOKS_MAX_CONCURRENCY = 4  # Parallel requests of bulk lookups.
+GOOGLE_BOOKS_CACHE_ALIAS = "google_books"
+GOOGLE_BOOKS_CACHE_TIMEOUT = 60 * 60 * 24  # Seconds.
+GOOGLE_BOOKS_CACHE_NEGATIVE_TIMEOUT = 60 * 10  # Seconds, for empty results.
+# Rate limit, timeouts, retries and circuit breaker, see books.upstream.
+GOOGLE_BOOKS_STATE_CACHE_ALIAS = "upstream"
+GOOGLE_BOOKS_RATE_LIMIT = 5  # Requests per second, of all processes sharing it.
+GOOGLE_BOOKS_RATE_LIMIT_BURST = 10  # Requests above the rate after a quiet time.
+GOOGLE_BOOKS_RATE_LIMIT_WAIT = 2  # Seconds to wait for a turn before giving up.
+GOOGLE_BOOKS_CONNECT_TIMEOUT = 3.05  # Seconds.
+GOOGLE_BOOKS_READ_TIMEOUT = 5  # Seconds.
+GOOGLE_BOOKS_MAX_RETRIES = 2  # After errors, timeouts, 429 and 5xx responses.
+GOOGLE_BOOKS_RETRY_BACKOFF = 0.25  # Seconds, upper bound of the first jitter.
+GOOGLE_BOOKS_CIRCUIT_FAILURE_THRESHOLD = 5  # Failures within the reset timeout.
+GOOGLE_BOOKS_CIRCUIT_RESET_TIMEOUT = 30  # Seconds to fail fast once open.
+
+BOOKS_SEARCH_BACKEND = "books.search_index.SqliteFTS5SearchBackend"
+# Use "books.search_index.DatabaseSearchBackend" on databases without FTS5.
+LOCAL_SEARCH_MIN_RESULTS = 3  # Ask Google Books when there are fewer matches.
+
+OWNED_BOOKS_PAGE_SIZE = 48
+OWNED_BOOKS_EAGER_TILES = 8  # Covers on the first page not loaded lazily.
+OWNED_BOOKS_PAGE_CACHE_ALIAS = "pages"
+OWNED_BOOKS_PAGE_CACHE_TIMEOUT = 60 * 60  # Seconds, evicted on changes anyway.
+
+ISBN_LOOKUP_MAX_ISBNS = 500  # Per request to the batch lookup API.
+LIBRARY_IMPORT_BATCH_SIZE = 200  # CSV rows resolved and written at once.
+LIBRARY_EXPORT_CHUNK_SIZE = 2000  # Owned Books fetched (and prefetched) at once.
+
+ADMIN_COUNT_ESTIMATE_THRESHOLD = 100_000  # Rows, estimate larger changelists.
+ADMIN_COUNT_LIMIT = 10_000  # Rows counted at most in filtered changelists.
+
+ENRICHMENT_MAX_ATTEMPTS = 5
+ENRICHMENT_RETRY_BACKOFF = 30  # Seconds before the first retry, doubling after.
+ENRICHMENT_POLL_INTERVAL = 2  # Seconds, see the run_enrichment_worker command.
+ENRICHMENT_LEASE_TIMEOUT = 60 * 10  # Seconds until a running job is taken back.
+
+THUMBNAIL_PROBE_TIMEOUT = 5  # Seconds, per image request.
+THUMBNAIL_PROBE_CHUNK_SIZE = 1024  # Bytes.
+THUMBNAIL_PROBE_MAX_BYTES = 2_000_000  # Give up on headers larger than this.
+
+THUMBNAIL_MIRROR = True  # Serve covers from MEDIA_ROOT, see books.thumbnails.
+THUMBNAIL_MIRROR_MAX_BYTES = 5_000_000  # Larger covers are not mirrored.
+THUMBNAIL_WIDTHS = (160, 320)  # Pixels, of the WebP and JPEG derivatives.
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_PLACEHOLDER_WIDTH = 16  # Pixels, inlined into each tile as data URI.
+THUMBNAIL_CACHE_MAX_AGE = 60 * 60 * 24 * 365  # Seconds, names never change.
 
 LOGIN_URL = "login"
 LOGIN_REDIRECT_URL = "ownedbook-list"
@@ -15,6 +15,7 @@ Including another URLconf
 """
 
 from books import views as books_views
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 
@@ -45,6 +46,21 @@ urlpatterns = [
         books_views.add_owned_book,
         name="ownedbook-add",
     ),
+    path(
+        "books/lookup",
+        books_views.lookup_isbns,
+        name="book-lookup",
+    ),
+    path(
+        "books/import",
+        books_views.import_library,
+        name="ownedbook-import",
+    ),
+    path(
+        "books/export",
+        books_views.export_library,
+        name="ownedbook-export",
+    ),
     path(
         "books/<int:ownedbook_id>/remove",
         books_views.remove_owned_book,
@@ -65,6 +81,21 @@ urlpatterns = [
         books_views.toggle_read,
         name="ownedbook-toggleread",
     ),
+    path(
+        f"{settings.MEDIA_URL.strip('/')}/thumbnails/<path:path>",
+        books_views.thumbnail,
+        name="thumbnail",
+    ),
+    path(
+        f"{settings.STATIC_URL.strip('/')}/<path:path>",
+        books_views.static_file,
+        name="static-file",
+    ),
+    path(
+        "upstream/stats",
+        books_views.upstream_stats,
+        name="upstream-stats",
+    ),
     path(
         "search",
         books_views.Search.as_view(),